@@ -1,19 +1,82 @@
 import streamlit as st
-from database import (add_drug, get_all_drugs, update_drug, delete_drug,
-                      add_supplier, get_all_suppliers, update_supplier, delete_supplier,
-                      add_order, get_all_orders, update_inventory,
-                      get_low_stock_drugs, get_expiring_soon_drugs,
+from database import (add_drug, update_drug, delete_drug,
+                      add_supplier, update_supplier, delete_supplier,
+                      place_order, update_inventory,
+                      get_order_details, receive_orders, cancel_orders, ORDER_STATUSES,
+                      get_stock_levels, set_reorder_threshold,
+                      allocate_fefo, compact_ledger, get_ledger_summary, LEDGER_RETENTION_DAYS,
                       search_drugs, search_suppliers, search_orders,
-                      add_user, verify_user)
+                      get_drugs_page, get_suppliers_page, get_orders_page,
+                      count_drugs, count_suppliers, count_orders,
+                      cache_stats)
+from export import EXPORTS, EXPORT_FORMATS, export_to_tempfile
+from write_queue import submit_write, get_write_queue
+import instrumentation
+import session_data
+from auth import login, register, forwarded_client, LoginThrottled
+import math
+from datetime import date, datetime, timedelta
+import os
 import random
 import string
 
+PAGE_SIZES = [25, 50, 100, 250]
+MAX_DOWNLOAD_BYTES = 50 * 1024 * 1024  # Larger exports are left to the export.py command line
+
 # Function to generate a simple CAPTCHA text
 def generate_captcha():
     """Generates a random 6-character CAPTCHA string."""
     characters = string.ascii_letters + string.digits
     return ''.join(random.choice(characters) for _ in range(6))
 
+def search_page(search, search_term):
+    """Adapts a search function to the paged view, using the row offset as cursor."""
+    def fetch(cursor, page_size, sort, descending):
+        offset = cursor or 0
+        rows = search(search_term, limit=page_size + 1, offset=offset)
+        return rows[:page_size], (offset + page_size if len(rows) > page_size else None)
+    return fetch
+
+def paged_view(key, fetch, sort_options=None, total=None, signature='', empty_message="Nothing found."):
+    """Renders one page of a list view as a table and returns its rows.
+
+    fetch(cursor, page_size, sort, descending) must return (rows, next_cursor).
+    Only the visible page is loaded; cursors of earlier pages are kept in
+    session state so "Previous" can go back.
+    """
+    columns = st.columns(3)
+    sort, descending = None, False
+    if sort_options:
+        sort = sort_options[columns[0].selectbox("Sort by", list(sort_options), key=f"{key}_sort")]
+        descending = columns[1].selectbox("Order", ["Ascending", "Descending"], key=f"{key}_order") == "Descending"
+    page_size = columns[2].selectbox("Rows per page", PAGE_SIZES, key=f"{key}_page_size")
+
+    # Start again from the first page whenever the search or sort changes
+    view = (signature, sort, descending, page_size)
+    if st.session_state.get(f"{key}_view") != view:
+        st.session_state[f"{key}_view"] = view
+        st.session_state[f"{key}_cursors"] = [None]
+    cursors = st.session_state[f"{key}_cursors"]
+
+    rows, next_cursor = fetch(cursors[-1], page_size, sort, descending)
+    if rows:
+        st.dataframe([dict(row) for row in rows], hide_index=True, use_container_width=True)
+    else:
+        st.write(empty_message)
+
+    navigation = st.columns([1, 1, 3])
+    if navigation[0].button("Previous", key=f"{key}_previous", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+    if navigation[1].button("Next", key=f"{key}_next", disabled=next_cursor is None):
+        cursors.append(next_cursor)
+        st.rerun()
+    page_info = f"Page {len(cursors)}"
+    if total is not None:
+        page_info += f" of {max(1, math.ceil(total / page_size))} ({total} total)"
+    navigation[2].caption(page_info)
+    return rows
+
 # Initialize session state for authentication
 if 'logged_in' not in st.session_state:
     st.session_state['logged_in'] = False
@@ -29,7 +92,7 @@ def main_app():
 
     # Sidebar for navigation
     st.sidebar.title("Navigation")
-    page = st.sidebar.radio("Go to", ["Drugs", "Suppliers", "Orders", "Reports", "Logout"])
+    page = st.sidebar.radio("Go to", ["Drugs", "Suppliers", "Orders", "Reports", "Admin", "Logout"])
 
     if page == "Logout":
         st.session_state['logged_in'] = False
@@ -61,22 +124,39 @@ def main_app():
             submit = st.form_submit_button("Add Drug")
 
             if submit:
-                add_drug(name, batch_number, str(expiry_date), manufacturer, quantity, storage_conditions)
+                submit_write(add_drug, name, batch_number, str(expiry_date), manufacturer, quantity,
+                             storage_conditions).result()
                 st.success("Drug added successfully!")
 
+        # Dispense stock, taking the batches that expire first
+        with st.form("dispense_drug_form"):
+            st.subheader("Dispense Drug")
+            dispense_name = st.text_input("Drug Name", key="dispense_name")
+            dispense_quantity = st.number_input("Quantity", min_value=1, key="dispense_quantity")
+            if st.form_submit_button("Dispense"):
+                try:
+                    allocations = submit_write(allocate_fefo, dispense_name, dispense_quantity).result()
+                    st.success(f"Dispensed {dispense_quantity} of {dispense_name}.")
+                    st.dataframe(allocations, hide_index=True)
+                except ValueError as e:
+                    st.error(str(e))
+
         # Search and display drugs
         st.subheader("All Drugs")
-        search_term = st.text_input("Search Drugs by Name", key="search_drugs")
+        search_term = st.text_input("Search Drugs by Name, Manufacturer or Batch", key="search_drugs")
         if search_term:
-            drugs = search_drugs(search_term)
+            drugs = paged_view("drugs", search_page(search_drugs, search_term),
+                               signature=search_term, empty_message="No drugs found.")
         else:
-            drugs = get_all_drugs()
-        if not drugs:
-            st.write("No drugs found.")
-        for drug in drugs:
-            st.write(f"**{drug['name']}** (Batch: {drug['batch_number']}, Expiry: {drug['expiry_date']}, Qty: {drug['quantity']})")
-            if st.button(f"Delete {drug['name']}", key=f"delete_drug_{drug['drug_id']}"):
-                delete_drug(drug['drug_id'])
+            drugs = paged_view("drugs", get_drugs_page,
+                               {"ID": "drug_id", "Name": "name", "Expiry Date": "expiry_date", "Quantity": "quantity"},
+                               total=count_drugs(), empty_message="No drugs found.")
+        if drugs:
+            labels = {drug['drug_id']: f"{drug['name']} (Batch: {drug['batch_number']})" for drug in drugs}
+            drug_id = st.selectbox("Drug to delete (from this page)", list(labels), format_func=labels.get,
+                                   key="delete_drug_choice")
+            if st.button("Delete Drug", key="delete_drug_button"):
+                submit_write(delete_drug, drug_id).result()
                 st.rerun()
         if search_term and st.button("Clear Search", key="clear_search_drugs_button"):
             st.session_state['clear_search_drugs'] = True
@@ -104,22 +184,24 @@ def main_app():
             submit = st.form_submit_button("Add Supplier")
 
             if submit:
-                add_supplier(name, contact_info, address)
+                submit_write(add_supplier, name, contact_info, address).result()
                 st.success("Supplier added successfully!")
 
         # Search and display suppliers
         st.subheader("All Suppliers")
-        search_term = st.text_input("Search Suppliers by Name", key="search_suppliers")
+        search_term = st.text_input("Search Suppliers by Name, Contact or Address", key="search_suppliers")
         if search_term:
-            suppliers = search_suppliers(search_term)
+            suppliers = paged_view("suppliers", search_page(search_suppliers, search_term),
+                                   signature=search_term, empty_message="No suppliers found.")
         else:
-            suppliers = get_all_suppliers()
-        if not suppliers:
-            st.write("No suppliers found.")
-        for supplier in suppliers:
-            st.write(f"**{supplier['name']}** (Contact: {supplier['contact_info']})")
-            if st.button(f"Delete {supplier['name']}", key=f"delete_supplier_{supplier['supplier_id']}"):
-                delete_supplier(supplier['supplier_id'])
+            suppliers = paged_view("suppliers", get_suppliers_page, {"ID": "supplier_id", "Name": "name"},
+                                   total=count_suppliers(), empty_message="No suppliers found.")
+        if suppliers:
+            labels = {supplier['supplier_id']: supplier['name'] for supplier in suppliers}
+            supplier_id = st.selectbox("Supplier to delete (from this page)", list(labels), format_func=labels.get,
+                                       key="delete_supplier_choice")
+            if st.button("Delete Supplier", key="delete_supplier_button"):
+                submit_write(delete_supplier, supplier_id).result()
                 st.rerun()
         if search_term and st.button("Clear Search", key="clear_search_suppliers_button"):
             st.session_state['clear_search_suppliers'] = True
@@ -141,38 +223,62 @@ def main_app():
         # Form to place a new order
         with st.form("add_order_form"):
             st.subheader("Place New Order")
-            suppliers = get_all_suppliers()
-            supplier_options = {supplier['name']: supplier['supplier_id'] for supplier in suppliers}
-            selected_supplier = st.selectbox("Select Supplier", list(supplier_options.keys()))
-            status = st.selectbox("Status", ["Pending", "Received"])
-
-            # Select drugs and quantities
-            drugs = get_all_drugs()
-            selected_drugs = st.multiselect("Select Drugs", [drug['name'] for drug in drugs])
+            suppliers = session_data.supplier_index()
+            supplier_options = suppliers.ids
+            selected_supplier = st.selectbox("Select Supplier", suppliers.names)
+            status = st.selectbox("Status", ORDER_STATUSES[:2])
+
+            # Select drugs and quantities (each name maps to its first batch)
+            drugs = session_data.drug_index()
+            drug_ids = drugs.ids
+            selected_drugs = st.multiselect("Select Drugs", drugs.names)
             quantities = {}
             for drug_name in selected_drugs:
-                drug_id = next(drug['drug_id'] for drug in drugs if drug['name'] == drug_name)
-                quantities[drug_name] = st.number_input(f"Quantity for {drug_name}", min_value=1, key=f"qty_{drug_id}")
+                quantities[drug_name] = st.number_input(f"Quantity for {drug_name}", min_value=1,
+                                                        key=f"qty_{drug_ids[drug_name]}")
 
             submit = st.form_submit_button("Place Order")
 
             if submit:
-                items = [{'drug_id': next(drug['drug_id'] for drug in drugs if drug['name'] == drug_name), 
-                          'quantity': quantities[drug_name]} for drug_name in selected_drugs]
-                add_order(supplier_options[selected_supplier], status, items)
-                st.success("Order placed successfully!")
+                items = [{'drug_id': drug_ids[drug_name], 'quantity': quantities[drug_name]}
+                         for drug_name in selected_drugs]
+                try:
+                    submit_write(place_order, supplier_options[selected_supplier], status, items).result()
+                    st.success("Order placed successfully!")
+                except ValueError as e:
+                    st.error(str(e))
 
         # Search and display orders
         st.subheader("All Orders")
         search_term = st.text_input("Search Orders by ID or Supplier Name", key="search_orders")
         if search_term:
-            orders = search_orders(search_term)
+            orders = paged_view("orders", search_page(search_orders, search_term),
+                                signature=search_term, empty_message="No orders found.")
         else:
-            orders = get_all_orders()
-        if not orders:
-            st.write("No orders found.")
-        for order in orders:
-            st.write(f"Order ID: {order['order_id']}, Date: {order['order_date']}, Supplier: {order['supplier_name']}, Status: {order['status']}")
+            orders = paged_view("orders", get_orders_page, {"ID": "order_id", "Order Date": "order_date"},
+                                total=count_orders(), empty_message="No orders found.")
+        if orders:
+            # Items of every order on this page, in one query
+            details = get_order_details(tuple(order['order_id'] for order in orders))
+            with st.expander("Items of the orders on this page"):
+                st.dataframe([dict(item) for order in orders for item in details[order['order_id']]],
+                             hide_index=True, use_container_width=True)
+
+            # Receive or cancel Pending orders; receiving adds their items to stock,
+            # and either gives back stock the order reserved
+            pending = [order['order_id'] for order in orders if order['status'] == 'Pending']
+            if pending:
+                selected = st.multiselect("Pending orders (from this page)", pending, key="pending_orders_choice")
+                actions = st.columns(2)
+                try:
+                    if actions[0].button("Mark Received", key="receive_orders_button", disabled=not selected):
+                        submit_write(receive_orders, selected).result()
+                        st.rerun()
+                    if actions[1].button("Cancel Orders", key="cancel_orders_button", disabled=not selected):
+                        submit_write(cancel_orders, selected).result()
+                        st.rerun()
+                except ValueError as e:
+                    st.error(str(e))
         if search_term and st.button("Clear Search", key="clear_search_orders_button"):
             st.session_state['clear_search_orders'] = True
             st.rerun()
@@ -181,17 +287,131 @@ def main_app():
     elif page == "Reports":
         st.header("Reports")
 
-        # Low stock drugs
-        st.subheader("Low Stock Drugs")
-        low_stock = get_low_stock_drugs()
-        for drug in low_stock:
-            st.write(f"**{drug['name']}** (Qty: {drug['quantity']})")
+        # Stock and order reports, computed together by the report engine
+        today = date.today()
+        period = st.date_input("Order reports period", (today.replace(day=1), today), key="report_period")
+        since, until = (period[0], period[-1]) if period else (None, None)
+        frames = session_data.report_frames(str(since) if since else None, str(until) if until else None)
+
+        # Products to reorder: read from the precomputed Stock_Levels table
+        st.subheader("Reorder Report")
+        if len(frames['low_stock']):
+            st.dataframe(frames['low_stock'], hide_index=True, use_container_width=True)
+        else:
+            st.write("All products are above their reorder threshold.")
+
+        # Per-product reorder thresholds
+        with st.form("reorder_threshold_form"):
+            st.subheader("Set Reorder Threshold")
+            products = {(product['name'], product['manufacturer']): product['reorder_threshold']
+                        for product in get_stock_levels()}
+            product = st.selectbox("Product", list(products), format_func=lambda key: f"{key[0]} ({key[1]})")
+            threshold = st.number_input("Reorder when stock plus pending orders falls below", min_value=0,
+                                        value=products.get(product, 10) if product else 10)
+            if st.form_submit_button("Save Threshold") and product:
+                submit_write(set_reorder_threshold, product[0], product[1], threshold).result()
+                st.rerun()
 
-        # Expiring soon drugs
         st.subheader("Drugs Expiring Soon")
-        expiring_soon = get_expiring_soon_drugs()
-        for drug in expiring_soon:
-            st.write(f"**{drug['name']}** (Expiry: {drug['expiry_date']})")
+        st.dataframe(frames['expiry_buckets'], hide_index=True)
+        st.dataframe(frames['expiring_soon'], hide_index=True, use_container_width=True)
+
+        st.subheader("Supplier Order Volume")
+        st.dataframe(frames['supplier_volume'], hide_index=True, use_container_width=True)
+
+        st.subheader("Daily Order Throughput")
+        daily = frames['daily_throughput']
+        if len(daily):
+            st.bar_chart(daily, x="order_date", y="units")
+        st.dataframe(daily, hide_index=True, use_container_width=True)
+
+        # Export data to a file (streamed to disk, then offered for download)
+        st.subheader("Export Data")
+        columns = st.columns(2)
+        dataset = columns[0].selectbox("Dataset", list(EXPORTS), format_func=str.title, key="export_dataset")
+        fmt = columns[1].selectbox("Format", list(EXPORT_FORMATS), format_func=str.upper, key="export_format")
+        if st.button("Prepare Export"):
+            path = export_to_tempfile(dataset, fmt)
+            try:
+                file_name = dataset + EXPORT_FORMATS[fmt]
+                size = os.path.getsize(path)
+                if size > MAX_DOWNLOAD_BYTES:
+                    st.warning(f"This export is {size / 2**20:.0f} MB, more than the {MAX_DOWNLOAD_BYTES // 2**20} MB "
+                               f"that can be downloaded here. Run `python export.py {dataset} --format {fmt}` "
+                               "on the server instead.")
+                else:
+                    # Streamlit holds download data in memory, so the button is only
+                    # offered in this run; the next rerun lets it go
+                    with open(path, 'rb') as f:
+                        st.download_button(f"Download {file_name}", f.read(), file_name=file_name)
+            finally:
+                os.remove(path)
+
+    # Admin Section: where the time goes in the database layer
+    elif page == "Admin":
+        st.header("Database Performance")
+        metrics = instrumentation.snapshot()
+
+        columns = st.columns(2)
+        instrumentation.SLOW_QUERY_MS = columns[0].number_input(
+            "Log queries slower than (ms)", min_value=0.0, value=float(instrumentation.SLOW_QUERY_MS), step=10.0)
+        if columns[1].button("Reset Statistics"):
+            instrumentation.reset()
+            st.rerun()
+
+        st.subheader("Database Functions")
+        st.dataframe([dict(function=name, **stats) for name, stats in metrics['functions'].items()],
+                     hide_index=True, use_container_width=True)
+
+        st.subheader("SQL Statements")
+        st.dataframe([dict(statement=name, **stats) for name, stats in metrics['queries'].items()],
+                     hide_index=True, use_container_width=True)
+
+        st.subheader("Slow Queries")
+        if not metrics['slow_queries']:
+            st.write("No queries slower than the threshold yet.")
+        for query in reversed(metrics['slow_queries']):
+            with st.expander(f"{query['ms']:.1f} ms, {query['rows']} rows at {query['at']}: {query['sql'][:80]}"):
+                st.code(query['sql'], language="sql")
+                st.code(query['plan'], language="text")
+
+        st.subheader("Connections, Cache and Write Queue")
+        columns = st.columns(3)
+        columns[0].dataframe([dict(event=name, **stats) for name, stats in metrics['connections'].items()],
+                             hide_index=True)
+        cache = cache_stats()
+        columns[1].dataframe([{"statistic": name, "value": value} for name, value in cache.items()], hide_index=True)
+        writes = get_write_queue().stats()
+        columns[2].dataframe([{"statistic": name, "value": value} for name, value in writes.items()], hide_index=True)
+
+        gauges = {f"cache_{name}": value for name, value in cache.items()}
+        gauges.update((f"write_queue_{name}", value) for name, value in writes.items())
+        st.download_button("Download Prometheus Metrics", instrumentation.prometheus_text(gauges),
+                           file_name="metrics.prom", mime="text/plain")
+
+        # Fold old ledger movements into per-drug balances (also run nightly by compact_ledger.py).
+        # Every user can reach this page, so the audit trail's retention window can only be lengthened here.
+        st.subheader("Inventory Ledger")
+        with st.form("compact_ledger_form"):
+            keep_days = st.number_input("Keep movements from the last (days)", min_value=LEDGER_RETENTION_DAYS,
+                                        value=LEDGER_RETENTION_DAYS)
+            confirmed = st.checkbox("I understand that older movements are permanently replaced by balances")
+            if st.form_submit_button("Compact Ledger"):
+                if not confirmed:
+                    st.error("Please confirm the compaction first.")
+                else:
+                    before = (datetime.now() - timedelta(days=keep_days)).strftime('%Y-%m-%d %H:%M:%S')
+                    removed = submit_write(compact_ledger, before).result()
+                    st.success(f"Folded {removed} ledger entries older than {before} into balances.")
+        ledger = get_ledger_summary()
+        columns = st.columns(3)
+        columns[0].metric("Ledger entries", ledger['entries'])
+        columns[1].metric("Oldest entry", ledger['oldest_entry'] or "-")
+        columns[2].metric("Compacted before", ledger['compacted_before'] or "-")
+
+def client_address():
+    """Returns the address the request came from, as recorded by our reverse proxy, or None."""
+    return forwarded_client(st.context.headers.get_all("X-Forwarded-For"))
 
 # Login Page
 def login_page():
@@ -203,12 +423,15 @@ def login_page():
         submit = st.form_submit_button("Login")
 
         if submit:
-            if verify_user(username, password):
-                st.session_state['logged_in'] = True
-                st.session_state['page'] = 'main'
-                st.rerun()
-            else:
-                st.error("Invalid username or password.")
+            try:
+                if login(username, password, client_address()):
+                    st.session_state['logged_in'] = True
+                    st.session_state['page'] = 'main'
+                    st.rerun()
+                else:
+                    st.error("Invalid username or password.")
+            except LoginThrottled as e:
+                st.error(f"{e} Please try again in {math.ceil(e.retry_after)} seconds.")
 
     if st.button("Go to Signup"):
         st.session_state['page'] = 'signup'
@@ -232,14 +455,18 @@ def signup_page():
             if captcha_input != st.session_state['captcha_text']:
                 st.error("CAPTCHA validation failed. Please try again.")
                 st.session_state['captcha_text'] = generate_captcha()  # Regenerate CAPTCHA
-            elif add_user(username, password):
-                st.success("Signup successful! Please login.")
-                st.session_state['page'] = 'login'
-                st.session_state['captcha_text'] = generate_captcha()
-                st.rerun()
             else:
-                st.error("Username already exists. Please choose a different username.")
-                st.session_state['captcha_text'] = generate_captcha()
+                try:
+                    if register(username, password):
+                        st.success("Signup successful! Please login.")
+                        st.session_state['page'] = 'login'
+                        st.session_state['captcha_text'] = generate_captcha()
+                        st.rerun()
+                    else:
+                        st.error("Username already exists. Please choose a different username.")
+                        st.session_state['captcha_text'] = generate_captcha()
+                except LoginThrottled as e:
+                    st.error(f"{e} Please try again in {math.ceil(e.retry_after)} seconds.")
 
     if st.button("Go to Login"):
         st.session_state['page'] = 'login'
@@ -0,0 +1,182 @@
+"""Login and signup for app.py: bounded password hashing and attempt throttling.
+
+Password hashes are deliberately slow (see database.hash_password), so they
+run on a small pool of HASH_WORKERS threads. A login storm then queues for
+the pool instead of starving every Streamlit script thread of CPU, and
+once MAX_PENDING_HASHES are waiting, further attempts are turned away.
+
+Every login attempt takes a token from the bucket of its username and of
+its client address. A successful login gives the tokens back, so only
+failures use up the allowance. A correct password also fills a small cache
+that lets the same user log in again without rehashing, for as long as
+their stored hash stays the same.
+
+Streamlit does not tell the app the address of the connection, so the
+client address can only come from the X-Forwarded-For entry added by a
+reverse proxy (see forwarded_client()). Behind one, set
+DRUG_INVENTORY_TRUSTED_PROXIES to the number of proxies in front of the
+app. It defaults to 0, since without a proxy the header is whatever the
+client sent. Attempts whose address is unknown all share one bucket, so a
+flood of failures is still throttled as a whole.
+"""
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+
+HASH_WORKERS = min(4, os.cpu_count() or 1)  # Password hashes computed at once
+MAX_PENDING_HASHES = 64                      # Attempts allowed to wait for a hash worker
+
+# Token buckets: (burst of attempts, seconds to earn one more attempt)
+USER_ATTEMPTS = (5, 60)      # Per username: 5 quick failures, then one a minute
+CLIENT_ATTEMPTS = (30, 2)    # Per client address: generous, since a ward may share one
+UNIDENTIFIED_ATTEMPTS = (60, 1)  # Shared by every attempt whose client address is unknown
+MAX_TRACKED_KEYS = 10000     # Buckets that are full again are forgotten beyond this
+
+VERIFIED_CACHE_SIZE = 1024   # Recent successful logins remembered
+VERIFIED_CACHE_TTL = 900     # Seconds a remembered login may skip the hash
+
+# Reverse proxies in front of the app that append to X-Forwarded-For; 0 ignores the header
+TRUSTED_PROXIES = int(os.environ.get('DRUG_INVENTORY_TRUSTED_PROXIES', 0))
+
+class LoginThrottled(Exception):
+    """Raised when a login is refused without checking the password."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class TokenBuckets:
+    """One token bucket per key, held in memory."""
+
+    def __init__(self, capacity, refill_seconds):
+        self.capacity = capacity
+        self.refill_seconds = refill_seconds
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _tokens(self, key, now):
+        tokens, updated = self._buckets.get(key, (self.capacity, now))
+        return min(self.capacity, tokens + (now - updated) / self.refill_seconds)
+
+    def take(self, key):
+        """Takes a token for key. Returns 0 on success, else seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens = self._tokens(key, now)
+            if tokens < 1:
+                return (1 - tokens) * self.refill_seconds
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > MAX_TRACKED_KEYS:
+                self._prune(now)
+        return 0
+
+    def give_back(self, key):
+        """Returns a token taken by take()."""
+        now = time.monotonic()
+        with self._lock:
+            self._buckets[key] = (min(self.capacity, self._tokens(key, now) + 1), now)
+
+    def _prune(self, now):
+        for key in [key for key in self._buckets if self._tokens(key, now) >= self.capacity]:
+            del self._buckets[key]
+
+_user_buckets = TokenBuckets(*USER_ATTEMPTS)
+_client_buckets = TokenBuckets(*CLIENT_ATTEMPTS)
+_unidentified_buckets = TokenBuckets(*UNIDENTIFIED_ATTEMPTS)
+
+def forwarded_client(forwarded_for, trusted_proxies=None):
+    """Returns the client address in X-Forwarded-For header values, or None.
+
+    Every proxy appends the address it received the request from, so only
+    the last trusted_proxies entries (default TRUSTED_PROXIES) were written
+    by our own proxies; anything before them came from the client and is
+    ignored. The first of the trusted entries is the client's address.
+    """
+    if trusted_proxies is None:
+        trusted_proxies = TRUSTED_PROXIES
+    addresses = [address.strip() for value in forwarded_for for address in value.split(',') if address.strip()]
+    if trusted_proxies < 1 or not addresses:
+        return None
+    return addresses[-min(trusted_proxies, len(addresses))]
+
+_hash_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='password-hash')
+_pending_hashes = threading.BoundedSemaphore(MAX_PENDING_HASHES)
+
+def _hash_in_pool(func, *args):
+    """Runs a hashing function on the worker pool and waits for its result."""
+    if not _pending_hashes.acquire(blocking=False):
+        raise LoginThrottled('The server is busy with other logins.', retry_after=1)
+    try:
+        return _hash_pool.submit(func, *args).result()
+    finally:
+        _pending_hashes.release()
+
+# Successful logins: HMAC of (username, password) under a per-process key -> (stored hash, expiry)
+_verified = OrderedDict()
+_verified_lock = threading.Lock()
+_verified_key = os.urandom(32)
+
+def _credential_key(username, password):
+    return hmac.new(_verified_key, f'{username}\0{password}'.encode(), hashlib.sha256).digest()
+
+def _recently_verified(key, password_hash):
+    with _verified_lock:
+        entry = _verified.get(key)
+        if entry is None or entry[0] != password_hash or entry[1] < time.monotonic():
+            return False
+        _verified.move_to_end(key)
+        return True
+
+def _remember_verified(key, password_hash):
+    with _verified_lock:
+        _verified[key] = (password_hash, time.monotonic() + VERIFIED_CACHE_TTL)
+        _verified.move_to_end(key)
+        while len(_verified) > VERIFIED_CACHE_SIZE:
+            _verified.popitem(last=False)
+
+def login(username, password, client=None):
+    """Checks a username and password. Returns True or False.
+
+    client identifies where the attempt comes from (e.g. its IP address);
+    attempts without one share a single bucket. Raises LoginThrottled when
+    the user or client has failed too often recently, or too many logins
+    are already waiting for a hash worker.
+    """
+    buckets = [(_user_buckets, username),
+               (_client_buckets, client) if client else (_unidentified_buckets, None)]
+    taken = []
+    for bucket, key in buckets:
+        retry_after = bucket.take(key)
+        if retry_after:
+            for taken_bucket, taken_key in taken:
+                taken_bucket.give_back(taken_key)
+            raise LoginThrottled('Too many failed login attempts.', retry_after)
+        taken.append((bucket, key))
+
+    # Cheap path: the stored hash is one indexed lookup by username
+    credential = _credential_key(username, password)
+    password_hash = database.get_password_hash(username)
+    verified = password_hash is not None and _recently_verified(credential, password_hash)
+    if not verified:
+        try:
+            verified = _hash_in_pool(database.verify_user, username, password)
+        except LoginThrottled:
+            for bucket, key in buckets:
+                bucket.give_back(key)  # Turned away for load, not for a wrong password
+            raise
+        if verified:
+            _remember_verified(credential, database.get_password_hash(username))  # Possibly just rehashed
+    if verified:
+        for bucket, key in buckets:
+            bucket.give_back(key)
+    return verified
+
+def register(username, password):
+    """Creates a user, hashing the password on the worker pool. Returns False if the name is taken."""
+    return _hash_in_pool(database.add_user, username, password)
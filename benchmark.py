@@ -0,0 +1,396 @@
+"""Benchmarks for the public functions of database.py on synthetic data.
+
+Each scale generates a fresh database in a temporary directory with
+realistic drugs (several batches per product), suppliers, orders and order
+items, then times every benchmark in BENCHMARKS against it. Results give
+p50/p95 latency, throughput and the peak memory allocated by one call, and
+can be saved as JSON and compared with an earlier run.
+
+Usage:
+    python benchmark.py --scales small medium --output results.json
+    python benchmark.py --scales medium --compare baseline.json --threshold 0.2
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+import bulk_import
+import database
+import drug_snapshot
+from write_queue import submit_write
+
+# Dataset sizes: distinct products, batches per product, suppliers, orders, items per order
+SCALES = {
+    'small': {'products': 200, 'batches': 5, 'suppliers': 50, 'orders': 2000, 'items': 3},
+    'medium': {'products': 2000, 'batches': 5, 'suppliers': 200, 'orders': 20000, 'items': 3},
+    'large': {'products': 20000, 'batches': 5, 'suppliers': 1000, 'orders': 200000, 'items': 3},
+}
+
+ITERATIONS = 50
+USERS = 20
+USER_PASSWORD = 'benchmark-password'
+
+MANUFACTURERS = ('Bayer', 'Pfizer', 'Novartis', 'Sanofi', 'Roche', 'Teva', 'Cipla', 'Sandoz', 'Mylan', 'Lupin')
+STORAGE_CONDITIONS = ('Room temperature', 'Refrigerate 2-8C', 'Keep dry', 'Protect from light', '')
+NAME_PARTS = ('ab', 'ac', 'al', 'am', 'an', 'ar', 'ce', 'ci', 'do', 'fen', 'lo', 'mi', 'na', 'ol',
+              'pra', 'ri', 'sta', 'te', 'tin', 'to', 'va', 'xa', 'zo', 'zol')
+NAME_ENDINGS = ('cillin', 'profen', 'statin', 'pril', 'sartan', 'mab', 'olol', 'azole', 'mycin', 'dine')
+
+# Data generation
+def product_names(count, rng):
+    """Returns count distinct, pronounceable drug names."""
+    names = set()
+    while len(names) < count:
+        parts = rng.sample(NAME_PARTS, rng.randint(1, 3))
+        names.add((''.join(parts) + rng.choice(NAME_ENDINGS)).capitalize())
+    return sorted(names)
+
+def generate_rows(scale, rng):
+    """Yields (kind, rows) for every table of a dataset, in the order they must be loaded.
+
+    IDs are assigned explicitly so benchmarks can pick existing rows at random.
+    """
+    today = date.today()
+    products = [(name, rng.choice(MANUFACTURERS)) for name in product_names(scale['products'], rng)]
+
+    def drugs():
+        drug_id = 0
+        for name, manufacturer in products:
+            for batch in range(scale['batches']):
+                drug_id += 1
+                # A few batches are already expired and some are out of stock
+                expiry = today + timedelta(days=rng.randint(-60, 720))
+                yield drug_id, {'drug_id': drug_id, 'name': name, 'batch_number': f'{name[:3].upper()}-{batch:04d}',
+                                'expiry_date': expiry.isoformat(), 'manufacturer': manufacturer,
+                                'quantity': rng.choice((0, rng.randint(1, 20), rng.randint(20, 500))),
+                                'storage_conditions': rng.choice(STORAGE_CONDITIONS)}
+
+    def suppliers():
+        for supplier_id in range(1, scale['suppliers'] + 1):
+            yield supplier_id, {'supplier_id': supplier_id, 'name': f'{rng.choice(MANUFACTURERS)} Distribution {supplier_id}',
+                                'contact_info': f'orders{supplier_id}@example.com',
+                                'address': f'{rng.randint(1, 999)} Harbour Road, Unit {supplier_id}'}
+
+    def orders():
+        for order_id in range(1, scale['orders'] + 1):
+            order_date = today - timedelta(days=rng.randint(0, 730))
+            yield order_id, {'order_id': order_id, 'order_date': order_date.isoformat(),
+                             'supplier_id': rng.randint(1, scale['suppliers']),
+                             'status': 'Pending' if rng.random() < 0.2 else 'Received'}
+
+    drug_count = scale['products'] * scale['batches']
+
+    def order_items():
+        line = 0
+        for order_id in range(1, scale['orders'] + 1):
+            for _ in range(rng.randint(1, 2 * scale['items'] - 1)):
+                line += 1
+                yield line, {'order_id': order_id, 'drug_id': rng.randint(1, drug_count),
+                             'quantity': rng.randint(1, 100)}
+
+    yield 'drugs', drugs()
+    yield 'suppliers', suppliers()
+    yield 'orders', orders()
+    yield 'order_items', order_items()
+
+def generate_dataset(path, scale, seed=0):
+    """Creates a database at path filled with a synthetic dataset and returns its row counts.
+
+    Points the database module at the new file.
+    """
+    rng = random.Random(seed)
+    database.configure(db_path=path)
+    counts = {}
+    for kind, rows in generate_rows(scale, rng):
+        summary = bulk_import.import_rows(kind, rows)
+        if summary['rejected']:
+            raise RuntimeError(f'Generated {kind} rows were rejected: {summary["errors"][:3]}')
+        counts[kind] = summary['inserted']
+    for i in range(USERS):
+        database.add_user(f'user{i}', USER_PASSWORD)
+    counts['users'] = USERS
+    with database.get_db_connection() as conn:
+        conn.execute('ANALYZE')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')  # So the file size below includes everything
+    return counts
+
+# Benchmarks
+class Context:
+    """What a benchmark needs to pick realistic arguments: a seeded RNG and the dataset shape."""
+
+    def __init__(self, scale, counts, seed=0):
+        self.rng = random.Random(seed)
+        self.drug_count = counts['drugs']
+        self.supplier_count = counts['suppliers']
+        self.order_count = counts['orders']
+        self.products = product_names(scale['products'], random.Random(seed))
+        self.deleted_drugs = 0
+        self.deleted_suppliers = 0
+        self.placed_orders = []  # Pending orders placed by the benchmarks, for cancel_orders
+
+    def drug_id(self):
+        return self.rng.randint(1, self.drug_count)
+
+    def supplier_id(self):
+        return self.rng.randint(1, self.supplier_count)
+
+    def order_ids(self, count):
+        return self.rng.sample(range(1, self.order_count + 1), min(count, self.order_count))
+
+    def product(self):
+        return self.rng.choice(self.products)
+
+    def prefix(self):
+        return self.product()[:3]
+
+    def items(self):
+        return [{'drug_id': self.drug_id(), 'quantity': self.rng.randint(1, 50)}
+                for _ in range(self.rng.randint(1, 5))]
+
+    def new_drug(self):
+        return (self.product(), f'BENCH-{self.rng.randrange(10 ** 6):06d}',
+                (date.today() + timedelta(days=self.rng.randint(1, 720))).isoformat(),
+                self.rng.choice(MANUFACTURERS), self.rng.randint(1, 500), '')
+
+def update_drug(ctx):
+    """Reads a batch and saves it back with one more unit, as the edit form would."""
+    with database.get_db_connection() as conn:
+        drug = conn.execute('SELECT * FROM Drugs WHERE drug_id = ?', (ctx.drug_id(),)).fetchone()
+    if drug:
+        database.update_drug(drug['drug_id'], drug['name'], drug['batch_number'], drug['expiry_date'],
+                             drug['manufacturer'], drug['quantity'] + 1, drug['storage_conditions'])
+
+def update_supplier(ctx):
+    """Reads a supplier and saves it back with a new address, as the edit form would."""
+    with database.get_db_connection() as conn:
+        supplier = conn.execute('SELECT * FROM Suppliers WHERE supplier_id = ?', (ctx.supplier_id(),)).fetchone()
+    if supplier:
+        database.update_supplier(supplier['supplier_id'], supplier['name'], supplier['contact_info'],
+                                 f'{ctx.rng.randint(1, 999)} Harbour Road')
+
+def cancel_orders(ctx):
+    """Cancels an order placed by an earlier benchmark (placing one first, timed, if none are left)."""
+    if not ctx.placed_orders:
+        ctx.placed_orders.append(database.place_order(ctx.supplier_id(), 'Pending', ctx.items()))
+    database.cancel_orders([ctx.placed_orders.pop()])
+
+def delete_drug(ctx):
+    """Deletes the generated batch with the highest remaining ID."""
+    database.delete_drug(ctx.drug_count - ctx.deleted_drugs)
+    ctx.deleted_drugs += 1
+
+def delete_supplier(ctx):
+    """Deletes the generated supplier with the highest remaining ID."""
+    database.delete_supplier(ctx.supplier_count - ctx.deleted_suppliers)
+    ctx.deleted_suppliers += 1
+
+# Name -> function(ctx) timed once per iteration. Writes change the dataset as they go,
+# so they run after every read, and deletes run last.
+BENCHMARKS = {
+    # Reads
+    'get_all_drugs': lambda ctx: database.get_all_drugs(),
+    'get_drugs_page': lambda ctx: database.get_drugs_page(after=(ctx.drug_id(), ctx.drug_id()), page_size=50),
+    'get_drugs_page_by_name': lambda ctx: database.get_drugs_page(after=(ctx.product(), 0), page_size=50, sort='name'),
+    'count_drugs': lambda ctx: database.count_drugs(),
+    'get_drug_names': lambda ctx: database.get_drug_names(),
+    'search_drugs': lambda ctx: database.search_drugs(ctx.prefix(), limit=50),
+    'get_all_suppliers': lambda ctx: database.get_all_suppliers(),
+    'get_suppliers_page': lambda ctx: database.get_suppliers_page(page_size=50),
+    'count_suppliers': lambda ctx: database.count_suppliers(),
+    'get_supplier_names': lambda ctx: database.get_supplier_names(),
+    'search_suppliers': lambda ctx: database.search_suppliers(ctx.rng.choice(MANUFACTURERS), limit=50),
+    'get_all_orders': lambda ctx: database.get_all_orders(),
+    'get_orders_page': lambda ctx: database.get_orders_page(after=(ctx.rng.randint(1, ctx.order_count),) * 2,
+                                                            page_size=50),
+    'count_orders': lambda ctx: database.count_orders(),
+    'search_orders_by_id': lambda ctx: database.search_orders(str(ctx.rng.randint(1, ctx.order_count))),
+    'search_orders_by_supplier': lambda ctx: database.search_orders(ctx.rng.choice(MANUFACTURERS), limit=50),
+    'get_order_details': lambda ctx: database.get_order_details(tuple(ctx.order_ids(50))),
+    'resolve_drug_ids': lambda ctx: database.resolve_drug_ids(ctx.rng.sample(ctx.products, min(100, len(ctx.products)))),
+    'get_ledger': lambda ctx: database.get_ledger(ctx.drug_id()),
+    'get_stock_at': lambda ctx: database.get_stock_at(ctx.drug_id(), datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
+    'get_ledger_summary': lambda ctx: database.get_ledger_summary(),
+    'get_expiry_buckets': lambda ctx: database.get_expiry_buckets(),
+    'get_stock_levels': lambda ctx: database.get_stock_levels(),
+    'get_reorder_report': lambda ctx: database.get_reorder_report(),
+    'get_low_stock_drugs': lambda ctx: database.get_low_stock_drugs(),
+    'get_expiring_soon_drugs': lambda ctx: database.get_expiring_soon_drugs(),
+    # The in-memory snapshot, refreshed from Drugs_Changes by whichever query follows a write
+    'snapshot_low_stock': lambda ctx: drug_snapshot.get_snapshot().low_stock(),
+    'snapshot_expiring': lambda ctx: drug_snapshot.get_snapshot().expiring(),
+    'snapshot_name_prefix': lambda ctx: drug_snapshot.get_snapshot().find(name_prefix=ctx.prefix(), limit=50),
+    # Generated batches have versions 1..drug_count, so these read every batch and the last 100 changed
+    'get_drug_changes': lambda ctx: database.get_drug_changes(),
+    'get_drug_changes_since': lambda ctx: database.get_drug_changes(since=ctx.drug_count - 100),
+    'verify_user': lambda ctx: database.verify_user(f'user{ctx.rng.randrange(USERS)}', USER_PASSWORD),
+    # Writes
+    'add_drug': lambda ctx: database.add_drug(*ctx.new_drug()),
+    # Includes the queue's WRITE_MAX_LATENCY wait, since a lone caller has no one to share a commit with
+    'add_drug_queued': lambda ctx: submit_write(database.add_drug, *ctx.new_drug()).result(),
+    'update_drug': update_drug,
+    'update_supplier': update_supplier,
+    'update_inventory': lambda ctx: database.update_inventory(ctx.drug_id(), 1),
+    'allocate_fefo': lambda ctx: database.allocate_fefo(ctx.product(), 1),
+    'add_supplier': lambda ctx: database.add_supplier('Bench Supplier', 'bench@example.com', '1 Bench Street'),
+    # One scrypt hash per call; a repeated username is rejected after hashing, like a new one
+    'add_user': lambda ctx: database.add_user(f'bench{ctx.rng.randrange(10 ** 9)}', USER_PASSWORD),
+    'place_order': lambda ctx: ctx.placed_orders.append(database.place_order(ctx.supplier_id(), 'Pending', ctx.items())),
+    'add_order': lambda ctx: ctx.placed_orders.append(database.add_order(ctx.supplier_id(), 'Pending', ctx.items())),
+    # About 80% of generated orders are already Received; those are skipped, as on a repeated receipt
+    'receive_orders': lambda ctx: database.receive_orders(ctx.order_ids(50)),
+    'place_order_reserving': lambda ctx: ctx.placed_orders.append(database.place_order(
+        ctx.supplier_id(), 'Pending', [{'drug_id': ctx.drug_id(), 'quantity': 1}], reserve_stock=True)),
+    'cancel_orders': cancel_orders,
+    'set_reorder_threshold': lambda ctx: database.set_reorder_threshold(ctx.product(), ctx.rng.choice(MANUFACTURERS),
+                                                                        ctx.rng.randint(5, 50)),
+    # Generated ledger entries are all recent, so this times the scan for old ones
+    'compact_ledger': lambda ctx: database.compact_ledger(),
+    'delete_drug': delete_drug,
+    'delete_supplier': delete_supplier,
+}
+
+# Errors a benchmark may raise on perfectly valid data (e.g. a random batch is out of stock)
+EXPECTED_ERRORS = (ValueError,)
+
+def percentile(samples, pct):
+    """Returns the pct-th percentile of samples (nearest rank)."""
+    ordered = sorted(samples)
+    return ordered[max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))]
+
+def run_benchmark(func, ctx, iterations, use_cache=False):
+    """Times func(ctx) and returns latency percentiles in ms, calls per second and peak KiB."""
+    samples = []
+    errors = 0
+    for _ in range(iterations + 1):  # The first call only warms up the page cache
+        if not use_cache:
+            database.clear_cache()
+        started = time.perf_counter()
+        try:
+            func(ctx)
+        except EXPECTED_ERRORS:
+            errors += 1
+        samples.append(time.perf_counter() - started)
+    samples = samples[1:]
+
+    # Memory is measured on a separate call, since tracing slows every allocation down
+    if not use_cache:
+        database.clear_cache()
+    tracemalloc.start()
+    try:
+        func(ctx)
+    except EXPECTED_ERRORS:
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    total = sum(samples)
+    return {
+        'iterations': iterations,
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p95_ms': percentile(samples, 95) * 1000,
+        'mean_ms': total / iterations * 1000,
+        'ops_per_second': iterations / total if total else 0.0,
+        'peak_kib': peak / 1024,
+        'expected_errors': errors,
+    }
+
+def run_scale(name, iterations=ITERATIONS, only=None, use_cache=False, seed=0, progress=None):
+    """Generates the dataset for one scale and runs the benchmarks on it. Returns a result dict."""
+    scale = SCALES[name]
+    directory = tempfile.mkdtemp(prefix=f'benchmark_{name}_')
+    try:
+        started = time.perf_counter()
+        counts = generate_dataset(os.path.join(directory, 'benchmark.db'), scale, seed)
+        result = {'dataset': counts, 'generate_seconds': time.perf_counter() - started,
+                  'database_bytes': os.path.getsize(os.path.join(directory, 'benchmark.db')), 'results': {}}
+        ctx = Context(scale, counts, seed)
+        for bench_name, func in BENCHMARKS.items():
+            if only and not any(pattern in bench_name for pattern in only):
+                continue
+            result['results'][bench_name] = run_benchmark(func, ctx, iterations, use_cache)
+            if progress:
+                progress(name, bench_name, result['results'][bench_name])
+        return result
+    finally:
+        database.close_connections()
+        shutil.rmtree(directory, ignore_errors=True)
+
+def run(scales, **options):
+    """Runs every scale and returns the full report, including the environment it ran in."""
+    original_path = database.DB_PATH
+    report = {
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'iterations': options.get('iterations', ITERATIONS),
+        'cache': options.get('use_cache', False),
+        'scales': {},
+    }
+    try:
+        for name in scales:
+            report['scales'][name] = run_scale(name, **options)
+    finally:
+        database.configure(db_path=original_path)
+    return report
+
+def compare(report, baseline, threshold):
+    """Returns (scale, benchmark, baseline p50, new p50, ratio) for benchmarks whose p50 grew by more than threshold."""
+    regressions = []
+    for scale, result in report['scales'].items():
+        old_results = baseline.get('scales', {}).get(scale, {}).get('results', {})
+        for name, new in result['results'].items():
+            old = old_results.get(name)
+            if old and old['p50_ms'] > 0:
+                ratio = new['p50_ms'] / old['p50_ms']
+                if ratio > 1 + threshold:
+                    regressions.append((scale, name, old['p50_ms'], new['p50_ms'], ratio))
+    return regressions
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description='Benchmark database.py on generated data.')
+    parser.add_argument('--scales', nargs='+', choices=list(SCALES), default=['small', 'medium'])
+    parser.add_argument('--iterations', type=int, default=ITERATIONS, help='timed calls per benchmark (default: %(default)s)')
+    parser.add_argument('--only', nargs='+', help='run only benchmarks whose name contains one of these strings')
+    parser.add_argument('--cache', action='store_true', help='leave the query cache on (default: cleared before every call)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the dataset and arguments')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='p50 slowdown counted as a regression with --compare (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    def progress(scale, name, result):
+        print(f'{scale:<7} {name:<28} p50 {result["p50_ms"]:9.3f} ms  p95 {result["p95_ms"]:9.3f} ms  '
+              f'{result["ops_per_second"]:9.0f}/s  peak {result["peak_kib"]:9.1f} KiB', file=sys.stderr)
+
+    report = run(args.scales, iterations=args.iterations, only=args.only, use_cache=args.cache,
+                 seed=args.seed, progress=progress)
+    for name, result in report['scales'].items():
+        print(f'{name}: {result["dataset"]} generated in {result["generate_seconds"]:.1f}s '
+              f'({result["database_bytes"] / 2 ** 20:.1f} MiB)', file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for scale, name, old, new, ratio in regressions:
+            print(f'REGRESSION {scale} {name}: p50 {old:.3f} ms -> {new:.3f} ms ({ratio:.2f}x)')
+        if regressions:
+            return 1
+        print(f'No benchmark slowed down by more than {args.threshold:.0%}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,237 @@
+"""Bulk import of drugs, suppliers, orders and order items from CSV or JSONL files.
+
+Rows are streamed from the file, validated one at a time and inserted with
+executemany() in large batches, one transaction per batch. Invalid rows are
+reported and skipped instead of aborting the load.
+
+Usage:
+    python bulk_import.py drugs warehouse_snapshot.csv
+    python bulk_import.py order_items items.jsonl --batch-size 50000 --drop-indexes
+"""
+import argparse
+import csv
+import json
+import sys
+import time
+from datetime import datetime
+from itertools import islice
+
+import database
+
+BATCH_SIZE = 10000
+MAX_REPORTED_ERRORS = 100  # Further errors are counted but not kept
+ORDER_STATUSES = database.ORDER_STATUSES  # Imported as history: Received orders don't add to stock
+
+# Import kinds: table name and (column, type, required) for every accepted field.
+# An omitted ID column lets SQLite assign the next ID.
+IMPORT_SPECS = {
+    'drugs': ('Drugs', (
+        ('drug_id', 'int', False),
+        ('name', 'text', True),
+        ('batch_number', 'text', True),
+        ('expiry_date', 'date', True),
+        ('manufacturer', 'text', True),
+        ('quantity', 'count', True),
+        ('storage_conditions', 'text', False),
+    )),
+    'suppliers': ('Suppliers', (
+        ('supplier_id', 'int', False),
+        ('name', 'text', True),
+        ('contact_info', 'text', False),
+        ('address', 'text', False),
+    )),
+    'orders': ('Orders', (
+        ('order_id', 'int', False),
+        ('order_date', 'date', True),
+        ('supplier_id', 'int', True),
+        ('status', 'status', True),
+    )),
+    'order_items': ('Order_Items', (
+        ('order_item_id', 'int', False),
+        ('order_id', 'int', True),
+        ('drug_id', 'int', True),
+        ('quantity', 'count', True),
+    )),
+}
+
+def read_rows(path):
+    """Yields (line_number, row_dict) from a .csv or .jsonl/.ndjson file without loading it whole.
+
+    A JSONL line that does not parse is yielded as None so it gets rejected on its own.
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith(('.jsonl', '.ndjson')):
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_number, json.loads(line)
+                except json.JSONDecodeError:
+                    yield line_number, None
+        else:
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+
+def convert_value(value, kind):
+    """Converts one raw field to the value stored in the database."""
+    if kind == 'text':
+        return str(value).strip()
+    if kind == 'date':
+        value = str(value).strip()
+        datetime.strptime(value, '%Y-%m-%d')  # Raises ValueError on anything else
+        return value
+    if kind == 'status':
+        value = str(value).strip()
+        if value not in ORDER_STATUSES:
+            raise ValueError(f'must be one of {", ".join(ORDER_STATUSES)}')
+        return value
+    number = int(value)
+    if kind == 'count' and number < 0:
+        raise ValueError('must not be negative')
+    return number
+
+def validate_row(row, fields):
+    """Returns the row as a tuple in column order, or raises ValueError."""
+    if not isinstance(row, dict):
+        raise ValueError('not a JSON object')
+    values = []
+    for column, kind, required in fields:
+        value = row.get(column)
+        if value is None or value == '':
+            if required:
+                raise ValueError(f'{column} is required')
+            values.append(None)
+            continue
+        try:
+            values.append(convert_value(value, kind))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f'{column}: invalid value {value!r} ({e})')
+    return tuple(values)
+
+def drop_indexes(table):
+    """Drops the secondary indexes of a table and returns their CREATE statements."""
+    with database.transaction() as conn:
+        indexes = conn.execute('''
+            SELECT name, sql FROM sqlite_master
+            WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL
+        ''', (table,)).fetchall()
+        for index in indexes:
+            conn.execute(f'DROP INDEX "{index["name"]}"')
+    return [index['sql'] for index in indexes]
+
+def create_indexes(statements):
+    """Recreates indexes dropped by drop_indexes()."""
+    with database.transaction() as conn:
+        for statement in statements:
+            conn.execute(statement)
+
+def insert_batch(conn, sql, batch, reject):
+    """Inserts a batch with executemany(); on a constraint error, retries row by row.
+
+    Returns the number of rows inserted. Rejected rows are passed to reject().
+    """
+    integrity_error = database.get_backend().IntegrityError
+    try:
+        conn.execute('SAVEPOINT import_batch')
+        conn.executemany(sql, [values for _, values in batch])
+        conn.execute('RELEASE import_batch')
+        return len(batch)
+    except integrity_error:
+        conn.execute('ROLLBACK TO import_batch')
+        conn.execute('RELEASE import_batch')
+    inserted = 0
+    for line_number, values in batch:
+        try:
+            conn.execute('SAVEPOINT import_row')
+            conn.execute(sql, values)
+            conn.execute('RELEASE import_row')
+            inserted += 1
+        except integrity_error as e:
+            conn.execute('ROLLBACK TO import_row')
+            conn.execute('RELEASE import_row')
+            reject(line_number, str(e))
+    return inserted
+
+def import_rows(kind, rows, batch_size=BATCH_SIZE, rebuild_indexes=False, progress=None):
+    """Imports (line_number, row_dict) pairs into the table for `kind`.
+
+    Returns a summary dict with the rows read, inserted and rejected, the
+    elapsed time, rows per second and the first MAX_REPORTED_ERRORS errors
+    as (line_number, message) pairs.
+    """
+    table, fields = IMPORT_SPECS[kind]
+    columns = ', '.join(column for column, _, _ in fields)
+    placeholders = ', '.join('?' for _ in fields)
+    sql = f'INSERT INTO {table} ({columns}) VALUES ({placeholders})'
+
+    started = time.perf_counter()
+    summary = {'read': 0, 'inserted': 0, 'rejected': 0, 'errors': []}
+
+    def reject(line_number, message):
+        summary['rejected'] += 1
+        if len(summary['errors']) < MAX_REPORTED_ERRORS:
+            summary['errors'].append((line_number, message))
+
+    def valid_rows():
+        for line_number, row in rows:
+            summary['read'] += 1
+            try:
+                yield line_number, validate_row(row, fields)
+            except ValueError as e:
+                reject(line_number, str(e))
+
+    dropped = drop_indexes(table) if rebuild_indexes else []
+    try:
+        valid = valid_rows()
+        while True:
+            batch = list(islice(valid, batch_size))
+            if not batch:
+                break
+            with database.transaction() as conn:
+                summary['inserted'] += insert_batch(conn, sql, batch, reject)
+            if progress:
+                progress(summary)
+    finally:
+        if dropped:
+            create_indexes(dropped)
+        database.invalidate_cache(table)
+
+    summary['seconds'] = time.perf_counter() - started
+    summary['rows_per_second'] = summary['inserted'] / summary['seconds'] if summary['seconds'] else 0.0
+    return summary
+
+def import_file(kind, path, **options):
+    """Imports a CSV or JSONL file; see import_rows() for options and the result."""
+    return import_rows(kind, read_rows(path), **options)
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description='Bulk import CSV or JSONL data into the drug inventory database.')
+    parser.add_argument('kind', choices=sorted(IMPORT_SPECS), help='what the file contains')
+    parser.add_argument('path', help='.csv file with a header row, or .jsonl with one object per line')
+    parser.add_argument('--database', default=database.DB_PATH, help='SQLite database file (default: %(default)s)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='rows per transaction (default: %(default)s)')
+    parser.add_argument('--drop-indexes', action='store_true',
+                        help='drop the table\'s secondary indexes during the load and rebuild them afterwards')
+    args = parser.parse_args(argv)
+
+    if args.database != database.DB_PATH:
+        database.configure(db_path=args.database)
+
+    def progress(summary):
+        elapsed = time.perf_counter() - started
+        print(f'{summary["inserted"]} rows inserted, {summary["rejected"]} rejected '
+              f'({summary["inserted"] / elapsed:.0f} rows/sec)', file=sys.stderr)
+
+    started = time.perf_counter()
+    summary = import_file(args.kind, args.path, batch_size=args.batch_size,
+                          rebuild_indexes=args.drop_indexes, progress=progress)
+    for line_number, message in summary['errors']:
+        print(f'line {line_number}: {message}', file=sys.stderr)
+    print(f'Read {summary["read"]} rows, inserted {summary["inserted"]}, rejected {summary["rejected"]} '
+          f'in {summary["seconds"]:.1f}s ({summary["rows_per_second"]:.0f} rows/sec)')
+    return 1 if summary['rejected'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,37 @@
+"""Compaction of the inventory ledger, meant to run nightly (e.g. from cron).
+
+Movements older than the retention window are folded into one balance per
+drug in Inventory_Balances and deleted, so Inventory_Ledger stops growing.
+Stock at any time inside the window can still be queried with
+database.get_stock_at().
+
+Usage:
+    python compact_ledger.py
+    python compact_ledger.py --keep-days 90 --database /srv/drug_inventory.db
+"""
+import argparse
+import sys
+from datetime import datetime, timedelta
+
+import database
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description='Fold old inventory ledger movements into per-drug balances.')
+    parser.add_argument('--keep-days', type=int, default=database.LEDGER_RETENTION_DAYS,
+                        help='days of movements kept in full (default: %(default)s)')
+    parser.add_argument('--database', default=database.DB_PATH, help='SQLite database file (default: %(default)s)')
+    args = parser.parse_args(argv)
+    if args.keep_days < 1:
+        parser.error('--keep-days must be at least 1')
+
+    if args.database != database.DB_PATH:
+        database.configure(db_path=args.database)
+    before = (datetime.now() - timedelta(days=args.keep_days)).strftime('%Y-%m-%d %H:%M:%S')
+    removed = database.compact_ledger(before)
+    summary = database.get_ledger_summary()
+    print(f'Folded {removed} entries older than {before} into balances; {summary["entries"]} entries remain')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,22 +1,413 @@
-import sqlite3
+import threading
+import re
+import queue
+import time
+import functools
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 import hashlib
+import hmac
+import os
+
+import backends
+import instrumentation
+
+# Database location and connection pool settings
+DB_PATH = 'drug_inventory.db'
+# A DB-API driver URL (see backends.backend_from_url) for a database shared by
+# several app nodes, which must speak SQLite's dialect (see backends.py); when
+# unset, the SQLite file at DB_PATH is used
+DATABASE_URL = os.environ.get('DRUG_INVENTORY_DATABASE_URL')
+POOL_SIZE = 8            # Maximum number of open connections shared by all threads
+POOL_TIMEOUT = 30        # Seconds to wait for a free connection before giving up
+BUSY_TIMEOUT_MS = 5000   # How long SQLite waits on a locked database before raising
+
+# Query cache settings
+CACHE_MAX_ENTRIES = 512  # Least recently used results are dropped beyond this
+CACHE_TTL = 300          # Seconds a result may be served, as a backstop to the checks below
+# Writes by other processes and app nodes are found through the Table_Versions
+# table: with a DB-API backend, every cached read checks it first; with a
+# local SQLite file, at most once every LOCAL_VERSION_CHECK_INTERVAL seconds
+LOCAL_VERSION_CHECK_INTERVAL = 1.0
+
+# PRAGMAs applied once to every new connection
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode = WAL',        # Readers no longer block the writer (and vice versa)
+    'PRAGMA synchronous = NORMAL',      # Safe with WAL, avoids an fsync on every commit
+    'PRAGMA cache_size = -16000',       # 16 MB page cache per connection
+    'PRAGMA mmap_size = 268435456',     # Memory-map up to 256 MB of the database file
+    'PRAGMA temp_store = MEMORY',
+)
+
+class ConnectionPool:
+    """A thread-safe pool of long-lived connections from a storage backend.
+
+    A thread keeps the same connection for as long as it holds it, so nested
+    calls (e.g. a transaction that calls other database functions) share it.
+    """
+
+    def __init__(self, backend, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.backend = backend
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._all = []
+        self._local = threading.local()
+        self.initialized = False  # Set once init_db() has brought the schema up to date
+
+    def _connect(self):
+        """Opens a new connection through the backend."""
+        started = time.perf_counter()
+        conn = self.backend.connect()
+        instrumentation.record_connection('open', time.perf_counter() - started)
+        return conn
+
+    def _discard(self, conn):
+        """Closes a broken connection instead of returning it to the pool."""
+        with self._lock:
+            self._opened -= 1
+            if conn in self._all:
+                self._all.remove(conn)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _acquire(self):
+        """Takes an idle connection, opening a new one while under the size limit."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+            with self._lock:
+                self._all.append(conn)
+            return conn
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f'No database connection became free within {self.timeout}s')
+
+    @contextmanager
+    def connection(self):
+        """Lends a connection to the calling thread, reusing the one it already holds."""
+        local = self._local
+        if getattr(local, 'depth', 0):
+            local.depth += 1
+            try:
+                yield local.conn
+            finally:
+                local.depth -= 1
+            return
+        started = time.perf_counter()
+        conn = self._acquire()
+        local.conn, local.depth, local.in_transaction = conn, 1, False
+        local.after_commit = []
+        broken = False
+        try:
+            yield conn
+        except BaseException as e:
+            broken = self.backend.is_disconnect(conn, e)
+            raise
+        finally:
+            instrumentation.record_connection('checkout', time.perf_counter() - started)
+            local.depth = 0
+            local.conn = None
+            if broken:
+                self._discard(conn)  # E.g. the server went away; the next borrower gets a new one
+            else:
+                if conn.in_transaction:
+                    conn.rollback()  # Never hand an open transaction to the next borrower
+                self._idle.put(conn)
+
+    @contextmanager
+    def transaction(self, immediate=True):
+        """Runs the block in one transaction; nested calls join the outer one."""
+        with self.connection() as conn:
+            local = self._local
+            if local.in_transaction:
+                yield conn
+                return
+            self.backend.begin(conn, immediate)
+            local.in_transaction = True
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                local.after_commit.clear()
+                raise
+            else:
+                conn.commit()
+            finally:
+                local.in_transaction = False
+            callbacks, local.after_commit = local.after_commit, []
+            for callback in callbacks:
+                callback()
+
+    def in_transaction(self):
+        """Returns True while the calling thread is inside transaction()."""
+        local = self._local
+        return bool(getattr(local, 'depth', 0) and local.in_transaction)
+
+    def after_commit(self, callback):
+        """Runs callback once the calling thread's transaction commits, or now if there is none."""
+        if self.in_transaction():
+            self._local.after_commit.append(callback)
+        else:
+            callback()
+
+    def close(self):
+        """Closes every connection the pool has opened."""
+        with self._lock:
+            conns, self._all, self._opened = self._all, [], 0
+        self._idle = queue.LifoQueue()
+        for conn in conns:
+            conn.close()
+
+def create_backend():
+    """Returns the storage backend selected by DATABASE_URL and DB_PATH."""
+    if DATABASE_URL:
+        return backends.backend_from_url(DATABASE_URL)
+    return backends.SQLiteBackend(DB_PATH, CONNECTION_PRAGMAS, BUSY_TIMEOUT_MS / 1000)
+
+_pool = ConnectionPool(create_backend())
+_pool_lock = threading.Lock()
+_init_lock = threading.Lock()
+
+def configure(db_path=None, pool_size=None, url=None, backend=None):
+    """Points the module at another database and/or resizes the pool.
+
+    db_path selects an SQLite file, url a DB-API driver URL (as in
+    DATABASE_URL) and backend a ready-made backend object.
+    """
+    global _pool, DB_PATH, DATABASE_URL
+    with _pool_lock:
+        if db_path is not None:
+            DB_PATH, DATABASE_URL = db_path, None
+        if url is not None:
+            DATABASE_URL = url
+        old = _pool
+        if backend is None:
+            backend = create_backend() if db_path is not None or url is not None else old.backend
+        _pool = ConnectionPool(backend, pool_size or old.size, old.timeout)
+    old.close()
+    _cache.clear()
+    _reset_table_versions()
+
+def get_backend():
+    """Returns the storage backend the pool draws its connections from."""
+    return _pool.backend
+
+def close_connections():
+    """Closes every pooled connection; new ones are opened on demand."""
+    _pool.close()
+
+def _ready_pool():
+    """Returns the pool, running init_db() first if this is its first use."""
+    pool = _pool
+    if not pool.initialized:
+        init_db()
+    return pool
 
-# Connect to the SQLite database
 def get_db_connection():
-    """Creates a connection to the database file 'drug_inventory.db'."""
-    conn = sqlite3.connect('drug_inventory.db')
-    conn.row_factory = sqlite3.Row  # Lets us access columns by name (e.g., drug['name'])
-    return conn
+    """Borrows a pooled connection to the configured database for a `with` block."""
+    return _ready_pool().connection()
 
-# Set up the database tables
-def init_db():
-    """Creates all necessary tables if they don’t already exist."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def transaction(immediate=True):
+    """Borrows a pooled connection and wraps the `with` block in a transaction.
+
+    Commits on success and rolls back on error. By default the write lock is
+    taken up front (BEGIN IMMEDIATE): in WAL mode a deferred transaction that
+    later needs to write fails with "database is locked" instead of waiting
+    out the busy timeout. Pass immediate=False for read-only transactions.
+    """
+    return _ready_pool().transaction(immediate)
+
+# Query cache
+class QueryCache:
+    """A process-wide LRU cache for the results of read functions.
+
+    Every table has a generation counter that write functions bump after they
+    commit. Cache keys include the generations of the tables a result was read
+    from, so a write makes older results unreachable instead of stale. Writes
+    made elsewhere bump the generations too, once check_table_versions() sees them.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    def generation(self, table):
+        """Returns the current generation of a table."""
+        return self._generations.get(table, 0)
+
+    def get_or_load(self, key, tables, loader):
+        """Returns the cached result for key, calling loader() on a miss."""
+        with self._lock:
+            # Read the generations before loading: a write that commits while we
+            # load bumps them, so the result is stored under an already old key
+            key = (key, tuple(self._generations.get(table, 0) for table in tables))
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return entry[2]
+                del self._entries[key]
+                self._stats['expirations'] += 1
+            self._stats['misses'] += 1
+        value = loader()
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, tables, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+        return value
+
+    def invalidate(self, *tables):
+        """Bumps the generation of each table, retiring every result read from it."""
+        with self._lock:
+            for table in tables:
+                self._generations[table] = self._generations.get(table, 0) + 1
+            self._stats['invalidations'] += 1
+            # Drop retired entries now rather than waiting for LRU eviction
+            for key in [key for key, entry in self._entries.items()
+                        if any(table in tables for table in entry[1])]:
+                del self._entries[key]
+
+    def clear(self):
+        """Empties the cache and resets the statistics."""
+        with self._lock:
+            self._entries.clear()
+            for name in self._stats:
+                self._stats[name] = 0
+
+    def stats(self):
+        """Returns hit/miss counters plus the current size."""
+        with self._lock:
+            stats = dict(self._stats, size=len(self._entries), max_entries=self.max_entries, ttl=self.ttl)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+_cache = QueryCache()
+
+def cached(*tables):
+    """Decorates a read function so its results are cached until `tables` change."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _pool.in_transaction():
+                return func(*args, **kwargs)  # Must see the transaction's own uncommitted writes
+            key = (func.__name__, tables, args, tuple(sorted(kwargs.items())))
+            try:
+                hash(key)
+            except TypeError:
+                return func(*args, **kwargs)  # Unhashable arguments are never cached
+            check_table_versions()
+            return _cache.get_or_load(key, tables, lambda: func(*args, **kwargs))
+        wrapper.uncached = func
+        return wrapper
+    return decorator
+
+def invalidates(*tables):
+    """Decorates a write function so cached reads of `tables` are dropped once it commits."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # The function's own transaction joins this one, so its writes and
+            # the Table_Versions bump commit together
+            with transaction():
+                result = func(*args, **kwargs)
+                invalidate_cache(*tables)
+            return result
+        return wrapper
+    return decorator
+
+def invalidate_cache(*tables):
+    """Retires cached reads of `tables` after the current transaction commits.
 
-    # Drugs table
-    cursor.execute('''
+    Their Table_Versions rows are bumped in the same transaction, which tells
+    other processes and app nodes to retire theirs too.
+    """
+    with transaction() as conn:
+        conn.executemany('''
+            INSERT INTO Table_Versions (name, version) VALUES (?, 1)
+            ON CONFLICT (name) DO UPDATE SET version = version + 1
+        ''', [(table,) for table in tables])
+    _pool.after_commit(lambda: _cache.invalidate(*tables))
+
+# Table_Versions as last read: {table: version}, or None before the first check
+_table_versions = None
+_table_versions_checked = 0.0
+_table_versions_lock = threading.Lock()
+
+def _reset_table_versions():
+    global _table_versions, _table_versions_checked
+    with _table_versions_lock:
+        _table_versions, _table_versions_checked = None, 0.0
+
+def check_table_versions():
+    """Retires cached reads of tables that other processes or app nodes have written since the last check.
+
+    Runs before every cached read, but against a local SQLite file only does
+    any work every LOCAL_VERSION_CHECK_INTERVAL seconds.
+    """
+    global _table_versions, _table_versions_checked
+    pool = _ready_pool()
+    interval = LOCAL_VERSION_CHECK_INTERVAL if pool.backend.name == 'sqlite' else 0.0
+    if pool.in_transaction() or time.monotonic() < _table_versions_checked + interval:
+        return
+    checked = time.monotonic()
+    with pool.connection() as conn:
+        versions = dict(conn.execute('SELECT name, version FROM Table_Versions').fetchall())
+    with _table_versions_lock:
+        previous, _table_versions, _table_versions_checked = _table_versions, versions, checked
+    if previous is not None:
+        changed = [table for table, version in versions.items() if previous.get(table) != version]
+        if changed:
+            _cache.invalidate(*changed)  # Includes this process's own writes, which is harmless
+
+def get_table_generation(table):
+    """Returns a counter that changes every time `table` is written, here or (once seen) elsewhere."""
+    check_table_versions()
+    return _cache.generation(table)
+
+def cache_stats():
+    """Returns the query cache's hit/miss/eviction counters and size."""
+    return _cache.stats()
+
+def clear_cache():
+    """Drops every cached result and resets the statistics, e.g. to time the queries themselves."""
+    _cache.clear()
+
+# Schema migrations
+# Each step is (version, description, statements). Steps run once each, in
+# order, and every applied version is recorded in the schema_version table.
+MIGRATIONS = [
+    (1, 'Create base tables', (
+        # Drugs table
+        '''
         CREATE TABLE IF NOT EXISTS Drugs (
             drug_id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL,
@@ -26,20 +417,18 @@ def init_db():
             quantity INTEGER NOT NULL,
             storage_conditions TEXT
         )
-    ''')
-
-    # Suppliers table
-    cursor.execute('''
+        ''',
+        # Suppliers table
+        '''
         CREATE TABLE IF NOT EXISTS Suppliers (
             supplier_id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL,
             contact_info TEXT,
             address TEXT
         )
-    ''')
-
-    # Orders table
-    cursor.execute('''
+        ''',
+        # Orders table
+        '''
         CREATE TABLE IF NOT EXISTS Orders (
             order_id INTEGER PRIMARY KEY AUTOINCREMENT,
             order_date DATE NOT NULL,
@@ -47,10 +436,9 @@ def init_db():
             status TEXT NOT NULL,
             FOREIGN KEY (supplier_id) REFERENCES Suppliers(supplier_id)
         )
-    ''')
-
-    # Order_Items table
-    cursor.execute('''
+        ''',
+        # Order_Items table
+        '''
         CREATE TABLE IF NOT EXISTS Order_Items (
             order_item_id INTEGER PRIMARY KEY AUTOINCREMENT,
             order_id INTEGER,
@@ -59,231 +447,1222 @@ def init_db():
             FOREIGN KEY (order_id) REFERENCES Orders(order_id),
             FOREIGN KEY (drug_id) REFERENCES Drugs(drug_id)
         )
-    ''')
-
-    # Users table for authentication
-    cursor.execute('''
+        ''',
+        # Users table for authentication
+        '''
         CREATE TABLE IF NOT EXISTS Users (
             user_id INTEGER PRIMARY KEY AUTOINCREMENT,
             username TEXT NOT NULL UNIQUE,
             password_hash TEXT NOT NULL
         )
-    ''')
+        ''',
+    )),
+    (2, 'Index report filters, the Orders-Suppliers join and Order_Items lookups', (
+        'CREATE INDEX IF NOT EXISTS idx_drugs_expiry_date ON Drugs (expiry_date)',
+        'CREATE INDEX IF NOT EXISTS idx_drugs_quantity ON Drugs (quantity)',
+        'CREATE INDEX IF NOT EXISTS idx_orders_supplier_date ON Orders (supplier_id, order_date)',
+        'CREATE INDEX IF NOT EXISTS idx_order_items_order ON Order_Items (order_id)',
+        'CREATE INDEX IF NOT EXISTS idx_order_items_drug ON Order_Items (drug_id)',
+    )),
+    (3, 'Add FTS5 search indexes for drugs and suppliers, kept in sync by triggers', (
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS Drugs_fts USING fts5(
+            name, manufacturer, batch_number,
+            content='Drugs', content_rowid='drug_id', prefix='2 3'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS Drugs_fts_insert AFTER INSERT ON Drugs BEGIN
+            INSERT INTO Drugs_fts (rowid, name, manufacturer, batch_number)
+            VALUES (NEW.drug_id, NEW.name, NEW.manufacturer, NEW.batch_number);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS Drugs_fts_delete AFTER DELETE ON Drugs BEGIN
+            INSERT INTO Drugs_fts (Drugs_fts, rowid, name, manufacturer, batch_number)
+            VALUES ('delete', OLD.drug_id, OLD.name, OLD.manufacturer, OLD.batch_number);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS Drugs_fts_update AFTER UPDATE OF name, manufacturer, batch_number ON Drugs BEGIN
+            INSERT INTO Drugs_fts (Drugs_fts, rowid, name, manufacturer, batch_number)
+            VALUES ('delete', OLD.drug_id, OLD.name, OLD.manufacturer, OLD.batch_number);
+            INSERT INTO Drugs_fts (rowid, name, manufacturer, batch_number)
+            VALUES (NEW.drug_id, NEW.name, NEW.manufacturer, NEW.batch_number);
+        END
+        ''',
+        "INSERT INTO Drugs_fts (Drugs_fts) VALUES ('rebuild')",
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS Suppliers_fts USING fts5(
+            name, contact_info, address,
+            content='Suppliers', content_rowid='supplier_id', prefix='2 3'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS Suppliers_fts_insert AFTER INSERT ON Suppliers BEGIN
+            INSERT INTO Suppliers_fts (rowid, name, contact_info, address)
+            VALUES (NEW.supplier_id, NEW.name, NEW.contact_info, NEW.address);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS Suppliers_fts_delete AFTER DELETE ON Suppliers BEGIN
+            INSERT INTO Suppliers_fts (Suppliers_fts, rowid, name, contact_info, address)
+            VALUES ('delete', OLD.supplier_id, OLD.name, OLD.contact_info, OLD.address);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS Suppliers_fts_update AFTER UPDATE OF name, contact_info, address ON Suppliers BEGIN
+            INSERT INTO Suppliers_fts (Suppliers_fts, rowid, name, contact_info, address)
+            VALUES ('delete', OLD.supplier_id, OLD.name, OLD.contact_info, OLD.address);
+            INSERT INTO Suppliers_fts (rowid, name, contact_info, address)
+            VALUES (NEW.supplier_id, NEW.name, NEW.contact_info, NEW.address);
+        END
+        ''',
+        "INSERT INTO Suppliers_fts (Suppliers_fts) VALUES ('rebuild')",
+    )),
+    (4, 'Index the sortable columns of the paged list views', (
+        'CREATE INDEX IF NOT EXISTS idx_drugs_name ON Drugs (name)',
+        'CREATE INDEX IF NOT EXISTS idx_suppliers_name ON Suppliers (name)',
+        'CREATE INDEX IF NOT EXISTS idx_orders_order_date ON Orders (order_date)',
+    )),
+    (5, 'Add the Stock_Levels aggregate per product, maintained by triggers', (
+        'CREATE INDEX IF NOT EXISTS idx_drugs_product ON Drugs (name, manufacturer, expiry_date)',
+        # One row per product (name + manufacturer) summed over all its batches
+        '''
+        CREATE TABLE IF NOT EXISTS Stock_Levels (
+            name TEXT NOT NULL,
+            manufacturer TEXT NOT NULL,
+            on_hand INTEGER NOT NULL DEFAULT 0,
+            earliest_expiry DATE,
+            pending_inbound INTEGER NOT NULL DEFAULT 0,
+            reorder_threshold INTEGER NOT NULL DEFAULT 10,
+            PRIMARY KEY (name, manufacturer)
+        )
+        ''',
+        # New batch: add its quantity; it can only make the earliest expiry earlier
+        '''
+        CREATE TRIGGER IF NOT EXISTS Stock_Levels_drug_insert AFTER INSERT ON Drugs BEGIN
+            INSERT INTO Stock_Levels (name, manufacturer, on_hand, earliest_expiry)
+            VALUES (NEW.name, NEW.manufacturer, NEW.quantity,
+                    CASE WHEN NEW.quantity > 0 THEN NEW.expiry_date END)
+            ON CONFLICT (name, manufacturer) DO UPDATE SET
+                on_hand = on_hand + excluded.on_hand,
+                earliest_expiry = MIN(COALESCE(earliest_expiry, excluded.earliest_expiry),
+                                      COALESCE(excluded.earliest_expiry, earliest_expiry));
+        END
+        ''',
+        # Quantity or expiry change within a product: apply the delta, and only
+        # rescan the product's batches if the earliest expiry may have moved
+        '''
+        CREATE TRIGGER IF NOT EXISTS Stock_Levels_drug_update AFTER UPDATE OF quantity, expiry_date ON Drugs
+        WHEN OLD.name = NEW.name AND OLD.manufacturer = NEW.manufacturer BEGIN
+            UPDATE Stock_Levels SET
+                on_hand = on_hand + NEW.quantity - OLD.quantity,
+                earliest_expiry = CASE
+                    WHEN OLD.expiry_date = NEW.expiry_date AND (OLD.quantity > 0) = (NEW.quantity > 0)
+                    THEN earliest_expiry
+                    ELSE (SELECT MIN(expiry_date) FROM Drugs
+                          WHERE name = NEW.name AND manufacturer = NEW.manufacturer AND quantity > 0)
+                END
+            WHERE name = NEW.name AND manufacturer = NEW.manufacturer;
+        END
+        ''',
+        # Batch renamed or moved to another manufacturer: recompute both products
+        '''
+        CREATE TRIGGER IF NOT EXISTS Stock_Levels_drug_move AFTER UPDATE OF name, manufacturer ON Drugs
+        WHEN OLD.name <> NEW.name OR OLD.manufacturer <> NEW.manufacturer BEGIN
+            UPDATE Stock_Levels SET
+                on_hand = on_hand - OLD.quantity,
+                earliest_expiry = (SELECT MIN(expiry_date) FROM Drugs
+                                   WHERE name = OLD.name AND manufacturer = OLD.manufacturer AND quantity > 0),
+                pending_inbound = (
+                    SELECT COALESCE(SUM(oi.quantity), 0)
+                    FROM Drugs d
+                    JOIN Order_Items oi ON oi.drug_id = d.drug_id
+                    JOIN Orders o ON o.order_id = oi.order_id
+                    WHERE d.name = OLD.name AND d.manufacturer = OLD.manufacturer AND o.status = 'Pending'
+                )
+            WHERE name = OLD.name AND manufacturer = OLD.manufacturer;
+            INSERT INTO Stock_Levels (name, manufacturer, on_hand, earliest_expiry, pending_inbound)
+            VALUES (NEW.name, NEW.manufacturer, NEW.quantity,
+                    (SELECT MIN(expiry_date) FROM Drugs
+                     WHERE name = NEW.name AND manufacturer = NEW.manufacturer AND quantity > 0),
+                    (SELECT COALESCE(SUM(oi.quantity), 0)
+                     FROM Drugs d
+                     JOIN Order_Items oi ON oi.drug_id = d.drug_id
+                     JOIN Orders o ON o.order_id = oi.order_id
+                     WHERE d.name = NEW.name AND d.manufacturer = NEW.manufacturer AND o.status = 'Pending'))
+            ON CONFLICT (name, manufacturer) DO UPDATE SET
+                on_hand = on_hand + excluded.on_hand,
+                earliest_expiry = excluded.earliest_expiry,
+                pending_inbound = excluded.pending_inbound;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS Stock_Levels_drug_delete AFTER DELETE ON Drugs BEGIN
+            UPDATE Stock_Levels SET
+                on_hand = on_hand - OLD.quantity,
+                earliest_expiry = CASE
+                    WHEN OLD.quantity > 0 AND OLD.expiry_date = earliest_expiry
+                    THEN (SELECT MIN(expiry_date) FROM Drugs
+                          WHERE name = OLD.name AND manufacturer = OLD.manufacturer AND quantity > 0)
+                    ELSE earliest_expiry
+                END,
+                pending_inbound = CASE
+                    WHEN EXISTS (SELECT 1 FROM Order_Items WHERE drug_id = OLD.drug_id)
+                    THEN (
+                        SELECT COALESCE(SUM(oi.quantity), 0)
+                        FROM Drugs d
+                        JOIN Order_Items oi ON oi.drug_id = d.drug_id
+                        JOIN Orders o ON o.order_id = oi.order_id
+                        WHERE d.name = OLD.name AND d.manufacturer = OLD.manufacturer AND o.status = 'Pending'
+                    )
+                    ELSE pending_inbound
+                END
+            WHERE name = OLD.name AND manufacturer = OLD.manufacturer;
+        END
+        ''',
+        # Items of Pending orders count as inbound stock
+        '''
+        CREATE TRIGGER IF NOT EXISTS Stock_Levels_item_insert AFTER INSERT ON Order_Items BEGIN
+            UPDATE Stock_Levels SET pending_inbound = pending_inbound + NEW.quantity
+            WHERE (name, manufacturer) = (SELECT name, manufacturer FROM Drugs WHERE drug_id = NEW.drug_id)
+              AND (SELECT status FROM Orders WHERE order_id = NEW.order_id) = 'Pending';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS Stock_Levels_item_delete AFTER DELETE ON Order_Items BEGIN
+            UPDATE Stock_Levels SET pending_inbound = pending_inbound - OLD.quantity
+            WHERE (name, manufacturer) = (SELECT name, manufacturer FROM Drugs WHERE drug_id = OLD.drug_id)
+              AND (SELECT status FROM Orders WHERE order_id = OLD.order_id) = 'Pending';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS Stock_Levels_item_update AFTER UPDATE OF order_id, drug_id, quantity ON Order_Items BEGIN
+            UPDATE Stock_Levels SET pending_inbound = pending_inbound - OLD.quantity
+            WHERE (name, manufacturer) = (SELECT name, manufacturer FROM Drugs WHERE drug_id = OLD.drug_id)
+              AND (SELECT status FROM Orders WHERE order_id = OLD.order_id) = 'Pending';
+            UPDATE Stock_Levels SET pending_inbound = pending_inbound + NEW.quantity
+            WHERE (name, manufacturer) = (SELECT name, manufacturer FROM Drugs WHERE drug_id = NEW.drug_id)
+              AND (SELECT status FROM Orders WHERE order_id = NEW.order_id) = 'Pending';
+        END
+        ''',
+        # An order entering or leaving Pending moves all its items in or out of inbound stock
+        '''
+        CREATE TRIGGER IF NOT EXISTS Stock_Levels_order_insert AFTER INSERT ON Orders
+        WHEN NEW.status = 'Pending' BEGIN
+            UPDATE Stock_Levels SET pending_inbound = pending_inbound + (
+                SELECT SUM(oi.quantity) FROM Order_Items oi JOIN Drugs d ON d.drug_id = oi.drug_id
+                WHERE oi.order_id = NEW.order_id
+                  AND d.name = Stock_Levels.name AND d.manufacturer = Stock_Levels.manufacturer
+            )
+            WHERE (name, manufacturer) IN (
+                SELECT d.name, d.manufacturer FROM Order_Items oi JOIN Drugs d ON d.drug_id = oi.drug_id
+                WHERE oi.order_id = NEW.order_id
+            );
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS Stock_Levels_order_status AFTER UPDATE OF status ON Orders
+        WHEN (OLD.status = 'Pending') <> (NEW.status = 'Pending') BEGIN
+            UPDATE Stock_Levels SET pending_inbound = pending_inbound
+                + (CASE WHEN NEW.status = 'Pending' THEN 1 ELSE -1 END) * (
+                    SELECT SUM(oi.quantity) FROM Order_Items oi JOIN Drugs d ON d.drug_id = oi.drug_id
+                    WHERE oi.order_id = NEW.order_id
+                      AND d.name = Stock_Levels.name AND d.manufacturer = Stock_Levels.manufacturer
+                )
+            WHERE (name, manufacturer) IN (
+                SELECT d.name, d.manufacturer FROM Order_Items oi JOIN Drugs d ON d.drug_id = oi.drug_id
+                WHERE oi.order_id = NEW.order_id
+            );
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS Stock_Levels_order_delete AFTER DELETE ON Orders
+        WHEN OLD.status = 'Pending' BEGIN
+            UPDATE Stock_Levels SET pending_inbound = pending_inbound - (
+                SELECT SUM(oi.quantity) FROM Order_Items oi JOIN Drugs d ON d.drug_id = oi.drug_id
+                WHERE oi.order_id = OLD.order_id
+                  AND d.name = Stock_Levels.name AND d.manufacturer = Stock_Levels.manufacturer
+            )
+            WHERE (name, manufacturer) IN (
+                SELECT d.name, d.manufacturer FROM Order_Items oi JOIN Drugs d ON d.drug_id = oi.drug_id
+                WHERE oi.order_id = OLD.order_id
+            );
+        END
+        ''',
+        # Backfill from existing data
+        '''
+        INSERT OR IGNORE INTO Stock_Levels (name, manufacturer, on_hand, earliest_expiry)
+        SELECT name, manufacturer, SUM(quantity), MIN(CASE WHEN quantity > 0 THEN expiry_date END)
+        FROM Drugs
+        GROUP BY name, manufacturer
+        ''',
+        '''
+        UPDATE Stock_Levels SET pending_inbound = (
+            SELECT COALESCE(SUM(oi.quantity), 0)
+            FROM Drugs d
+            JOIN Order_Items oi ON oi.drug_id = d.drug_id
+            JOIN Orders o ON o.order_id = oi.order_id
+            WHERE d.name = Stock_Levels.name AND d.manufacturer = Stock_Levels.manufacturer AND o.status = 'Pending'
+        )
+        ''',
+    )),
+    (6, 'Index in-stock batches by name and expiry for FEFO allocation', (
+        'CREATE INDEX IF NOT EXISTS idx_drugs_fefo ON Drugs (name, expiry_date) WHERE quantity > 0',
+    )),
+    (7, 'Add the append-only inventory ledger and compacted balances', (
+        # Every stock movement; Drugs.quantity remains the current balance
+        '''
+        CREATE TABLE IF NOT EXISTS Inventory_Ledger (
+            entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            drug_id INTEGER NOT NULL,
+            quantity_change INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            order_id INTEGER,
+            created_at TEXT NOT NULL DEFAULT (datetime('now', 'localtime')),
+            FOREIGN KEY (drug_id) REFERENCES Drugs(drug_id),
+            FOREIGN KEY (order_id) REFERENCES Orders(order_id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_ledger_drug_time ON Inventory_Ledger (drug_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_ledger_time ON Inventory_Ledger (created_at)',
+        # Per-drug sum of all ledger entries older than as_of (removed by compact_ledger)
+        '''
+        CREATE TABLE IF NOT EXISTS Inventory_Balances (
+            drug_id INTEGER PRIMARY KEY,
+            quantity INTEGER NOT NULL,
+            as_of TEXT NOT NULL
+        )
+        ''',
+        # Batches entering and leaving the Drugs table are movements too
+        '''
+        CREATE TRIGGER IF NOT EXISTS Inventory_Ledger_drug_insert AFTER INSERT ON Drugs
+        WHEN NEW.quantity <> 0 BEGIN
+            INSERT INTO Inventory_Ledger (drug_id, quantity_change, reason)
+            VALUES (NEW.drug_id, NEW.quantity, 'opening');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS Inventory_Ledger_drug_delete AFTER DELETE ON Drugs
+        WHEN OLD.quantity <> 0 BEGIN
+            INSERT INTO Inventory_Ledger (drug_id, quantity_change, reason)
+            VALUES (OLD.drug_id, -OLD.quantity, 'removal');
+        END
+        ''',
+        '''
+        INSERT INTO Inventory_Ledger (drug_id, quantity_change, reason)
+        SELECT drug_id, quantity, 'opening' FROM Drugs WHERE quantity <> 0
+        ''',
+    )),
+    (8, 'Add the Drugs change log read by the in-memory drug snapshot', (
+        # The version of a drug's latest insert, update or delete. Writers are
+        # serialised, so versions increase in commit order.
+        '''
+        CREATE TABLE IF NOT EXISTS Drugs_Changes (
+            drug_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_drugs_changes_version ON Drugs_Changes (version)',
+        '''
+        CREATE TRIGGER IF NOT EXISTS Drugs_Changes_insert AFTER INSERT ON Drugs BEGIN
+            INSERT INTO Drugs_Changes (drug_id, version)
+            VALUES (NEW.drug_id, (SELECT COALESCE(MAX(version), 0) + 1 FROM Drugs_Changes))
+            ON CONFLICT (drug_id) DO UPDATE SET version = excluded.version;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS Drugs_Changes_update
+        AFTER UPDATE OF drug_id, name, manufacturer, expiry_date, quantity ON Drugs BEGIN
+            INSERT INTO Drugs_Changes (drug_id, version)
+            VALUES (NEW.drug_id, (SELECT COALESCE(MAX(version), 0) + 1 FROM Drugs_Changes))
+            ON CONFLICT (drug_id) DO UPDATE SET version = excluded.version;
+        END
+        ''',
+        # A renumbered batch also disappears under its old ID
+        '''
+        CREATE TRIGGER IF NOT EXISTS Drugs_Changes_renumber AFTER UPDATE OF drug_id ON Drugs
+        WHEN OLD.drug_id <> NEW.drug_id BEGIN
+            INSERT INTO Drugs_Changes (drug_id, version)
+            VALUES (OLD.drug_id, (SELECT COALESCE(MAX(version), 0) + 1 FROM Drugs_Changes))
+            ON CONFLICT (drug_id) DO UPDATE SET version = excluded.version;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS Drugs_Changes_delete AFTER DELETE ON Drugs BEGIN
+            INSERT INTO Drugs_Changes (drug_id, version)
+            VALUES (OLD.drug_id, (SELECT COALESCE(MAX(version), 0) + 1 FROM Drugs_Changes))
+            ON CONFLICT (drug_id) DO UPDATE SET version = excluded.version;
+        END
+        ''',
+    )),
+    (9, 'Add per-table write counters for query caches on other app nodes', (
+        # Bumped by invalidate_cache() in the writing transaction, read by check_table_versions()
+        '''
+        CREATE TABLE IF NOT EXISTS Table_Versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+        ''',
+    )),
+    (10, "Index ledger movements by order, for releasing an order's reservation", (
+        '''
+        CREATE INDEX IF NOT EXISTS idx_ledger_order ON Inventory_Ledger (order_id, reason)
+        WHERE order_id IS NOT NULL
+        ''',
+    )),
+]
+
+def get_schema_version():
+    """Returns the highest applied migration version (0 for a new database)."""
+    with _pool.connection() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TEXT NOT NULL
+            )
+        ''')
+        return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+def migrate():
+    """Applies any pending migrations in order. Safe to call on every startup."""
+    latest = MIGRATIONS[-1][0]
+    # Fast path: SQLite keeps user_version in the file header, so an up-to-date
+    # database is recognised without touching any table
+    backend = _pool.backend
+    with _pool.connection() as conn:
+        version = backend.user_version(conn)
+        if version is not None and version >= latest:
+            return
+    if get_schema_version() >= latest:
+        with _pool.connection() as conn:
+            backend.set_user_version(conn, latest)  # Created before user_version was kept
+        return
+    # BEGIN IMMEDIATE so two processes starting together can't both apply a step
+    with _pool.transaction(immediate=True) as conn:
+        current = conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+        for version, description, statements in MIGRATIONS:
+            if version <= current:
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute('INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                         (version, description, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        backend.set_user_version(conn, latest)
+
+# Set up the database tables
+def init_db():
+    """Creates all necessary tables and indexes if they don’t already exist.
+
+    Runs by itself the first time a connection is borrowed, once per process
+    (and again after configure()), so importing this module does no I/O.
+    """
+    with _init_lock:
+        pool = _pool
+        if not pool.initialized:
+            migrate()
+            pool.initialized = True
+
+# Full-text search helpers
+def fts_query(search_term, column=None):
+    """Turns free text into an FTS5 prefix query, e.g. 'asp bay' -> '"asp"* "bay"*'.
+
+    Returns an empty string when the term has no searchable words.
+    """
+    words = re.findall(r'[^\W_]+', search_term)
+    query = ' '.join(f'"{word}"*' for word in words)
+    if query and column:
+        query = f'{column} : ({query})'
+    return query
 
-    conn.commit()
-    conn.close()
+# Keyset pagination helper
+def fetch_page(select, sort_columns, key, sort, after, page_size, descending):
+    """Returns (rows, next_cursor) for one page of `select`, ordered by `sort`.
+
+    sort_columns maps each allowed sort name to its SQL expression and `key` is
+    the primary key name. Pages continue from the cursor of the previous page
+    (a (sort_value, key_value) tuple), so every page costs one index seek no
+    matter how deep it is. next_cursor is None on the last page.
+    """
+    if sort not in sort_columns:
+        raise ValueError(f'Cannot sort by {sort!r}; choose one of {", ".join(sort_columns)}')
+    sort_sql, key_sql = sort_columns[sort], sort_columns[key]
+    direction, op = ('DESC', '<') if descending else ('ASC', '>')
+    params = []
+    if after is None:
+        where = ''
+    elif sort == key:
+        where = f'WHERE {key_sql} {op} ?'
+        params.append(after[1])
+    else:
+        where = f'WHERE ({sort_sql}, {key_sql}) {op} (?, ?)'
+        params.extend(after)
+    params.append(page_size + 1)  # One extra row tells us whether another page exists
+    with get_db_connection() as conn:
+        rows = conn.execute(f'''
+            {select}
+            {where}
+            ORDER BY {sort_sql} {direction}, {key_sql} {direction}
+            LIMIT ?
+        ''', params).fetchall()
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, (rows[-1][sort], rows[-1][key])
 
 # User Management Functions
+# Passwords are stored as 'scrypt$n$r$p$salt$hash' (or 'pbkdf2_sha256$iterations$salt$hash'
+# where OpenSSL lacks scrypt). After the cost below is raised, each password is rehashed
+# the next time verify_user() checks it, as are legacy unsalted SHA-256 hashes.
+SCRYPT_N = 2 ** 14        # CPU/memory cost; each hash uses 128 * N * r bytes (16 MB)
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = 600000
+SALT_BYTES = 16
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r, dklen=32)
+
 def hash_password(password):
-    """Hashes a password using SHA-256."""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Hashes a password with a random salt, using scrypt where available and PBKDF2 otherwise."""
+    salt = os.urandom(SALT_BYTES)
+    if hasattr(hashlib, 'scrypt'):
+        digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+        return f'scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}'
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, PBKDF2_ITERATIONS)
+    return f'pbkdf2_sha256${PBKDF2_ITERATIONS}${salt.hex()}${digest.hex()}'
+
+def check_password(password, password_hash):
+    """Returns True if password matches a stored hash in any supported format."""
+    scheme, _, rest = password_hash.partition('$')
+    if scheme == 'scrypt':
+        n, r, p, salt, digest = rest.split('$')
+        candidate = _scrypt(password, bytes.fromhex(salt), int(n), int(r), int(p))
+    elif scheme == 'pbkdf2_sha256':
+        iterations, salt, digest = rest.split('$')
+        candidate = hashlib.pbkdf2_hmac('sha256', password.encode(), bytes.fromhex(salt), int(iterations))
+    else:
+        # Legacy: unsalted SHA-256 hex digest
+        digest = password_hash
+        candidate = hashlib.sha256(password.encode()).digest()
+    return hmac.compare_digest(candidate.hex(), digest)
+
+def password_needs_rehash(password_hash):
+    """Returns True if a stored hash is weaker than what hash_password() produces today."""
+    if hasattr(hashlib, 'scrypt'):
+        return password_hash.split('$')[:4] != ['scrypt', str(SCRYPT_N), str(SCRYPT_R), str(SCRYPT_P)]
+    return password_hash.split('$')[:2] != ['pbkdf2_sha256', str(PBKDF2_ITERATIONS)]
+
+# Checked against for unknown usernames, so they take as long to reject as wrong passwords
+_DUMMY_PASSWORD_HASH = None
 
 def add_user(username, password):
     """Adds a new user with a hashed password to the Users table."""
     password_hash = hash_password(password)
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute('''
-            INSERT INTO Users (username, password_hash)
-            VALUES (?, ?)
-        ''', (username, password_hash))
-        conn.commit()
-    except sqlite3.IntegrityError:
-        conn.close()
+        with transaction() as conn:
+            conn.execute('''
+                INSERT INTO Users (username, password_hash)
+                VALUES (?, ?)
+            ''', (username, password_hash))
+    except _pool.backend.IntegrityError:
         return False  # Username already exists
-    conn.close()
     return True
 
+def get_password_hash(username):
+    """Returns the stored password hash of a user, or None if there is no such user."""
+    with get_db_connection() as conn:
+        row = conn.execute('SELECT password_hash FROM Users WHERE username = ?', (username,)).fetchone()
+    return row[0] if row else None
+
 def verify_user(username, password):
-    """Verifies if the username and password match a record in the Users table."""
-    password_hash = hash_password(password)
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM Users WHERE username = ? AND password_hash = ?', (username, password_hash))
-    user = cursor.fetchone()
-    conn.close()
-    return user is not None
+    """Verifies if the username and password match a record in the Users table.
+
+    A correct password stored in an outdated format is rehashed on the way.
+    """
+    global _DUMMY_PASSWORD_HASH
+    password_hash = get_password_hash(username)
+    if password_hash is None:
+        if _DUMMY_PASSWORD_HASH is None:
+            _DUMMY_PASSWORD_HASH = hash_password('')
+        check_password(password, _DUMMY_PASSWORD_HASH)
+        return False
+    if not check_password(password, password_hash):
+        return False
+    if password_needs_rehash(password_hash):
+        new_hash = hash_password(password)  # Outside the transaction: hashing is slow
+        with transaction() as conn:
+            # Only if nobody changed it meanwhile
+            conn.execute('UPDATE Users SET password_hash = ? WHERE username = ? AND password_hash = ?',
+                         (new_hash, username, password_hash))
+    return True
 
 # Drug Management Functions
+@invalidates('Drugs')
 def add_drug(name, batch_number, expiry_date, manufacturer, quantity, storage_conditions):
     """Adds a new drug to the Drugs table."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO Drugs (name, batch_number, expiry_date, manufacturer, quantity, storage_conditions)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (name, batch_number, expiry_date, manufacturer, quantity, storage_conditions))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('''
+            INSERT INTO Drugs (name, batch_number, expiry_date, manufacturer, quantity, storage_conditions)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (name, batch_number, expiry_date, manufacturer, quantity, storage_conditions))
 
+@cached('Drugs')
 def get_all_drugs():
     """Returns all drugs from the Drugs table."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM Drugs')
-    drugs = cursor.fetchall()
-    conn.close()
-    return drugs
+    with get_db_connection() as conn:
+        return conn.execute('SELECT * FROM Drugs').fetchall()
+
+DRUG_SORT_COLUMNS = {'drug_id': 'drug_id', 'name': 'name', 'expiry_date': 'expiry_date', 'quantity': 'quantity'}
+
+@cached('Drugs')
+def get_drugs_page(after=None, page_size=50, sort='drug_id', descending=False):
+    """Returns one page of drugs and the cursor for the next page."""
+    return fetch_page('SELECT * FROM Drugs', DRUG_SORT_COLUMNS, 'drug_id',
+                      sort, after, page_size, descending)
+
+@cached('Drugs')
+def count_drugs():
+    """Returns the number of rows in the Drugs table."""
+    with get_db_connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM Drugs').fetchone()[0]
 
+@invalidates('Drugs')
 def update_drug(drug_id, name, batch_number, expiry_date, manufacturer, quantity, storage_conditions):
-    """Updates an existing drug’s details."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE Drugs
-        SET name = ?, batch_number = ?, expiry_date = ?, manufacturer = ?, quantity = ?, storage_conditions = ?
-        WHERE drug_id = ?
-    ''', (name, batch_number, expiry_date, manufacturer, quantity, storage_conditions, drug_id))
-    conn.commit()
-    conn.close()
+    """Updates an existing drug’s details. A quantity change is logged as a 'correction'."""
+    with transaction(immediate=True) as conn:
+        old = conn.execute('SELECT quantity FROM Drugs WHERE drug_id = ?', (drug_id,)).fetchone()
+        conn.execute('''
+            UPDATE Drugs
+            SET name = ?, batch_number = ?, expiry_date = ?, manufacturer = ?, quantity = ?, storage_conditions = ?
+            WHERE drug_id = ?
+        ''', (name, batch_number, expiry_date, manufacturer, quantity, storage_conditions, drug_id))
+        if old is not None and old['quantity'] != quantity:
+            log_movements(conn, [(drug_id, quantity - old['quantity'], 'correction', None)])
 
+@invalidates('Drugs')
 def delete_drug(drug_id):
     """Deletes a drug from the Drugs table."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM Drugs WHERE drug_id = ?', (drug_id,))
-    conn.commit()
-    conn.close()
-
-def search_drugs(search_term):
-    """Returns drugs where the name contains the search term."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM Drugs WHERE LOWER(name) LIKE LOWER(?)', (f'%{search_term}%',))
-    drugs = cursor.fetchall()
-    conn.close()
-    return drugs
+    with transaction() as conn:
+        conn.execute('DELETE FROM Drugs WHERE drug_id = ?', (drug_id,))
+
+@cached('Drugs')
+def search_drugs(search_term, limit=None, offset=0):
+    """Returns drugs whose name, manufacturer or batch number starts with the
+    search words, best matches first."""
+    query = fts_query(search_term)
+    if not query:
+        return []
+    with get_db_connection() as conn:
+        return conn.execute('''
+            SELECT d.*
+            FROM Drugs_fts f
+            JOIN Drugs d ON d.drug_id = f.rowid
+            WHERE Drugs_fts MATCH ?
+            ORDER BY f.rank
+            LIMIT ? OFFSET ?
+        ''', (query, -1 if limit is None else limit, offset)).fetchall()
 
 # Supplier Management Functions
+@invalidates('Suppliers')
 def add_supplier(name, contact_info, address):
     """Adds a new supplier to the Suppliers table."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO Suppliers (name, contact_info, address)
-        VALUES (?, ?, ?)
-    ''', (name, contact_info, address))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('''
+            INSERT INTO Suppliers (name, contact_info, address)
+            VALUES (?, ?, ?)
+        ''', (name, contact_info, address))
 
+@cached('Suppliers')
 def get_all_suppliers():
     """Returns all suppliers from the Suppliers table."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM Suppliers')
-    suppliers = cursor.fetchall()
-    conn.close()
-    return suppliers
+    with get_db_connection() as conn:
+        return conn.execute('SELECT * FROM Suppliers').fetchall()
+
+def get_supplier_names():
+    """Returns (name, supplier_id) for every supplier, sorted by name.
+
+    Not cached here: session_data keeps the result for the app.
+    """
+    with get_db_connection() as conn:
+        return conn.execute('SELECT name, supplier_id FROM Suppliers ORDER BY name, supplier_id').fetchall()
+
+SUPPLIER_SORT_COLUMNS = {'supplier_id': 'supplier_id', 'name': 'name'}
 
+@cached('Suppliers')
+def get_suppliers_page(after=None, page_size=50, sort='supplier_id', descending=False):
+    """Returns one page of suppliers and the cursor for the next page."""
+    return fetch_page('SELECT * FROM Suppliers', SUPPLIER_SORT_COLUMNS, 'supplier_id',
+                      sort, after, page_size, descending)
+
+@cached('Suppliers')
+def count_suppliers():
+    """Returns the number of rows in the Suppliers table."""
+    with get_db_connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM Suppliers').fetchone()[0]
+
+@invalidates('Suppliers')
 def update_supplier(supplier_id, name, contact_info, address):
     """Updates an existing supplier’s details."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE Suppliers
-        SET name = ?, contact_info = ?, address = ?
-        WHERE supplier_id = ?
-    ''', (name, contact_info, address, supplier_id))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('''
+            UPDATE Suppliers
+            SET name = ?, contact_info = ?, address = ?
+            WHERE supplier_id = ?
+        ''', (name, contact_info, address, supplier_id))
 
+@invalidates('Suppliers')
 def delete_supplier(supplier_id):
     """Deletes a supplier from the Suppliers table."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM Suppliers WHERE supplier_id = ?', (supplier_id,))
-    conn.commit()
-    conn.close()
-
-def search_suppliers(search_term):
-    """Returns suppliers where the name contains the search term."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM Suppliers WHERE LOWER(name) LIKE LOWER(?)', (f'%{search_term}%',))
-    suppliers = cursor.fetchall()
-    conn.close()
-    return suppliers
+    with transaction() as conn:
+        conn.execute('DELETE FROM Suppliers WHERE supplier_id = ?', (supplier_id,))
+
+@cached('Suppliers')
+def search_suppliers(search_term, limit=None, offset=0):
+    """Returns suppliers whose name, contact info or address starts with the
+    search words, best matches first."""
+    query = fts_query(search_term)
+    if not query:
+        return []
+    with get_db_connection() as conn:
+        return conn.execute('''
+            SELECT s.*
+            FROM Suppliers_fts f
+            JOIN Suppliers s ON s.supplier_id = f.rowid
+            WHERE Suppliers_fts MATCH ?
+            ORDER BY f.rank
+            LIMIT ? OFFSET ?
+        ''', (query, -1 if limit is None else limit, offset)).fetchall()
 
 # Order Management Functions
-def add_order(supplier_id, status, items):
-    """Adds a new order and its items to the Orders and Order_Items tables."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+MAX_SQL_VARIABLES = 500  # IN (...) lists are split into chunks of this size
+MAX_SQL_INTEGER = 2 ** 63 - 1  # Largest value SQLite stores as an INTEGER
+
+# Order lifecycle: a Pending order is either received, which adds its items
+# to stock, or cancelled. Received and Cancelled are final. Stock reserved by
+# place_order(reserve_stock=True) is held only while the order is Pending:
+# receiving or cancelling it gives the stock back, logged as
+# 'reservation_release', and a receipt then adds the items as usual.
+ORDER_STATUSES = ('Pending', 'Received', 'Cancelled')
+ORDER_TRANSITIONS = {'Pending': ('Received', 'Cancelled')}
+
+def resolve_drug_ids(names):
+    """Maps each drug name to the ID of its first batch, using one indexed query per chunk."""
+    names = list(dict.fromkeys(names))
+    drug_ids = {}
+    with get_db_connection() as conn:
+        for i in range(0, len(names), MAX_SQL_VARIABLES):
+            chunk = names[i:i + MAX_SQL_VARIABLES]
+            rows = conn.execute(f'''
+                SELECT name, MIN(drug_id) AS drug_id
+                FROM Drugs
+                WHERE name IN ({', '.join('?' for _ in chunk)})
+                GROUP BY name
+            ''', chunk).fetchall()
+            drug_ids.update((row['name'], row['drug_id']) for row in rows)
+    return drug_ids
+
+def get_drug_names():
+    """Returns (name, drug_id of its first batch) for every drug name, sorted by name.
+
+    Not cached here: session_data keeps the app's copy up to date from get_drug_changes().
+    """
+    with get_db_connection() as conn:
+        return conn.execute('SELECT name, MIN(drug_id) FROM Drugs GROUP BY name ORDER BY name').fetchall()
+
+@invalidates('Orders', 'Order_Items')
+def place_order(supplier_id, status, items, reserve_stock=False):
+    """Places an order with all its items in a single transaction and returns its ID.
+
+    Each item is a dict with a 'quantity' and either a 'drug_id' or a drug
+    'name' (resolved to the first batch with that name). With
+    reserve_stock=True a Pending order also holds the ordered quantities out
+    of stock until it is received or cancelled; other statuses reserve
+    nothing. Raises ValueError, leaving the database untouched, if an item
+    is invalid or a drug does not have enough stock to reserve. An order
+    placed as Received adds its items to stock straight away.
+    """
+    if status not in ORDER_STATUSES:
+        raise ValueError(f'Unknown order status: {status}')
     order_date = datetime.now().strftime('%Y-%m-%d')
-    cursor.execute('''
-        INSERT INTO Orders (order_date, supplier_id, status)
-        VALUES (?, ?, ?)
-    ''', (order_date, supplier_id, status))
-    order_id = cursor.lastrowid
-
-    for item in items:
-        cursor.execute('''
+    # BEGIN IMMEDIATE takes the write lock first, so the names resolved and
+    # the stock checked below can't be changed by another writer before we update
+    with transaction(immediate=True) as conn:
+        names = [item['name'] for item in items if 'drug_id' not in item]
+        drug_ids = resolve_drug_ids(names) if names else {}  # Runs on this transaction's connection
+        rows = []
+        for item in items:
+            drug_id = item['drug_id'] if 'drug_id' in item else drug_ids.get(item['name'])
+            if drug_id is None:
+                raise ValueError(f"Unknown drug: {item['name']}")
+            if item['quantity'] <= 0:
+                raise ValueError(f'Quantity must be positive for drug {drug_id}')
+            rows.append((drug_id, item['quantity']))
+
+        order_id = conn.execute('''
+            INSERT INTO Orders (order_date, supplier_id, status)
+            VALUES (?, ?, ?)
+        ''', (order_date, supplier_id, status)).lastrowid
+        conn.executemany('''
             INSERT INTO Order_Items (order_id, drug_id, quantity)
             VALUES (?, ?, ?)
-        ''', (order_id, item['drug_id'], item['quantity']))
-    conn.commit()
-    conn.close()
+        ''', [(order_id, drug_id, quantity) for drug_id, quantity in rows])
+        if reserve_stock and status == 'Pending':
+            reserve_stock_for(conn, rows, order_id)
+        if status == 'Received':
+            apply_receipts(conn, [order_id])
+            invalidate_cache('Drugs')
+    return order_id
 
+def reserve_stock_for(conn, rows, order_id=None):
+    """Subtracts (drug_id, quantity) rows from stock inside the caller's transaction.
+
+    Raises ValueError if any drug is missing or would go below zero.
+    """
+    needed = {}
+    for drug_id, quantity in rows:
+        needed[drug_id] = needed.get(drug_id, 0) + quantity
+    drug_ids = list(needed)
+    on_hand = {}
+    for i in range(0, len(drug_ids), MAX_SQL_VARIABLES):
+        chunk = drug_ids[i:i + MAX_SQL_VARIABLES]
+        on_hand.update(conn.execute(f'''
+            SELECT drug_id, quantity FROM Drugs
+            WHERE drug_id IN ({', '.join('?' for _ in chunk)})
+        ''', chunk).fetchall())
+    short = [drug_id for drug_id, quantity in needed.items() if on_hand.get(drug_id, 0) < quantity]
+    if short:
+        raise ValueError(f"Not enough stock for drug ID(s) {', '.join(map(str, short))}")
+    apply_movements(conn, [(drug_id, -quantity, 'reservation', order_id) for drug_id, quantity in needed.items()])
+    invalidate_cache('Drugs')
+
+def add_order(supplier_id, status, items):
+    """Adds a new order and its items to the Orders and Order_Items tables."""
+    return place_order(supplier_id, status, items)
+
+@cached('Orders', 'Suppliers')
 def get_all_orders():
     """Returns all orders with supplier names."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT o.order_id, o.order_date, s.name as supplier_name, o.status
-        FROM Orders o
-        JOIN Suppliers s ON o.supplier_id = s.supplier_id
-    ''')
-    orders = cursor.fetchall()
-    conn.close()
-    return orders
-
-def search_orders(search_term):
-    """Returns orders where the order ID or supplier name contains the search term."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
+    with get_db_connection() as conn:
+        return conn.execute('''
+            SELECT o.order_id, o.order_date, s.name as supplier_name, o.status
+            FROM Orders o
+            JOIN Suppliers s ON o.supplier_id = s.supplier_id
+        ''').fetchall()
+
+ORDER_SORT_COLUMNS = {'order_id': 'o.order_id', 'order_date': 'o.order_date'}
+
+@cached('Orders', 'Suppliers')
+def get_orders_page(after=None, page_size=50, sort='order_id', descending=True):
+    """Returns one page of orders (newest first by default) and the cursor for the next page."""
+    return fetch_page('''
         SELECT o.order_id, o.order_date, s.name as supplier_name, o.status
         FROM Orders o
         JOIN Suppliers s ON o.supplier_id = s.supplier_id
-        WHERE LOWER(CAST(o.order_id AS TEXT)) LIKE LOWER(?) OR LOWER(s.name) LIKE LOWER(?)
-    ''', (f'%{search_term}%', f'%{search_term}%'))
-    orders = cursor.fetchall()
-    conn.close()
-    return orders
+    ''', ORDER_SORT_COLUMNS, 'order_id', sort, after, page_size, descending)
+
+@cached('Orders', 'Suppliers')
+def count_orders():
+    """Returns the number of orders shown by get_all_orders()."""
+    with get_db_connection() as conn:
+        return conn.execute('''
+            SELECT COUNT(*)
+            FROM Orders o
+            JOIN Suppliers s ON o.supplier_id = s.supplier_id
+        ''').fetchone()[0]
+
+@cached('Orders', 'Suppliers')
+def search_orders(search_term, limit=None, offset=0):
+    """Returns the order with a numeric search term as its ID, or else orders
+    from suppliers whose name starts with the search words."""
+    search_term = search_term.strip()
+    limit = -1 if limit is None else limit
+    # isascii(): isdigit() also accepts digits like '²' that int() rejects
+    if search_term.isascii() and search_term.isdigit():
+        order_id = int(search_term)
+        if order_id > MAX_SQL_INTEGER:
+            return []  # Too large to be an order ID (and to bind as an SQLite integer)
+        with get_db_connection() as conn:
+            # Exact primary key lookup instead of scanning every ID as text
+            return conn.execute('''
+                SELECT o.order_id, o.order_date, s.name as supplier_name, o.status
+                FROM Orders o
+                JOIN Suppliers s ON o.supplier_id = s.supplier_id
+                WHERE o.order_id = ?
+                LIMIT ? OFFSET ?
+            ''', (order_id, limit, offset)).fetchall()
+    query = fts_query(search_term, column='name')
+    if not query:
+        return []
+    with get_db_connection() as conn:
+        return conn.execute('''
+            SELECT o.order_id, o.order_date, s.name as supplier_name, o.status
+            FROM Suppliers_fts f
+            JOIN Suppliers s ON s.supplier_id = f.rowid
+            JOIN Orders o ON o.supplier_id = s.supplier_id
+            WHERE Suppliers_fts MATCH ?
+            ORDER BY f.rank, o.order_id DESC
+            LIMIT ? OFFSET ?
+        ''', (query, limit, offset)).fetchall()
+
+@cached('Order_Items', 'Drugs')
+def get_order_details(order_ids):
+    """Returns {order_id: [item rows]} for many orders, with one query per MAX_SQL_VARIABLES orders.
+
+    Each item row has order_item_id, order_id, drug_id, name, batch_number,
+    manufacturer and quantity (the drug columns are None if the batch was
+    deleted). Orders without items map to an empty list.
+    """
+    order_ids = list(dict.fromkeys(order_ids))
+    details = {order_id: [] for order_id in order_ids}
+    with get_db_connection() as conn:
+        for i in range(0, len(order_ids), MAX_SQL_VARIABLES):
+            chunk = order_ids[i:i + MAX_SQL_VARIABLES]
+            rows = conn.execute(f'''
+                SELECT oi.order_item_id, oi.order_id, oi.drug_id, d.name, d.batch_number, d.manufacturer, oi.quantity
+                FROM Order_Items oi
+                LEFT JOIN Drugs d ON d.drug_id = oi.drug_id
+                WHERE oi.order_id IN ({', '.join('?' for _ in chunk)})
+                ORDER BY oi.order_id, oi.order_item_id
+            ''', chunk).fetchall()
+            for row in rows:
+                details[row['order_id']].append(row)
+    return details
+
+@invalidates('Orders', 'Drugs')
+def set_order_status(order_ids, status):
+    """Moves orders to `status` in one transaction and returns the IDs of those that changed.
+
+    Orders already in `status` are skipped, so repeating a call is harmless.
+    Orders leaving Pending give back any stock they reserved
+    (release_reservations()), and Received orders then have their items
+    added to stock by apply_receipts().
+    Raises ValueError, changing nothing, for unknown orders or a transition
+    that ORDER_TRANSITIONS does not allow.
+    """
+    if status not in ORDER_STATUSES:
+        raise ValueError(f'Unknown order status: {status}')
+    order_ids = list(dict.fromkeys(order_ids))
+    changed = []
+    # BEGIN IMMEDIATE: the statuses read below can't change before we update them
+    with transaction(immediate=True) as conn:
+        for i in range(0, len(order_ids), MAX_SQL_VARIABLES):
+            chunk = order_ids[i:i + MAX_SQL_VARIABLES]
+            current = dict(conn.execute(f'''
+                SELECT order_id, status FROM Orders
+                WHERE order_id IN ({', '.join('?' for _ in chunk)})
+            ''', chunk).fetchall())
+            missing = [order_id for order_id in chunk if order_id not in current]
+            if missing:
+                raise ValueError(f"Unknown order ID(s) {', '.join(map(str, missing))}")
+            refused = [f'{order_id} ({current[order_id]})' for order_id in chunk
+                       if current[order_id] != status and status not in ORDER_TRANSITIONS.get(current[order_id], ())]
+            if refused:
+                raise ValueError(f"Can't mark order(s) {', '.join(refused)} as {status}")
+            moving = [order_id for order_id in chunk if current[order_id] != status]
+            if not moving:
+                continue
+            conn.execute(f'''
+                UPDATE Orders SET status = ?
+                WHERE order_id IN ({', '.join('?' for _ in moving)})
+            ''', [status] + moving)
+            release_reservations(conn, moving)
+            if status == 'Received':
+                apply_receipts(conn, moving)
+            changed.extend(moving)
+    return changed
+
+def receive_orders(order_ids):
+    """Marks orders Received and adds their items to stock; see set_order_status()."""
+    return set_order_status(order_ids, 'Received')
+
+def cancel_orders(order_ids):
+    """Marks orders Cancelled; see set_order_status()."""
+    return set_order_status(order_ids, 'Cancelled')
 
 # Inventory Tracking
-def update_inventory(drug_id, quantity_change):
-    """Updates a drug’s quantity (positive to add, negative to subtract)."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE Drugs
-        SET quantity = quantity + ?
-        WHERE drug_id = ?
-    ''', (quantity_change, drug_id))
-    conn.commit()
-    conn.close()
+# Every change to Drugs.quantity is also appended to Inventory_Ledger as a
+# (drug_id, quantity_change, reason, order_id) movement, giving an audit trail
+# and point-in-time stock. Drugs.quantity stays the current balance.
+# Retention: compact_ledger() (run nightly with compact_ledger.py, or from the
+# Admin page) keeps the last LEDGER_RETENTION_DAYS days of movements in full
+# and folds older ones into one Inventory_Balances row per drug.
+LEDGER_RETENTION_DAYS = 365
+def log_movements(conn, movements):
+    """Appends (drug_id, quantity_change, reason, order_id) movements to the ledger."""
+    created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn.executemany('''
+        INSERT INTO Inventory_Ledger (drug_id, quantity_change, reason, order_id, created_at)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [movement + (created_at,) for movement in movements])
+
+def apply_movements(conn, movements):
+    """Applies movements to Drugs.quantity and logs them, inside the caller's transaction."""
+    conn.executemany('UPDATE Drugs SET quantity = quantity + ? WHERE drug_id = ?',
+                     [(quantity_change, drug_id) for drug_id, quantity_change, _, _ in movements])
+    log_movements(conn, movements)
+
+def apply_receipts(conn, order_ids):
+    """Adds the items of (at most MAX_SQL_VARIABLES) orders to stock, inside the caller's transaction.
+
+    One grouped UPDATE covers every batch, and one INSERT ... SELECT logs a
+    'receipt' movement per order and batch. Items of deleted batches are skipped.
+    """
+    placeholders = ', '.join('?' for _ in order_ids)
+    conn.execute(f'''
+        UPDATE Drugs SET quantity = quantity + received.units
+        FROM (
+            SELECT drug_id, SUM(quantity) AS units
+            FROM Order_Items
+            WHERE order_id IN ({placeholders})
+            GROUP BY drug_id
+        ) AS received
+        WHERE Drugs.drug_id = received.drug_id
+    ''', order_ids)
+    conn.execute(f'''
+        INSERT INTO Inventory_Ledger (drug_id, quantity_change, reason, order_id, created_at)
+        SELECT oi.drug_id, SUM(oi.quantity), 'receipt', oi.order_id, ?
+        FROM Order_Items oi
+        JOIN Drugs d ON d.drug_id = oi.drug_id
+        WHERE oi.order_id IN ({placeholders})
+        GROUP BY oi.order_id, oi.drug_id
+    ''', [datetime.now().strftime('%Y-%m-%d %H:%M:%S')] + list(order_ids))
+
+def release_reservations(conn, order_ids):
+    """Gives back the stock reserved by (at most MAX_SQL_VARIABLES) orders, inside the caller's transaction.
+
+    The orders' 'reservation' ledger movements are reversed with one grouped
+    UPDATE, and one 'reservation_release' movement per order and batch is
+    logged. Orders that reserved nothing are unaffected.
+    """
+    placeholders = ', '.join('?' for _ in order_ids)
+    conn.execute(f'''
+        UPDATE Drugs SET quantity = quantity - held.units
+        FROM (
+            SELECT drug_id, SUM(quantity_change) AS units
+            FROM Inventory_Ledger
+            WHERE order_id IN ({placeholders}) AND reason = 'reservation'
+            GROUP BY drug_id
+        ) AS held
+        WHERE Drugs.drug_id = held.drug_id
+    ''', order_ids)
+    conn.execute(f'''
+        INSERT INTO Inventory_Ledger (drug_id, quantity_change, reason, order_id, created_at)
+        SELECT l.drug_id, -SUM(l.quantity_change), 'reservation_release', l.order_id, ?
+        FROM Inventory_Ledger l
+        JOIN Drugs d ON d.drug_id = l.drug_id
+        WHERE l.order_id IN ({placeholders}) AND l.reason = 'reservation'
+        GROUP BY l.order_id, l.drug_id
+    ''', [datetime.now().strftime('%Y-%m-%d %H:%M:%S')] + list(order_ids))
+
+@invalidates('Drugs')
+def update_inventory(drug_id, quantity_change, reason='adjustment', order_id=None):
+    """Updates a drug’s quantity (positive to add, negative to subtract) and logs the movement."""
+    with transaction() as conn:
+        apply_movements(conn, [(drug_id, quantity_change, reason, order_id)])
+
+def get_ledger(drug_id, limit=100):
+    """Returns a drug's most recent ledger entries, newest first."""
+    with get_db_connection() as conn:
+        return conn.execute('''
+            SELECT * FROM Inventory_Ledger
+            WHERE drug_id = ?
+            ORDER BY created_at DESC, entry_id DESC
+            LIMIT ?
+        ''', (drug_id, limit)).fetchall()
+
+def get_stock_at(drug_id, at):
+    """Returns a drug's quantity at a point in time ('YYYY-MM-DD HH:MM:SS'; a bare date means midnight).
+
+    Raises ValueError for times before the drug's history was compacted.
+    """
+    with get_db_connection() as conn:
+        balance = conn.execute('SELECT quantity, as_of FROM Inventory_Balances WHERE drug_id = ?',
+                               (drug_id,)).fetchone()
+        if balance is not None and at < balance['as_of']:
+            raise ValueError(f"Stock history of drug {drug_id} before {balance['as_of']} has been compacted")
+        moved = conn.execute('''
+            SELECT COALESCE(SUM(quantity_change), 0) FROM Inventory_Ledger
+            WHERE drug_id = ? AND created_at <= ?
+        ''', (drug_id, at)).fetchone()[0]
+    return (balance['quantity'] if balance is not None else 0) + moved
+
+def compact_ledger(before=None):
+    """Folds ledger entries older than `before` into Inventory_Balances and deletes them.
+
+    before is a 'YYYY-MM-DD HH:MM:SS' time, by default LEDGER_RETENTION_DAYS
+    ago. Point-in-time queries keep working from `before` onwards. The
+    reservations of Pending orders are kept, since release_reservations()
+    reads them. A `before` earlier than a previous run's never moves a
+    balance's as_of back, since the balance already covers the later
+    movements. Returns the number of entries removed.
+    """
+    if before is None:
+        before = (datetime.now() - timedelta(days=LEDGER_RETENTION_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+    compactable = '''
+        created_at < ? AND NOT (
+            reason = 'reservation' AND order_id IN (SELECT order_id FROM Orders WHERE status = 'Pending')
+        )
+    '''
+    with transaction(immediate=True) as conn:
+        conn.execute(f'''
+            INSERT INTO Inventory_Balances (drug_id, quantity, as_of)
+            SELECT drug_id, SUM(quantity_change), ?
+            FROM Inventory_Ledger
+            WHERE {compactable}
+            GROUP BY drug_id
+            ON CONFLICT (drug_id) DO UPDATE SET
+                quantity = quantity + excluded.quantity,
+                as_of = MAX(as_of, excluded.as_of)
+        ''', (before, before))
+        return conn.execute(f'DELETE FROM Inventory_Ledger WHERE {compactable}', (before,)).rowcount
+
+def get_ledger_summary():
+    """Returns the number of ledger entries, the oldest one's time and the latest compaction cutoff."""
+    with get_db_connection() as conn:
+        entries, oldest = conn.execute('SELECT COUNT(*), MIN(created_at) FROM Inventory_Ledger').fetchone()
+        compacted = conn.execute('SELECT MAX(as_of) FROM Inventory_Balances').fetchone()[0]
+    return {'entries': entries, 'oldest_entry': oldest, 'compacted_before': compacted}
+
+@invalidates('Drugs')
+def allocate_fefo(name, quantity, include_expired=False):
+    """Takes `quantity` units of a drug from its batches, first-expiry-first-out.
+
+    Batches are consumed in expiry order (expired ones are skipped unless
+    include_expired=True) and all decrements commit together. Returns the
+    allocations as dicts with drug_id, batch_number, expiry_date and quantity.
+    Raises ValueError, changing nothing, if there is not enough stock.
+    """
+    if quantity <= 0:
+        raise ValueError('Quantity must be positive')
+    today = '' if include_expired else datetime.now().strftime('%Y-%m-%d')
+    allocations = []
+    remaining = quantity
+    # BEGIN IMMEDIATE: no other writer can take the same batches between our read and update
+    with transaction(immediate=True) as conn:
+        batches = conn.execute('''
+            SELECT drug_id, batch_number, expiry_date, quantity
+            FROM Drugs
+            WHERE name = ? AND quantity > 0 AND expiry_date >= ?
+            ORDER BY expiry_date, drug_id
+        ''', (name, today))
+        for batch in batches:  # Stops reading as soon as the request is covered
+            taken = min(batch['quantity'], remaining)
+            allocations.append({'drug_id': batch['drug_id'], 'batch_number': batch['batch_number'],
+                                'expiry_date': batch['expiry_date'], 'quantity': taken})
+            remaining -= taken
+            if remaining == 0:
+                break
+        if remaining:
+            raise ValueError(f'Only {quantity - remaining} of {quantity} units of {name} are in stock')
+        apply_movements(conn, [(allocation['drug_id'], -allocation['quantity'], 'dispense', None)
+                               for allocation in allocations])
+    return allocations
 
 # Reporting Functions
+EXPIRY_BUCKETS = (7, 30, 90)  # Days ahead covered by get_expiry_buckets()
+
+@cached('Drugs')
+def get_expiry_buckets(as_of=None):
+    """Returns in-stock batches grouped into Expired / Within N days buckets.
+
+    One grouped query over the expiry index; returns a list of dicts with
+    bucket, batches and quantity for every bucket, empty ones included.
+    as_of is a 'YYYY-MM-DD' date (default: today).
+    """
+    with get_db_connection() as conn:
+        return query_expiry_buckets(conn, as_of)
+
+def query_expiry_buckets(conn, as_of=None):
+    """Runs get_expiry_buckets() on the given connection, e.g. a read-only one."""
+    today = datetime.strptime(as_of, '%Y-%m-%d') if as_of else datetime.now()
+    labels = ['Expired'] + [f'Within {days} days' for days in EXPIRY_BUCKETS]
+    limits = [today] + [today + timedelta(days=days) for days in EXPIRY_BUCKETS]
+    limits = [limit.strftime('%Y-%m-%d') for limit in limits]
+    cases = ' '.join('WHEN expiry_date < ? THEN ?' for _ in limits)
+    params = [value for pair in zip(limits, labels) for value in pair] + [limits[-1]]
+    rows = conn.execute(f'''
+        SELECT CASE {cases} END AS bucket, COUNT(*) AS batches, SUM(quantity) AS quantity
+        FROM Drugs
+        WHERE expiry_date < ? AND +quantity > 0  -- unary + keeps the planner on the expiry index
+        GROUP BY bucket
+    ''', params).fetchall()
+    totals = {bucket: (batches, quantity) for bucket, batches, quantity in rows}
+    return [{'bucket': label, 'batches': totals.get(label, (0, 0))[0], 'quantity': totals.get(label, (0, 0))[1]}
+            for label in labels]
+
+STOCK_LEVEL_TABLES = ('Stock_Levels', 'Drugs', 'Orders', 'Order_Items')  # Triggers keep Stock_Levels in step with these
+
+@cached(*STOCK_LEVEL_TABLES)
+def get_stock_levels():
+    """Returns on-hand stock, earliest expiry and pending inbound quantity per product."""
+    with get_db_connection() as conn:
+        return conn.execute('SELECT * FROM Stock_Levels ORDER BY name, manufacturer').fetchall()
+
+# Products whose stock plus pending orders is below their reorder threshold
+REORDER_REPORT_QUERY = '''
+    SELECT *, reorder_threshold - on_hand - pending_inbound AS shortfall
+    FROM Stock_Levels
+    WHERE on_hand + pending_inbound < reorder_threshold
+    ORDER BY shortfall DESC, name
+'''
+
+@cached(*STOCK_LEVEL_TABLES)
+def get_reorder_report():
+    """Returns products whose stock plus pending orders is below their reorder threshold."""
+    with get_db_connection() as conn:
+        return conn.execute(REORDER_REPORT_QUERY).fetchall()
+
+@invalidates('Stock_Levels')
+def set_reorder_threshold(name, manufacturer, threshold):
+    """Sets the reorder threshold of a product (drug name + manufacturer)."""
+    with transaction() as conn:
+        conn.execute('''
+            INSERT INTO Stock_Levels (name, manufacturer, reorder_threshold)
+            VALUES (?, ?, ?)
+            ON CONFLICT (name, manufacturer) DO UPDATE SET reorder_threshold = excluded.reorder_threshold
+        ''', (name, manufacturer, threshold))
+
+@cached('Drugs')
 def get_low_stock_drugs(threshold=10):
     """Returns drugs with quantity below the threshold (default 10)."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM Drugs WHERE quantity < ?', (threshold,))
-    drugs = cursor.fetchall()
-    conn.close()
-    return drugs
+    with get_db_connection() as conn:
+        return conn.execute('SELECT * FROM Drugs WHERE quantity < ?', (threshold,)).fetchall()
 
+@cached('Drugs')
 def get_expiring_soon_drugs(days=30):
     """Returns drugs expiring within the next 30 days."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
     expiry_date = (datetime.now() + timedelta(days=days)).strftime('%Y-%m-%d')
-    cursor.execute('SELECT * FROM Drugs WHERE expiry_date < ?', (expiry_date,))
-    drugs = cursor.fetchall()
-    conn.close()
-    return drugs
+    with get_db_connection() as conn:
+        return conn.execute('SELECT * FROM Drugs WHERE expiry_date < ?', (expiry_date,)).fetchall()
+
+# Drug change log, read by drug_snapshot.py and session_data.py
+def get_drug_changes(since=None):
+    """Returns (version, rows) for refreshing an in-memory copy of Drugs.
+
+    Rows are (drug_id, name, manufacturer, expiry_date, quantity): every drug
+    if since is None, else those changed after version `since`, with the
+    other columns None for deleted drugs. Pass the returned version as
+    `since` next time.
+    """
+    with get_db_connection() as conn:
+        # The version is read first: a write that commits in between is
+        # returned again next time, which is harmless
+        version = conn.execute('SELECT COALESCE(MAX(version), 0) FROM Drugs_Changes').fetchone()[0]
+        if since is None:
+            rows = conn.execute('SELECT drug_id, name, manufacturer, expiry_date, quantity FROM Drugs').fetchall()
+        else:
+            rows = conn.execute('''
+                SELECT c.drug_id, d.name, d.manufacturer, d.expiry_date, d.quantity
+                FROM Drugs_Changes c
+                LEFT JOIN Drugs d ON d.drug_id = c.drug_id
+                WHERE c.version > ?
+            ''', (since,)).fetchall()
+    return version, rows
 
-# Initialize the database
-init_db()
+# Time every public function; cached reads are timed including cache hits.
+# Context managers and decorators are left alone, since calling them does no work.
+instrumentation.instrument_functions(globals(), __name__,
+                                     exclude=('get_db_connection', 'transaction', 'cached', 'invalidates'))
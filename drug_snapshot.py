@@ -0,0 +1,253 @@
+"""A compact, columnar in-memory copy of the Drugs table for dashboards and search-as-you-type.
+
+Each column is a NumPy array with one entry per batch: drug_id, quantity,
+expiry as a day ordinal, and name and manufacturer as codes into a
+dictionary of distinct strings. Filters are vectorised over whole columns,
+so a query over tens of thousands of batches takes microseconds and no
+database round trip.
+
+The snapshot refreshes itself before each query. It is up to date after any
+write made by this process or reported by database.check_table_versions(),
+and otherwise checks the Drugs_Changes log at most every REFRESH_INTERVAL
+seconds. A refresh only reads the batches that changed since the last one.
+
+    snapshot = get_snapshot()
+    snapshot.find(name_prefix='amox', limit=20)
+    snapshot.low_stock(10)
+"""
+import bisect
+import functools
+import threading
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+import database
+
+REFRESH_INTERVAL = 1.0   # Seconds between checks for writes made by other processes
+INITIAL_CAPACITY = 1024  # Rows allocated up front; the columns double when full
+
+class Dictionary:
+    """Distinct strings and their codes, with a case-insensitive sorted index for prefix lookups."""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+        self._sorted = []  # (casefolded value, code), sorted
+        self._ranks = None
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+            bisect.insort(self._sorted, (value.casefold(), code))
+            self._ranks = None
+        return code
+
+    def prefix_codes(self, prefix):
+        """Returns the codes of every value starting with prefix, ignoring case."""
+        prefix = prefix.casefold()
+        start = bisect.bisect_left(self._sorted, (prefix,))
+        codes = []
+        for key, code in self._sorted[start:]:
+            if not key.startswith(prefix):
+                break
+            codes.append(code)
+        return codes
+
+    def ranks(self):
+        """Returns an array giving each code's position in sorted order."""
+        if self._ranks is None:
+            ranks = np.empty(len(self.values), np.int32)
+            ranks[[code for _, code in self._sorted]] = np.arange(len(self._sorted), dtype=np.int32)
+            self._ranks = ranks
+        return self._ranks
+
+    def nbytes(self):
+        return sum(len(value) + 49 for value in self.values)  # Roughly: str object overhead plus characters
+
+# Day ordinal of each 'YYYY-MM-DD' string seen; 0 for anything that doesn't parse
+_ordinals = {}
+
+def day_ordinal(value):
+    ordinal = _ordinals.get(value)
+    if ordinal is None:
+        try:
+            ordinal = date.fromisoformat(str(value)[:10]).toordinal()
+        except ValueError:
+            ordinal = 0
+        if len(_ordinals) < 100000:
+            _ordinals[value] = ordinal
+    return ordinal
+
+@functools.lru_cache(maxsize=4096)
+def iso_date(ordinal):
+    return date.fromordinal(ordinal).isoformat() if ordinal else None
+
+class DrugSnapshot:
+    """Columns of the Drugs table, kept in step with the database by refresh()."""
+
+    COLUMNS = ('drug_id', 'quantity', 'expiry', 'name', 'manufacturer')
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self, capacity=INITIAL_CAPACITY):
+        self.size = 0
+        self.drug_id = np.zeros(capacity, np.int64)
+        self.quantity = np.zeros(capacity, np.int64)
+        self.expiry = np.zeros(capacity, np.int32)        # date.toordinal(); 0 if it didn't parse
+        self.name = np.zeros(capacity, np.int32)          # Codes into self.names
+        self.manufacturer = np.zeros(capacity, np.int32)  # Codes into self.manufacturers
+        self.names = Dictionary()
+        self.manufacturers = Dictionary()
+        self._rows = {}  # drug_id -> row
+        self._version = None
+        self._backend = None
+        self._generation = None
+        self._checked = 0.0
+
+    # Loading
+    def _grow(self, needed):
+        capacity = len(self.drug_id)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for column in self.COLUMNS:
+            old = getattr(self, column)
+            new = np.zeros(capacity, old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, column, new)
+
+    def _put(self, row, drug_id, name, manufacturer, expiry_date, quantity):
+        self.drug_id[row] = drug_id
+        self.quantity[row] = quantity
+        self.expiry[row] = day_ordinal(expiry_date)
+        self.name[row] = self.names.encode(name)
+        self.manufacturer[row] = self.manufacturers.encode(manufacturer)
+
+    def _remove(self, drug_id):
+        """Deletes a batch by moving the last row into its place."""
+        row = self._rows.pop(drug_id)
+        last = self.size - 1
+        if row != last:
+            for column in self.COLUMNS:
+                values = getattr(self, column)
+                values[row] = values[last]
+            self._rows[int(self.drug_id[row])] = row
+        self.size = last
+
+    def _apply(self, changes):
+        self._grow(self.size + len(changes))
+        for drug_id, name, manufacturer, expiry_date, quantity in changes:
+            row = self._rows.get(drug_id)
+            if name is None:  # Deleted
+                if row is not None:
+                    self._remove(drug_id)
+                continue
+            if row is None:
+                row = self._rows[drug_id] = self.size
+                self.size += 1
+            self._put(row, drug_id, name, manufacturer, expiry_date, quantity)
+
+    def refresh(self, force=False):
+        """Brings the snapshot up to date. Returns the number of batches read."""
+        backend = database.get_backend()
+        generation = database.get_table_generation('Drugs')
+        if (not force and self._backend is backend and generation == self._generation
+                and time.monotonic() < self._checked + REFRESH_INTERVAL):
+            return 0
+        with self._lock:
+            if self._backend is not backend:
+                self._reset()  # database.configure() pointed us at another database
+            version, changes = database.get_drug_changes(self._version)
+            if self._version is not None and version < self._version:
+                self._reset()  # The database was replaced behind our back
+                version, changes = database.get_drug_changes()
+            self._apply(changes)
+            # Generations are read before the changes, so a write that lands
+            # during the read makes the next refresh check again
+            self._version, self._backend, self._generation = version, backend, generation
+            self._checked = time.monotonic()
+            return len(changes)
+
+    # Queries
+    def _rows_for(self, positions, order):
+        if order == 'name':
+            keys = (self.expiry[positions], self.names.ranks()[self.name[positions]])
+        elif order == 'expiry':
+            keys = (self.names.ranks()[self.name[positions]], self.expiry[positions])
+        else:
+            keys = (self.names.ranks()[self.name[positions]], self.quantity[positions])
+        return positions[np.lexsort(keys)]
+
+    def find(self, name_prefix=None, below=None, expiring_within=None, as_of=None, limit=None, order='name'):
+        """Returns the batches matching every filter given, as dicts.
+
+        name_prefix matches the start of the name, ignoring case; below keeps
+        batches with a quantity under it; expiring_within keeps batches (in
+        stock or not) expiring within that many days of as_of (a date, default
+        today), expired ones included. Results are ordered by 'name',
+        'expiry' or 'quantity'.
+        """
+        self.refresh()
+        with self._lock:
+            size = self.size
+            mask = np.ones(size, bool)
+            if name_prefix is not None:
+                wanted = np.zeros(len(self.names.values), bool)
+                wanted[self.names.prefix_codes(name_prefix)] = True
+                mask &= wanted[self.name[:size]]
+            if below is not None:
+                mask &= self.quantity[:size] < below
+            if expiring_within is not None:
+                limit_day = (as_of or date.today()) + timedelta(days=expiring_within)
+                mask &= self.expiry[:size] < limit_day.toordinal()
+            positions = self._rows_for(np.flatnonzero(mask), order)[:limit]
+            return self._as_dicts(positions)
+
+    def low_stock(self, threshold=10, limit=None):
+        """Batches with fewer than threshold units, lowest first (like database.get_low_stock_drugs)."""
+        return self.find(below=threshold, limit=limit, order='quantity')
+
+    def expiring(self, days=30, limit=None):
+        """Batches expiring within days, soonest first (like database.get_expiring_soon_drugs)."""
+        return self.find(expiring_within=days, limit=limit, order='expiry')
+
+    def _as_dicts(self, positions):
+        names, manufacturers = self.names.values, self.manufacturers.values
+        return [{'drug_id': drug_id, 'name': names[name], 'manufacturer': manufacturers[manufacturer],
+                 'expiry_date': iso_date(expiry), 'quantity': quantity}
+                for drug_id, name, manufacturer, expiry, quantity in zip(
+                    self.drug_id[positions].tolist(), self.name[positions].tolist(),
+                    self.manufacturer[positions].tolist(), self.expiry[positions].tolist(),
+                    self.quantity[positions].tolist())]
+
+    def stats(self):
+        """Returns the number of batches and distinct names, the version read and the bytes held."""
+        with self._lock:
+            columns = sum(getattr(self, column).nbytes for column in self.COLUMNS)
+            return {
+                'batches': self.size,
+                'names': len(self.names.values),
+                'manufacturers': len(self.manufacturers.values),
+                'version': self._version,
+                'column_bytes': columns,
+                'dictionary_bytes': self.names.nbytes() + self.manufacturers.nbytes(),
+            }
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+def get_snapshot():
+    """Returns the process-wide snapshot, loading it on first use."""
+    global _snapshot
+    if _snapshot is None:
+        with _snapshot_lock:
+            if _snapshot is None:
+                _snapshot = DrugSnapshot()
+    return _snapshot
@@ -0,0 +1,153 @@
+"""Streaming export of drugs, suppliers and order history to CSV, JSONL or Parquet.
+
+Rows are read from a database cursor in fixed-size chunks and written out
+straight away, so memory use stays constant however large the tables are.
+
+Usage:
+    python export.py drugs --format csv --output drugs.csv
+    python export.py orders --format parquet
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+
+import database
+
+CHUNK_SIZE = 5000
+
+# Datasets that can be exported and the query that produces each one
+EXPORTS = {
+    'drugs': 'SELECT * FROM Drugs ORDER BY drug_id',
+    'suppliers': 'SELECT * FROM Suppliers ORDER BY supplier_id',
+    # One row per order item; orders without items appear once with empty item columns
+    'orders': '''
+        SELECT o.order_id, o.order_date, o.status, o.supplier_id, s.name AS supplier_name,
+               oi.order_item_id, oi.drug_id, d.name AS drug_name, d.batch_number, oi.quantity
+        FROM Orders o
+        LEFT JOIN Suppliers s ON s.supplier_id = o.supplier_id
+        LEFT JOIN Order_Items oi ON oi.order_id = o.order_id
+        LEFT JOIN Drugs d ON d.drug_id = oi.drug_id
+        ORDER BY o.order_id, oi.order_item_id
+    ''',
+}
+
+EXPORT_FORMATS = {'csv': '.csv', 'jsonl': '.jsonl', 'parquet': '.parquet'}
+
+def iter_chunks(dataset, chunk_size=CHUNK_SIZE):
+    """Yields (columns, rows) for a dataset, at most chunk_size rows at a time.
+
+    There is always at least one (possibly empty) chunk, so even an empty
+    export gets its header.
+    """
+    with database.get_db_connection() as conn:
+        cursor = conn.execute(EXPORTS[dataset])
+        columns = [description[0] for description in cursor.description]
+        while True:
+            rows = [tuple(row) for row in cursor.fetchmany(chunk_size)]
+            yield columns, rows
+            if len(rows) < chunk_size:
+                break
+
+def write_csv(dataset, out, chunk_size=CHUNK_SIZE):
+    """Writes a dataset to a text stream as CSV with a header row. Returns the row count."""
+    writer = csv.writer(out)
+    count = 0
+    for columns, rows in iter_chunks(dataset, chunk_size):
+        if count == 0:
+            writer.writerow(columns)
+        writer.writerows(rows)
+        count += len(rows)
+    return count
+
+def write_jsonl(dataset, out, chunk_size=CHUNK_SIZE):
+    """Writes a dataset to a text stream as one JSON object per line. Returns the row count."""
+    count = 0
+    for columns, rows in iter_chunks(dataset, chunk_size):
+        out.writelines(json.dumps(dict(zip(columns, row))) + '\n' for row in rows)
+        count += len(rows)
+    return count
+
+def arrow_type(column):
+    """Returns the Parquet column type: integers for IDs and quantities, text otherwise."""
+    import pyarrow as pa
+    return pa.int64() if column == 'quantity' or column.endswith('_id') else pa.string()
+
+def write_parquet(dataset, path, chunk_size=CHUNK_SIZE):
+    """Writes a dataset to a Parquet file, one row group per chunk. Returns the row count.
+
+    Needs pyarrow, which is installed along with Streamlit.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError('Parquet export needs pyarrow (pip install pyarrow)')
+    writer = None
+    count = 0
+    try:
+        for columns, rows in iter_chunks(dataset, chunk_size):
+            if writer is None:
+                schema = pa.schema([(column, arrow_type(column)) for column in columns])
+                writer = pq.ParquetWriter(path, schema)
+            if not rows:
+                continue
+            # Transpose the chunk into columns
+            arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            count += len(rows)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+def export(dataset, fmt, path, chunk_size=CHUNK_SIZE):
+    """Exports a dataset to a file in the given format. Returns the row count."""
+    if dataset not in EXPORTS:
+        raise ValueError(f'Unknown dataset {dataset!r}; choose one of {", ".join(EXPORTS)}')
+    if fmt == 'parquet':
+        return write_parquet(dataset, path, chunk_size)
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'Unknown format {fmt!r}; choose one of {", ".join(EXPORT_FORMATS)}')
+    writer = write_csv if fmt == 'csv' else write_jsonl
+    with open(path, 'w', newline='', encoding='utf-8') as out:
+        return writer(dataset, out, chunk_size)
+
+def export_to_tempfile(dataset, fmt, chunk_size=CHUNK_SIZE):
+    """Exports a dataset to a new temporary file and returns its path. The caller deletes it."""
+    fd, path = tempfile.mkstemp(prefix=f'{dataset}_', suffix=EXPORT_FORMATS[fmt])
+    os.close(fd)
+    try:
+        export(dataset, fmt, path, chunk_size)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description='Export drug inventory data without loading it into memory.')
+    parser.add_argument('dataset', choices=list(EXPORTS))
+    parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv')
+    parser.add_argument('--output', help="output file (default: <dataset>.<format>; '-' writes CSV/JSONL to stdout)")
+    parser.add_argument('--database', default=database.DB_PATH, help='SQLite database file (default: %(default)s)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='rows read per chunk (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    if args.database != database.DB_PATH:
+        database.configure(db_path=args.database)
+    if args.output == '-':
+        if args.format == 'parquet':
+            parser.error('Parquet output must go to a file')
+        writer = write_csv if args.format == 'csv' else write_jsonl
+        count = writer(args.dataset, sys.stdout, args.chunk_size)
+    else:
+        output = args.output or args.dataset + EXPORT_FORMATS[args.format]
+        count = export(args.dataset, args.format, output, args.chunk_size)
+        print(f'Exported {count} rows to {output}', file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
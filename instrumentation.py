@@ -0,0 +1,359 @@
+"""Call and query metrics for the database layer, with a slow-query log.
+
+database.py opens its SQLite connections with InstrumentedConnection, and
+DB-API backends build their cursors on TimedCursor, so every SQL statement
+is timed from execute() until its cursor is exhausted or dropped, and its
+rows are counted. Public database functions are wrapped with
+instrument(), and the pool reports how long opening and holding a
+connection took. Statements slower than SLOW_QUERY_MS are logged together
+with their EXPLAIN QUERY PLAN.
+
+    snapshot()          # Aggregates as plain dicts (used by the admin page)
+    prometheus_text()   # The same aggregates in the Prometheus text format
+"""
+import functools
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+SLOW_QUERY_MS = 100       # Statements slower than this are logged with their query plan
+SLOW_QUERY_LOG_SIZE = 100 # Most recent slow statements kept for the admin page
+LATENCY_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)  # Histogram bounds in seconds
+METRIC_PREFIX = 'drug_inventory'
+
+logger = logging.getLogger('drug_inventory.slow_queries')
+
+class Stat:
+    """Count, errors, rows, total/max seconds and a latency histogram for one name."""
+
+    __slots__ = ('count', 'errors', 'rows', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = self.errors = self.rows = 0
+        self.total = self.max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # The last one counts everything slower
+
+    def add(self, seconds, rows=0, error=False):
+        self.count += 1
+        self.errors += error
+        self.rows += rows
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def quantile(self, q):
+        """Estimates a latency quantile as the upper bound of the bucket it falls in."""
+        if not self.count:
+            return 0.0
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS + (self.max,), self.buckets):
+            seen += count
+            if seen >= q * self.count:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            'calls': self.count,
+            'errors': self.errors,
+            'rows': self.rows,
+            'total_ms': self.total * 1000,
+            'mean_ms': self.total / self.count * 1000 if self.count else 0.0,
+            'p50_ms': self.quantile(0.5) * 1000,
+            'p95_ms': self.quantile(0.95) * 1000,
+            'max_ms': self.max * 1000,
+        }
+
+class Metrics:
+    """Thread-safe registry of Stats, grouped by kind ('function', 'query', 'connection')."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {'function': {}, 'query': {}, 'connection': {}}
+        self.slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+    def record(self, kind, name, seconds, rows=0, error=False):
+        with self._lock:
+            stat = self._stats[kind].get(name)
+            if stat is None:
+                stat = self._stats[kind][name] = Stat()
+            stat.add(seconds, rows, error)
+
+    def snapshot(self, kind):
+        """Returns {name: stats dict} for one kind, slowest total first."""
+        with self._lock:
+            stats = {name: stat.as_dict() for name, stat in self._stats[kind].items()}
+        return dict(sorted(stats.items(), key=lambda item: -item[1]['total_ms']))
+
+    def histograms(self, kind):
+        """Returns (name, bucket counts, total seconds, count, errors, rows) for one kind."""
+        with self._lock:
+            return [(name, list(stat.buckets), stat.total, stat.count, stat.errors, stat.rows)
+                    for name, stat in self._stats[kind].items()]
+
+    def reset(self):
+        with self._lock:
+            for stats in self._stats.values():
+                stats.clear()
+            self.slow_queries.clear()
+
+metrics = Metrics()
+
+# SQL statements
+_whitespace = re.compile(r'\s+')
+_placeholder_list = re.compile(r'\?(?:\s*,\s*\?)+')
+
+def normalize_sql(sql):
+    """Collapses whitespace and IN (?, ?, ...) lists so one statement shape gets one entry."""
+    return _placeholder_list.sub('?, ...', _whitespace.sub(' ', sql).strip())
+
+def explain(conn, sql, parameters):
+    """Returns the EXPLAIN QUERY PLAN of a statement as indented lines, or the error it raised."""
+    if not isinstance(conn, sqlite3.Connection):
+        return '(no plan: not an SQLite connection)'
+    try:
+        # A plain cursor, so the EXPLAIN itself isn't measured
+        rows = conn.cursor(sqlite3.Cursor).execute('EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()
+    except sqlite3.Error as e:
+        return f'(no plan: {e})'
+    depths = {0: -1}
+    lines = []
+    for row in rows:
+        node_id, parent = row[0], row[1]
+        depths[node_id] = depths.get(parent, -1) + 1
+        lines.append('  ' * depths[node_id] + row[-1])
+    return '\n'.join(lines) or '(no plan)'
+
+# Statements that are not worth a query plan
+UNPLANNED = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE', 'PRAGMA', 'CREATE', 'DROP', 'ANALYZE')
+
+class TimedCursor:
+    """Cursor mixin that times each statement, fetches included, and counts the rows returned.
+
+    Goes before the cursor class it instruments, e.g. class C(TimedCursor, sqlite3.Cursor).
+    """
+
+    _sql = None
+
+    def _start(self, sql, parameters):
+        self._finish()
+        self._sql, self._parameters, self._plan = sql, parameters, None
+        self._elapsed, self._rows, self._error = 0.0, 0, False
+
+    def _slow(self, sql):
+        return self._elapsed * 1000 >= SLOW_QUERY_MS and not sql.lstrip().upper().startswith(UNPLANNED)
+
+    def _finish(self, owned=True):
+        """Records the statement that ran last, once its rows have been read (or abandoned).
+
+        owned is False when the cursor is being garbage-collected: its
+        connection may be back in the pool and in use by another thread, so
+        a plan not captured yet is not looked up.
+        """
+        sql, self._sql = self._sql, None
+        if sql is None:
+            return
+        metrics.record('query', normalize_sql(sql), self._elapsed, self._rows, self._error)
+        if self._slow(sql):
+            plan = self._plan
+            if plan is None:
+                plan = (explain(self.connection, sql, self._parameters) if owned
+                        else '(no plan: the cursor was dropped before its last row)')
+            metrics.slow_queries.append({
+                'at': datetime.now().isoformat(timespec='seconds'),
+                'ms': self._elapsed * 1000,
+                'rows': self._rows,
+                'sql': normalize_sql(sql),
+                'plan': plan,
+            })
+            logger.warning('Slow query (%.1f ms, %d rows): %s\n%s', self._elapsed * 1000, self._rows,
+                           normalize_sql(sql), plan)
+
+    def _timed(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        except Exception:
+            self._error = True
+            raise
+        finally:
+            self._elapsed += time.perf_counter() - started
+
+    def execute(self, sql, parameters=()):
+        self._start(sql, parameters)
+        try:
+            self._timed(super().execute, sql, parameters)
+        except Exception:
+            self._finish()
+            raise
+        if self._slow(sql):
+            # Already slow: plan it now, while the caller still holds the connection
+            self._plan = explain(self.connection, sql, parameters)
+        if self.description is None:
+            self._finish()  # Not a query: nothing more to fetch
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        self._start(sql, seq_of_parameters[0] if seq_of_parameters else ())
+        try:
+            self._timed(super().executemany, sql, seq_of_parameters)
+        finally:
+            self._finish()
+        return self
+
+    def fetchone(self):
+        if self._sql is None:
+            return super().fetchone()
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._finish()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        if self._sql is None:
+            return super().fetchmany(self.arraysize if size is None else size)
+        size = self.arraysize if size is None else size
+        rows = self._timed(super().fetchmany, size)
+        self._rows += len(rows)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        if self._sql is None:
+            return super().fetchall()
+        rows = self._timed(super().fetchall)
+        self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # A cursor dropped before its last row (e.g. a single fetchone()) is recorded here
+        try:
+            self._finish(owned=False)
+        except Exception:
+            pass
+
+class InstrumentedCursor(TimedCursor, sqlite3.Cursor):
+    """An sqlite3 cursor that times its statements."""
+
+class InstrumentedConnection(sqlite3.Connection):
+    """A connection whose execute() and executemany() go through InstrumentedCursor."""
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or InstrumentedCursor)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+# Functions and connections
+def instrument(func):
+    """Wraps a function so every call is counted and timed under its name."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        error = False
+        try:
+            return func(*args, **kwargs)
+        except BaseException:
+            error = True
+            raise
+        finally:
+            metrics.record('function', func.__name__, time.perf_counter() - started, error=error)
+    return wrapper
+
+def instrument_functions(namespace, module, exclude=()):
+    """Wraps every public function defined in module (given its globals) with instrument()."""
+    for name, value in list(namespace.items()):
+        if (not name.startswith('_') and name not in exclude and callable(value) and not isinstance(value, type)
+                and getattr(value, '__module__', None) == module):
+            namespace[name] = instrument(value)
+
+def record_connection(event, seconds):
+    """Records how long opening ('open') or borrowing ('checkout') a connection took."""
+    metrics.record('connection', event, seconds)
+
+# Reports
+def snapshot():
+    """Returns all aggregates: per function, per SQL statement, connections and recent slow queries."""
+    return {
+        'functions': metrics.snapshot('function'),
+        'queries': metrics.snapshot('query'),
+        'connections': metrics.snapshot('connection'),
+        'slow_queries': list(metrics.slow_queries),
+    }
+
+def reset():
+    """Clears every aggregate and the slow-query log."""
+    metrics.reset()
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def prometheus_text(gauges=None):
+    """Returns the aggregates in the Prometheus text exposition format.
+
+    gauges is an optional {name: value} dict of extra values to include,
+    such as the query cache statistics.
+    """
+    lines = []
+    families = (
+        ('function', 'function', 'Time spent in database functions.'),
+        ('query', 'query', 'Time spent executing and fetching SQL statements.'),
+        ('connection', 'event', 'Time spent opening and holding pooled connections.'),
+    )
+    for kind, label, help_text in families:
+        metric = f'{METRIC_PREFIX}_{kind}_seconds'
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} histogram')
+        errors, rows = [], []
+        for name, buckets, total, count, error_count, row_count in metrics.histograms(kind):
+            labels = f'{label}="{_label(name)}"'
+            cumulative = 0
+            for bound, bucket in zip(LATENCY_BUCKETS, buckets):
+                cumulative += bucket
+                lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'{metric}_sum{{{labels}}} {total:.6f}')
+            lines.append(f'{metric}_count{{{labels}}} {count}')
+            errors.append(f'{METRIC_PREFIX}_{kind}_errors_total{{{labels}}} {error_count}')
+            rows.append(f'{METRIC_PREFIX}_{kind}_rows_total{{{labels}}} {row_count}')
+        if kind != 'connection':
+            lines.append(f'# TYPE {METRIC_PREFIX}_{kind}_errors_total counter')
+            lines.extend(errors)
+        if kind == 'query':
+            lines.append(f'# TYPE {METRIC_PREFIX}_{kind}_rows_total counter')
+            lines.extend(rows)
+    for name, value in (gauges or {}).items():
+        metric = f'{METRIC_PREFIX}_{name}'
+        lines.append(f'# TYPE {metric} gauge')
+        lines.append(f'{metric} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,120 @@
+"""Report engine: computes the Reports page's tables concurrently as compact DataFrames.
+
+Each report runs on its own read-only connection in a thread pool. Every
+report is a single aggregate query, so the heavy lifting (e.g. summing
+millions of order items) happens inside SQLite. SQLite releases the GIL
+while it does, so the reports genuinely run in parallel, and only the
+small aggregated result crosses into Python as a DataFrame. The order
+reports reach Order_Items through its order_id index, starting from the
+date range, so a month-end run reads only that month's items.
+
+    frames = run_reports(since='2026-09-01', until='2026-09-30')
+    st.dataframe(frames['supplier_volume'])
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import database
+
+REPORT_WORKERS = 4
+EXPIRING_DAYS = 30         # Batches expiring within this many days are listed
+
+READ_ONLY_PRAGMAS = (
+    'PRAGMA cache_size = -64000',      # 64 MB: reports scan more than the app's page views
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA temp_store = MEMORY',
+)
+
+@contextmanager
+def read_only_connection():
+    """Opens a read-only connection to the current database, separate from the write pool."""
+    database.init_db()
+    backend = database.get_backend()
+    conn = backend.connect(read_only=True)
+    try:
+        if backend.name == 'sqlite':
+            for pragma in READ_ONLY_PRAGMAS:
+                conn.execute(pragma)
+        yield conn
+    finally:
+        conn.close()
+
+def query_frame(conn, sql, parameters=()):
+    """Runs a query and returns its result as a DataFrame."""
+    cursor = conn.execute(sql, parameters)
+    columns = [description[0] for description in cursor.description]
+    return pd.DataFrame(cursor.fetchall(), columns=columns)
+
+# Stock reports
+def low_stock(conn, since, until):
+    # Products below their own reorder threshold, from the Stock_Levels aggregate
+    return query_frame(conn, database.REORDER_REPORT_QUERY)
+
+def expiring_soon(conn, since, until):
+    limit = (datetime.now() + timedelta(days=EXPIRING_DAYS)).strftime('%Y-%m-%d')
+    return query_frame(conn, '''
+        SELECT drug_id, name, batch_number, manufacturer, expiry_date, quantity
+        FROM Drugs
+        WHERE expiry_date < ? AND +quantity > 0
+        ORDER BY expiry_date, name
+    ''', (limit,))
+
+def expiry_buckets(conn, since, until):
+    return pd.DataFrame(database.query_expiry_buckets(conn))
+
+# Order reports (supplier "volume" is in units, since orders carry no prices)
+def supplier_volume(conn, since, until):
+    return query_frame(conn, '''
+        SELECT o.supplier_id, IFNULL(s.name, '(unknown supplier)') AS supplier,
+               COUNT(DISTINCT o.order_id) AS orders, COUNT(oi.order_id) AS lines,
+               TOTAL(oi.quantity) AS units,
+               TOTAL(CASE WHEN o.status = 'Pending' THEN oi.quantity END) AS pending_units,
+               MAX(o.order_date) AS last_order
+        FROM Orders o
+        LEFT JOIN Order_Items oi ON oi.order_id = o.order_id
+        LEFT JOIN Suppliers s ON s.supplier_id = o.supplier_id
+        WHERE o.order_date BETWEEN ? AND ?
+        GROUP BY o.supplier_id
+        ORDER BY units DESC
+    ''', (since, until))
+
+def daily_throughput(conn, since, until):
+    return query_frame(conn, '''
+        SELECT o.order_date, COUNT(DISTINCT o.order_id) AS orders, COUNT(oi.order_id) AS lines,
+               TOTAL(oi.quantity) AS units,
+               TOTAL(CASE WHEN o.status = 'Pending' THEN oi.quantity END) AS pending_units
+        FROM Orders o
+        LEFT JOIN Order_Items oi ON oi.order_id = o.order_id
+        WHERE o.order_date BETWEEN ? AND ?
+        GROUP BY o.order_date
+        ORDER BY o.order_date
+    ''', (since, until))
+
+# Report name -> function(conn, since, until) returning a DataFrame
+REPORTS = {
+    'low_stock': low_stock,
+    'expiring_soon': expiring_soon,
+    'expiry_buckets': expiry_buckets,
+    'supplier_volume': supplier_volume,
+    'daily_throughput': daily_throughput,
+}
+
+def _run_report(name, since, until):
+    with read_only_connection() as conn:
+        return REPORTS[name](conn, since, until)
+
+def run_reports(names=tuple(REPORTS), since=None, until=None, workers=REPORT_WORKERS):
+    """Computes the named reports concurrently and returns {name: DataFrame}.
+
+    since and until ('YYYY-MM-DD', inclusive) limit the order reports to a
+    period; by default they cover every order.
+    """
+    since = since or '0000-01-01'
+    until = until or '9999-12-31'
+    names = list(names)
+    with ThreadPoolExecutor(max_workers=min(workers, len(names)) or 1, thread_name_prefix='report') as pool:
+        frames = pool.map(_run_report, names, [since] * len(names), [until] * len(names))
+        return dict(zip(names, frames))
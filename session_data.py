@@ -0,0 +1,173 @@
+"""Lookups for app.py that are built once and shared by every Streamlit session.
+
+Streamlit reruns app.py on every interaction. Instead of rebuilding the
+supplier and drug pickers from full table reads each time, the app asks
+this module for them. The supplier lookup is kept in a View held by
+st.cache_resource and is rebuilt only when database.py reports a write to
+Suppliers, including writes made by other processes and app nodes (see
+database.check_table_versions). Drugs are written far more often, by every
+dispense and receipt, so the drug lookup (DrugNames) instead reads the
+batches changed since its last refresh from the Drugs_Changes log, and
+only inserts, deletes and renames touch the index. An unchanged rerun
+costs a few dictionary lookups, plus a Table_Versions read with a DB-API
+backend.
+
+Report frames are cached the same way, keyed by the write generations of
+the tables they read.
+"""
+import bisect
+import threading
+import time
+
+import streamlit as st
+
+import database
+import reports
+
+MAX_INSERTED_NAMES = 100  # Beyond this many added or removed names, NameIndex.updated() re-sorts
+
+class View:
+    """A value built from some tables, rebuilt only after one of them changes."""
+
+    def __init__(self, tables, build):
+        self.tables = tables
+        self.build = build
+        self._lock = threading.Lock()
+        self._generations = None
+        self._expires = 0.0
+        self._value = None
+
+    def _stale(self, generations):
+        return generations != self._generations or time.monotonic() >= self._expires
+
+    def get(self):
+        """Returns the current value, rebuilding it first if its tables were written."""
+        generations = tuple(database.get_table_generation(table) for table in self.tables)
+        if self._stale(generations):
+            with self._lock:
+                if self._stale(generations):
+                    # Generations are read before building, so a write that lands
+                    # during the build makes the next get() rebuild again
+                    self._value = self.build()
+                    self._generations = generations
+                    self._expires = time.monotonic() + database.CACHE_TTL
+        return self._value
+
+class NameIndex:
+    """Names in display order plus a name -> ID dict."""
+
+    def __init__(self, rows):
+        self.ids = {name: row_id for name, row_id in rows}
+        self.names = list(self.ids)
+
+    def updated(self, ids):
+        """Returns a copy with the names in the {name: ID or None to drop} dict changed."""
+        index = NameIndex(())
+        index.ids, index.names = dict(self.ids), self.names
+        added, removed = [], []
+        for name, row_id in ids.items():
+            if row_id is not None:
+                if name not in index.ids:
+                    added.append(name)
+                index.ids[name] = row_id
+            elif index.ids.pop(name, None) is not None:
+                removed.append(name)
+        if len(added) + len(removed) > MAX_INSERTED_NAMES:
+            index.names = sorted(index.ids)  # Same order as SQLite's ORDER BY name
+        elif added or removed:
+            index.names = list(self.names)
+            for name in removed:
+                index.names.pop(bisect.bisect_left(index.names, name))
+            for name in added:
+                bisect.insort(index.names, name)
+        return index
+
+class DrugNames:
+    """The NameIndex of drug names, each mapped to its first batch, kept up to date from Drugs_Changes.
+
+    A refresh reads only the batches changed since the last one. Changes
+    that keep a batch's name, like quantity edits, leave the index as it is;
+    inserts, deletes and renames produce an updated copy, so sessions
+    holding the old one are unaffected.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._index = NameIndex(())
+        self._names = {}     # drug_id -> name
+        self._batches = {}   # name -> set of drug_ids
+        self._version = None
+        self._backend = None
+        self._generation = None
+
+    def get(self):
+        """Returns the current NameIndex, refreshing it first if Drugs was written."""
+        backend = database.get_backend()
+        generation = database.get_table_generation('Drugs')
+        if backend is not self._backend or generation != self._generation:
+            with self._lock:
+                if backend is not self._backend or generation != self._generation:
+                    self._refresh(backend)
+                    # As in View.get(), the generation is read before the changes
+                    self._backend, self._generation = backend, generation
+        return self._index
+
+    def _refresh(self, backend):
+        if backend is not self._backend:
+            self._reset()  # database.configure() pointed us at another database
+        version, changes = database.get_drug_changes(self._version)
+        if self._version is not None and version < self._version:
+            self._reset()  # The database was replaced behind our back
+            version, changes = database.get_drug_changes()
+        renamed = set()
+        for drug_id, name, *_ in changes:
+            old = self._names.get(drug_id)
+            if name == old:
+                continue
+            if old is not None:
+                self._batches[old].discard(drug_id)
+                renamed.add(old)
+            if name is None:
+                del self._names[drug_id]
+            else:
+                self._names[drug_id] = name
+                self._batches.setdefault(name, set()).add(drug_id)
+                renamed.add(name)
+        if renamed:
+            ids = {}
+            for name in renamed:
+                drug_ids = self._batches.get(name)
+                if not drug_ids:
+                    self._batches.pop(name, None)
+                ids[name] = min(drug_ids) if drug_ids else None
+            self._index = self._index.updated(ids)
+        self._version = version
+
+@st.cache_resource
+def _views():
+    return {
+        'drugs': DrugNames(),
+        'suppliers': View(('Suppliers',), lambda: NameIndex(database.get_supplier_names())),
+    }
+
+def drug_index():
+    """Returns the NameIndex of drug names, each mapped to its first batch. Don't modify it."""
+    return _views()['drugs'].get()
+
+def supplier_index():
+    """Returns the NameIndex of supplier names. Don't modify it."""
+    return _views()['suppliers'].get()
+
+REPORT_TABLES = ('Stock_Levels', 'Drugs', 'Suppliers', 'Orders', 'Order_Items')
+
+@st.cache_data(ttl=database.CACHE_TTL, max_entries=32, show_spinner="Computing reports...")
+def _report_frames(since, until, generations):
+    return reports.run_reports(since=since, until=until)
+
+def report_frames(since=None, until=None):
+    """Returns reports.run_reports() for a period, recomputed only after its tables are written."""
+    generations = tuple(database.get_table_generation(table) for table in REPORT_TABLES)
+    return _report_frames(since, until, generations)
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the top of the repository, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+@pytest.fixture
+def db(tmp_path):
+    """Points database.py at a fresh SQLite file for one test."""
+    old_path = database.DB_PATH
+    database.configure(db_path=str(tmp_path / 'test.db'))
+    database.init_db()
+    yield database
+    database.configure(db_path=old_path)
@@ -0,0 +1,46 @@
+"""Login throttling and the client address it is keyed on."""
+import importlib.util
+
+import pytest
+
+import auth
+
+def test_forwarded_client_trusts_only_the_proxy_entries():
+    # The client sent a spoofed entry; our one proxy appended the real address
+    assert auth.forwarded_client(['6.6.6.6, 203.0.113.7'], trusted_proxies=1) == '203.0.113.7'
+    assert auth.forwarded_client(['6.6.6.6', '203.0.113.7'], trusted_proxies=1) == '203.0.113.7'
+    assert auth.forwarded_client(['6.6.6.6, 203.0.113.7, 10.0.0.2'], trusted_proxies=2) == '203.0.113.7'
+    assert auth.forwarded_client(['203.0.113.7'], trusted_proxies=3) == '203.0.113.7'
+
+def test_forwarded_client_without_a_usable_header():
+    assert auth.forwarded_client([], trusted_proxies=1) is None
+    assert auth.forwarded_client([' , '], trusted_proxies=1) is None
+    assert auth.forwarded_client(['203.0.113.7'], trusted_proxies=0) is None
+
+def test_forwarded_for_is_ignored_unless_a_proxy_is_configured(monkeypatch):
+    monkeypatch.delenv('DRUG_INVENTORY_TRUSTED_PROXIES', raising=False)
+    spec = importlib.util.find_spec('auth')
+    fresh = importlib.util.module_from_spec(spec)  # A separate copy with the default settings
+    spec.loader.exec_module(fresh)
+    assert fresh.forwarded_client(['203.0.113.7']) is None
+
+@pytest.fixture
+def small_buckets(monkeypatch):
+    monkeypatch.setattr(auth, '_user_buckets', auth.TokenBuckets(100, 60))
+    monkeypatch.setattr(auth, '_client_buckets', auth.TokenBuckets(3, 60))
+    monkeypatch.setattr(auth, '_unidentified_buckets', auth.TokenBuckets(3, 60))
+    monkeypatch.setattr(auth.database, 'verify_user', lambda username, password: False)
+
+def test_spoofed_headers_share_the_proxy_address_bucket(db, small_buckets):
+    for i in range(3):
+        client = auth.forwarded_client([f'10.9.8.{i}, 203.0.113.7'], trusted_proxies=1)
+        assert not auth.login(f'user{i}', 'guess', client)
+    with pytest.raises(auth.LoginThrottled):
+        auth.login('user9', 'guess', auth.forwarded_client(['10.9.8.9, 203.0.113.7'], trusted_proxies=1))
+    assert not auth.login('user9', 'guess', '198.51.100.1')  # Other clients are unaffected
+
+def test_unidentified_clients_share_one_bucket(db, small_buckets):
+    for i in range(3):
+        assert not auth.login(f'user{i}', 'guess', None)
+    with pytest.raises(auth.LoginThrottled):
+        auth.login('user9', 'guess', None)
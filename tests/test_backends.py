@@ -0,0 +1,195 @@
+"""Conformance tests: database.py must behave the same on every storage backend.
+
+Each test runs against SQLiteBackend, DBAPIBackend over Python's sqlite3
+module (the local stand-in for a server), and DBAPIBackend over a driver
+with the 'format' paramstyle, to exercise placeholder translation.
+"""
+import re
+import sqlite3
+import types
+
+import pytest
+
+import backends
+import database
+
+def format_driver():
+    """A DB-API module with paramstyle 'format', wrapping sqlite3."""
+    driver = types.ModuleType('format_driver')
+    for name in ('Error', 'IntegrityError', 'InterfaceError', 'OperationalError', 'ProgrammingError'):
+        setattr(driver, name, getattr(sqlite3, name))
+    driver.paramstyle = 'format'
+
+    class Cursor:
+        def __init__(self, cursor):
+            self._cursor = cursor
+            self.arraysize = 1
+
+        def _sql(self, sql):
+            assert '?' not in re.sub(r"'(?:[^']|'')*'", '', sql), sql  # Every placeholder was translated
+            return sql.replace('%s', '?').replace('%%', '%')
+
+        def execute(self, sql, parameters):
+            self._cursor.execute(self._sql(sql), parameters)
+
+        def executemany(self, sql, seq_of_parameters):
+            self._cursor.executemany(self._sql(sql), seq_of_parameters)
+
+        description = property(lambda self: self._cursor.description)
+        rowcount = property(lambda self: self._cursor.rowcount)
+        lastrowid = property(lambda self: self._cursor.lastrowid)
+        fetchone = lambda self: self._cursor.fetchone()
+        fetchmany = lambda self, size: self._cursor.fetchmany(size)
+        fetchall = lambda self: self._cursor.fetchall()
+        close = lambda self: self._cursor.close()
+
+    class Connection:
+        autocommit = False
+
+        def __init__(self, database):
+            self._conn = sqlite3.connect(database, check_same_thread=False, isolation_level=None)
+
+        def cursor(self):
+            return Cursor(self._conn.cursor())
+
+        def close(self):
+            self._conn.close()
+
+    driver.connect = Connection
+    return driver
+
+BACKENDS = {
+    'sqlite': lambda path: backends.SQLiteBackend(path, database.CONNECTION_PRAGMAS),
+    'dbapi-sqlite3': lambda path: backends.DBAPIBackend('sqlite3', path, check_same_thread=False),
+    'dbapi-format': lambda path: backends.DBAPIBackend(format_driver(), database=path),
+}
+
+@pytest.fixture(params=list(BACKENDS))
+def backend_db(request, tmp_path):
+    """database.py on a fresh database, through each backend in turn."""
+    old_path = database.DB_PATH
+    database.configure(backend=BACKENDS[request.param](str(tmp_path / 'test.db')))
+    yield database
+    database.configure(db_path=old_path)
+
+def test_schema_is_migrated_once(backend_db):
+    db = backend_db
+    db.init_db()
+    assert db.get_schema_version() == db.MIGRATIONS[-1][0]
+    db.migrate()
+    with db.get_db_connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM schema_version').fetchone()[0] == len(db.MIGRATIONS)
+
+def test_drugs_and_suppliers(backend_db):
+    db = backend_db
+    # Placeholders and percent signs inside values must pass through untouched
+    db.add_drug('Aspirin 100%', 'B1', '2030-01-01', "O'Maker ?", 50, 'cool')
+    db.add_drug('Ibuprofen', 'B2', '2030-06-01', 'Maker', 5, '')
+    db.add_supplier('Acme', 'orders@acme.example', '1 Main Street')
+    drugs = db.get_all_drugs()
+    assert [(row['name'], row['manufacturer'], row['quantity']) for row in drugs] == [
+        ('Aspirin 100%', "O'Maker ?", 50), ('Ibuprofen', 'Maker', 5)]
+    assert drugs[0]['NAME'] == drugs[0][1] == 'Aspirin 100%'  # By name (any case) or position
+    assert list(drugs[0].keys())[:3] == ['drug_id', 'name', 'batch_number']
+    assert [row['name'] for row in db.search_drugs('aspir')] == ['Aspirin 100%']
+    assert [row['name'] for row in db.search_suppliers('acm')] == ['Acme']
+    rows, cursor = db.get_drugs_page(page_size=1)
+    assert [row['drug_id'] for row in rows] == [1] and cursor == (1, 1)
+    assert (db.count_drugs(), db.count_suppliers()) == (2, 1)
+    assert [row['name'] for row in db.get_low_stock_drugs()] == ['Ibuprofen']
+
+    db.update_drug(2, 'Ibuprofen', 'B2', '2030-06-01', 'Maker', 25, '')
+    db.delete_drug(1)
+    assert [(row['drug_id'], row['quantity']) for row in db.get_all_drugs()] == [(2, 25)]
+    assert [(row['quantity_change'], row['reason']) for row in db.get_ledger(2)] == [(20, 'correction'), (5, 'opening')]
+
+def test_orders(backend_db):
+    db = backend_db
+    db.add_drug('Aspirin', 'B1', '2030-01-01', 'Maker', 50, '')
+    db.add_supplier('Acme', 'c', 'a')
+    order_id = db.place_order(1, 'Pending', [{'name': 'Aspirin', 'quantity': 10}])
+    assert [row['status'] for row in db.search_orders(str(order_id))] == ['Pending']
+    assert db.get_stock_levels()[0]['pending_inbound'] == 10
+    with pytest.raises(ValueError):
+        db.place_order(1, 'Pending', [{'drug_id': 1, 'quantity': 500}], reserve_stock=True)
+    assert db.count_orders() == 1  # The failed order left nothing behind
+    assert db.receive_orders([order_id]) == [order_id]
+    assert db.get_all_drugs()[0]['quantity'] == 60
+    assert db.get_stock_levels()[0]['pending_inbound'] == 0
+
+def test_duplicate_username_is_rejected(backend_db):
+    db = backend_db
+    assert db.add_user('alice', 'secret')
+    assert not db.add_user('alice', 'other')  # The backend's IntegrityError is caught
+    assert db.verify_user('alice', 'secret') and not db.verify_user('alice', 'wrong')
+
+def test_transactions(backend_db):
+    db = backend_db
+    db.add_drug('Aspirin', 'B1', '2030-01-01', 'Maker', 50, '')
+    with pytest.raises(RuntimeError):
+        with db.transaction() as conn:
+            conn.execute('UPDATE Drugs SET quantity = 0 WHERE drug_id = 1')
+            raise RuntimeError
+    assert db.get_all_drugs.uncached()[0]['quantity'] == 50
+    with db.transaction() as conn:
+        db.update_inventory(1, -10)  # Joins the outer transaction
+        conn.execute('UPDATE Drugs SET quantity = quantity - 5 WHERE drug_id = 1')
+    assert db.get_all_drugs.uncached()[0]['quantity'] == 35
+
+def test_pool_discards_disconnected_connections(tmp_path):
+    backend = BACKENDS['dbapi-sqlite3'](str(tmp_path / 'test.db'))
+    pool = database.ConnectionPool(backend, size=1)
+    with pool.connection() as conn:
+        first = conn
+    with pytest.raises(sqlite3.OperationalError):
+        with pool.connection() as conn:
+            assert conn is first
+            conn.raw.close()  # The server went away mid-call
+            raise sqlite3.OperationalError('server closed the connection unexpectedly')
+    with pool.connection() as conn:
+        assert conn is not first  # The failed connection was closed, not reused
+    pool.close()
+
+def test_pool_keeps_connections_after_statement_errors(tmp_path):
+    backend = BACKENDS['dbapi-sqlite3'](str(tmp_path / 'test.db'))
+    pool = database.ConnectionPool(backend, size=1)
+    with pool.connection() as conn:
+        first = conn
+    with pytest.raises(sqlite3.OperationalError):
+        with pool.transaction() as conn:
+            conn.execute('SELECT * FROM no_such_table')
+    with pool.connection() as conn:
+        assert conn is first  # A bad statement is not a dead connection
+        assert conn.execute('SELECT 1').fetchone()[0] == 1
+    pool.close()
+
+@pytest.mark.parametrize('paramstyle, expected', [
+    ('qmark', "SELECT * FROM t WHERE a = ? AND b LIKE '?%' AND c = ?"),
+    ('format', "SELECT * FROM t WHERE a = %s AND b LIKE '?%%' AND c = %s"),
+    ('pyformat', "SELECT * FROM t WHERE a = %(p1)s AND b LIKE '?%%' AND c = %(p2)s"),
+    ('numeric', "SELECT * FROM t WHERE a = :1 AND b LIKE '?%' AND c = :2"),
+    ('named', "SELECT * FROM t WHERE a = :p1 AND b LIKE '?%' AND c = :p2"),
+])
+def test_translate_placeholders(paramstyle, expected):
+    sql = "SELECT * FROM t WHERE a = ? AND b LIKE '?%' AND c = ?"
+    assert backends.translate_placeholders(sql, paramstyle) == expected
+
+def test_backend_from_url():
+    backend = backends.backend_from_url('sqlite3:////tmp/inventory.db?check_same_thread=0&timeout=5')
+    assert backend.driver is sqlite3
+    assert backend.connect_kwargs == {'database': '/tmp/inventory.db', 'check_same_thread': 0, 'timeout': 5}
+    with pytest.raises(ValueError):
+        backends.backend_from_url('drug_inventory.db')
+
+def test_dbapi_backend_refuses_other_dialects(tmp_path):
+    driver = format_driver()
+
+    class ServerConnection(driver.connect):
+        def __init__(self, database):
+            super().__init__(database)
+            self._conn.create_function('sqlite_version', 0, lambda: 1 / 0)  # As on a server without it
+
+    driver.connect = ServerConnection
+    backend = backends.DBAPIBackend(driver, database=str(tmp_path / 'test.db'))
+    with pytest.raises(ValueError, match="SQLite's SQL"):
+        backend.connect()
@@ -0,0 +1,73 @@
+"""Bulk import: row validation, per-row retry of failed batches and index rebuilds."""
+import bulk_import
+
+DRUG_HEADER = 'drug_id,name,batch_number,expiry_date,manufacturer,quantity,storage_conditions\n'
+
+def write(path, text):
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+def test_invalid_rows_are_rejected_with_their_line(db, tmp_path):
+    path = write(tmp_path / 'drugs.csv', DRUG_HEADER + (
+        ',Amoxicillin,A1,2030-01-01,Acme,100,\n'
+        ',Ibuprofen,I1,31/12/2030,Acme,50,\n'     # Not YYYY-MM-DD
+        ',Cetirizine,C1,2030-01-01,Acme,-5,\n'    # Negative quantity
+        ',,X1,2030-01-01,Acme,5,\n'               # Missing name
+        'abc,Zinc,Z1,2030-01-01,Acme,5,\n'        # Non-numeric ID
+        ',Paracetamol,P1,2030-01-01,Acme,10,Cool\n'
+    ))
+    summary = bulk_import.import_file('drugs', path)
+    assert (summary['read'], summary['inserted'], summary['rejected']) == (6, 2, 4)
+    assert [line for line, _ in summary['errors']] == [3, 4, 5, 6]
+    assert 'expiry_date' in summary['errors'][0][1] and 'name is required' in summary['errors'][2][1]
+    assert [drug['name'] for drug in db.get_all_drugs()] == ['Amoxicillin', 'Paracetamol']
+
+def test_jsonl_lines_that_are_not_objects_are_rejected(db, tmp_path):
+    path = write(tmp_path / 'orders.jsonl', (
+        '{"order_date": "2026-01-05", "supplier_id": 1, "status": "Received"}\n'
+        'not json\n'
+        '\n'
+        '[1, 2]\n'
+        '{"order_date": "2026-01-06", "supplier_id": 1, "status": "Shipped"}\n'
+    ))
+    summary = bulk_import.import_file('orders', path)
+    assert summary['inserted'] == 1
+    assert [line for line, _ in summary['errors']] == [2, 4, 5]
+    assert 'not a JSON object' in summary['errors'][0][1]
+
+def test_a_constraint_error_only_rejects_its_own_row(db):
+    db.add_drug('Amoxicillin', 'A1', '2030-01-01', 'Acme', 100, '')
+    rows = [(i, {'drug_id': drug_id, 'name': f'Drug {drug_id}', 'batch_number': 'B', 'expiry_date': '2030-01-01',
+                 'manufacturer': 'Acme', 'quantity': 1})
+            for i, drug_id in enumerate([2, 3, 1, 4, 5, 5, 6], start=2)]  # 1 exists; 5 is repeated
+    summary = bulk_import.import_rows('drugs', rows, batch_size=4)
+    assert (summary['inserted'], summary['rejected']) == (5, 2)
+    assert [line for line, _ in summary['errors']] == [4, 7]
+    assert [drug['drug_id'] for drug in db.get_all_drugs()] == [1, 2, 3, 4, 5, 6]
+    assert db.get_all_drugs()[0]['name'] == 'Amoxicillin'  # The existing row was left alone
+
+def test_imports_are_visible_to_cached_reads(db):
+    assert db.count_drugs() == 0
+    bulk_import.import_rows('drugs', [(2, {'name': 'Amoxicillin', 'batch_number': 'A1', 'expiry_date': '2030-01-01',
+                                           'manufacturer': 'Acme', 'quantity': 5})])
+    assert db.count_drugs() == 1
+
+def test_dropped_indexes_are_rebuilt(db):
+    def indexes():
+        with db.get_db_connection() as conn:
+            rows = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' "
+                                "AND tbl_name = 'Order_Items' AND sql IS NOT NULL").fetchall()
+        return sorted(tuple(row) for row in rows)
+    before = indexes()
+    assert before
+    rows = [(2, {'order_id': 1, 'drug_id': 1, 'quantity': 3}), (3, {'order_id': 1, 'drug_id': 2, 'quantity': -1})]
+    summary = bulk_import.import_rows('order_items', rows, rebuild_indexes=True)
+    assert (summary['inserted'], summary['rejected']) == (1, 1)
+    assert indexes() == before
+
+def test_cli_reports_rejected_rows(db, tmp_path, capsys):
+    path = write(tmp_path / 'suppliers.csv', 'name,contact_info,address\nAcme Supply,Ann,\n,Bob,\n')
+    assert bulk_import.main(['suppliers', path]) == 1
+    captured = capsys.readouterr()
+    assert 'inserted 1, rejected 1' in captured.out
+    assert 'line 3: name is required' in captured.err
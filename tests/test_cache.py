@@ -0,0 +1,72 @@
+"""Query cache: @cached results are retired by @invalidates writes through table generations."""
+import pytest
+
+import database
+
+def test_hits_until_one_of_its_tables_is_written():
+    cache = database.QueryCache()
+    loads = []
+    load = lambda: loads.append(1) or len(loads)
+    assert cache.get_or_load('k', ('Drugs', 'Orders'), load) == 1
+    assert cache.get_or_load('k', ('Drugs', 'Orders'), load) == 1
+    cache.invalidate('Suppliers')
+    assert cache.get_or_load('k', ('Drugs', 'Orders'), load) == 1
+    cache.invalidate('Orders')
+    assert cache.get_or_load('k', ('Drugs', 'Orders'), load) == 2
+    assert cache.stats()['hits'] == 2 and cache.stats()['misses'] == 2
+
+def test_a_write_during_a_load_retires_its_result():
+    cache = database.QueryCache()
+    def load_while_written():
+        cache.invalidate('Drugs')  # Another thread commits while we read
+        return 'old'
+    assert cache.get_or_load('k', ('Drugs',), load_while_written) == 'old'
+    assert cache.get_or_load('k', ('Drugs',), lambda: 'new') == 'new'
+
+def test_least_recently_used_entries_are_evicted():
+    cache = database.QueryCache(max_entries=2)
+    cache.get_or_load('a', ('Drugs',), lambda: 'a')
+    cache.get_or_load('b', ('Drugs',), lambda: 'b')
+    cache.get_or_load('a', ('Drugs',), lambda: 'reloaded')  # 'a' is now the most recent
+    cache.get_or_load('c', ('Drugs',), lambda: 'c')
+    assert cache.get_or_load('a', ('Drugs',), lambda: 'reloaded') == 'a'
+    assert cache.get_or_load('b', ('Drugs',), lambda: 'reloaded') == 'reloaded'
+    assert cache.stats()['evictions'] == 2
+
+def test_results_expire_after_the_ttl():
+    cache = database.QueryCache(ttl=0)
+    cache.get_or_load('k', ('Drugs',), lambda: 'first')
+    assert cache.get_or_load('k', ('Drugs',), lambda: 'second') == 'second'
+    assert cache.stats()['expirations'] == 1
+
+def test_writes_retire_cached_reads(db):
+    assert db.count_drugs() == 0
+    assert db.count_drugs() == 0
+    db.add_drug('Amoxicillin', 'A1', '2030-01-01', 'Acme', 100, '')
+    assert db.count_drugs() == 1
+    db.update_drug(1, 'Amoxicillin', 'A1', '2030-01-01', 'Acme', 60, '')
+    assert db.get_all_drugs()[0]['quantity'] == 60
+    assert db.cache_stats()['hits'] >= 1
+
+def test_transactions_see_their_own_writes_and_rollbacks_keep_the_cache(db):
+    assert db.count_drugs() == 0
+    generation = db.get_table_generation('Drugs')
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.add_drug('Amoxicillin', 'A1', '2030-01-01', 'Acme', 100, '')
+            assert db.count_drugs() == 1  # Read inside the transaction, not from the cache
+            raise RuntimeError('abandon the transaction')
+    assert db.get_table_generation('Drugs') == generation
+    assert db.count_drugs() == 0
+
+def test_generations_change_only_after_commit(db):
+    generation = db.get_table_generation('Drugs')
+    with db.transaction():
+        db.add_drug('Amoxicillin', 'A1', '2030-01-01', 'Acme', 100, '')
+        assert db.get_table_generation('Drugs') == generation
+    assert db.get_table_generation('Drugs') != generation
+
+def test_unhashable_arguments_are_not_cached(db):
+    misses = db.cache_stats()['misses']
+    assert db.get_order_details([1, 2]) == {1: [], 2: []}
+    assert db.cache_stats()['misses'] == misses
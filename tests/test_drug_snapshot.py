@@ -0,0 +1,83 @@
+"""In-memory drug snapshot: incremental refreshes must leave it equal to the Drugs table."""
+from datetime import date, timedelta
+
+import pytest
+
+pytest.importorskip('numpy')
+
+import drug_snapshot
+
+def day(offset):
+    return (date.today() + timedelta(days=offset)).isoformat()
+
+def table(db):
+    return sorted((row['drug_id'], row['name'], row['manufacturer'], row['expiry_date'], row['quantity'])
+                  for row in db.get_all_drugs.uncached())
+
+def contents(snapshot):
+    return sorted(tuple(batch[column] for column in ('drug_id', 'name', 'manufacturer', 'expiry_date', 'quantity'))
+                  for batch in snapshot.find())
+
+@pytest.fixture
+def stocked(db):
+    db.add_drug('Aspirin', 'A1', day(90), 'Acme', 40, '')      # 1
+    db.add_drug('Amoxicillin', 'B1', day(5), 'Beta', 3, '')    # 2
+    db.add_drug('ibuprofen', 'I1', day(-2), 'Acme', 0, '')     # 3: expired, out of stock
+    db.add_drug('Zinc', 'Z1', day(400), 'Zeta', 7, '')         # 4
+    return db
+
+def test_initial_load_matches_the_table(stocked):
+    snapshot = drug_snapshot.DrugSnapshot()
+    assert snapshot.refresh(force=True) == 4
+    assert contents(snapshot) == table(stocked)
+    assert snapshot.refresh(force=True) == 0  # Nothing changed since
+    assert snapshot.stats()['batches'] == 4
+
+def test_incremental_refresh_follows_adds_updates_and_deletes(stocked):
+    snapshot = drug_snapshot.DrugSnapshot()
+    snapshot.refresh(force=True)
+    stocked.add_drug('Paracetamol', 'P1', day(60), 'Acme', 12, '')
+    stocked.update_drug(2, 'Amoxicillin', 'B1', day(5), 'Beta', 30, '')
+    assert snapshot.refresh(force=True) == 2
+    assert contents(snapshot) == table(stocked)
+
+    stocked.delete_drug(1)  # The last row moves into the freed slot
+    assert snapshot.refresh(force=True) == 1
+    assert contents(snapshot) == table(stocked)
+    stocked.update_drug(5, 'Paracetamol', 'P1', day(60), 'Acme', 2, '')  # Updates the moved row in place
+    stocked.delete_drug(4)
+    snapshot.refresh(force=True)
+    assert contents(snapshot) == table(stocked)
+    assert snapshot.stats()['batches'] == 3
+
+def test_writes_are_seen_without_forcing(stocked):
+    snapshot = drug_snapshot.DrugSnapshot()
+    assert len(snapshot.find()) == 4
+    stocked.delete_drug(3)  # Bumps the Drugs generation, so the next query reads the change
+    assert [batch['drug_id'] for batch in snapshot.find(name_prefix='i')] == []
+
+def test_find_filters(stocked):
+    snapshot = drug_snapshot.DrugSnapshot()
+    assert [batch['name'] for batch in snapshot.find(name_prefix='a')] == ['Amoxicillin', 'Aspirin']
+    assert [batch['name'] for batch in snapshot.find(name_prefix='IBU')] == ['ibuprofen']
+    assert snapshot.find(name_prefix='x') == []
+    assert [batch['drug_id'] for batch in snapshot.find(below=5)] == [2, 3]
+    assert [batch['drug_id'] for batch in snapshot.find(expiring_within=30)] == [2, 3]
+    assert [batch['drug_id'] for batch in snapshot.find(expiring_within=30, as_of=date.today() + timedelta(days=80))] == [2, 1, 3]
+    assert [batch['drug_id'] for batch in snapshot.find(name_prefix='a', below=5, expiring_within=30)] == [2]
+    assert len(snapshot.find(limit=2)) == 2
+
+def test_low_stock_and_expiring_order(stocked):
+    snapshot = drug_snapshot.DrugSnapshot()
+    assert [(batch['name'], batch['quantity']) for batch in snapshot.low_stock(threshold=10)] == [
+        ('ibuprofen', 0), ('Amoxicillin', 3), ('Zinc', 7)]
+    assert [batch['expiry_date'] for batch in snapshot.expiring(days=100)] == [day(-2), day(5), day(90)]
+    assert [batch['name'] for batch in snapshot.expiring(days=100, limit=1)] == ['ibuprofen']
+
+def test_reconfigure_resets_the_snapshot(stocked, tmp_path):
+    snapshot = drug_snapshot.DrugSnapshot()
+    assert len(snapshot.find()) == 4
+    stocked.configure(db_path=str(tmp_path / 'other.db'))
+    stocked.init_db()
+    stocked.add_drug('Zinc', 'Z9', day(30), 'Zeta', 1, '')
+    assert [(batch['drug_id'], batch['name']) for batch in snapshot.find()] == [(1, 'Zinc')]
@@ -0,0 +1,59 @@
+"""FEFO allocation and expiry buckets."""
+from datetime import date, timedelta
+
+import pytest
+
+def days_from_today(days):
+    return (date.today() + timedelta(days=days)).isoformat()
+
+@pytest.fixture
+def batches(db):
+    db.add_drug('Amoxicillin', 'LATE', days_from_today(200), 'Acme', 10, '')       # 1
+    db.add_drug('Amoxicillin', 'SOON', days_from_today(20), 'Acme', 4, '')         # 2
+    db.add_drug('Amoxicillin', 'EXPIRED', days_from_today(-1), 'Acme', 50, '')     # 3
+    db.add_drug('Amoxicillin', 'SOON-2', days_from_today(20), 'Generic Co', 3, '') # 4, ties with 2
+    db.add_drug('Amoxicillin', 'EMPTY', days_from_today(5), 'Acme', 0, '')         # 5
+    db.add_drug('Ibuprofen', 'I1', days_from_today(1), 'Acme', 100, '')            # 6
+    return db
+
+def quantities(db):
+    return {drug['drug_id']: drug['quantity'] for drug in db.get_all_drugs()}
+
+def test_allocates_first_expiry_first(batches):
+    db = batches
+    allocations = db.allocate_fefo('Amoxicillin', 9)
+    assert [(a['batch_number'], a['quantity']) for a in allocations] == [('SOON', 4), ('SOON-2', 3), ('LATE', 2)]
+    assert quantities(db) == {1: 8, 2: 0, 3: 50, 4: 0, 5: 0, 6: 100}
+    assert [(row['quantity_change'], row['reason']) for row in db.get_ledger(1)][0] == (-2, 'dispense')
+
+def test_expired_batches_only_when_asked(batches):
+    db = batches
+    allocations = db.allocate_fefo('Amoxicillin', 51, include_expired=True)
+    assert [(a['batch_number'], a['quantity']) for a in allocations] == [('EXPIRED', 50), ('SOON', 1)]
+
+def test_shortfall_changes_nothing(batches):
+    db = batches
+    before = quantities(db)
+    with pytest.raises(ValueError, match='Only 17 of 18 units'):
+        db.allocate_fefo('Amoxicillin', 18)
+    with pytest.raises(ValueError):
+        db.allocate_fefo('Paracetamol', 1)
+    with pytest.raises(ValueError):
+        db.allocate_fefo('Amoxicillin', 0)
+    assert quantities(db) == before
+
+def test_expiry_buckets(batches):
+    db = batches
+    buckets = {bucket['bucket']: (bucket['batches'], bucket['quantity']) for bucket in db.get_expiry_buckets()}
+    assert buckets == {
+        'Expired': (1, 50),
+        'Within 7 days': (1, 100),   # The empty batch is not counted
+        'Within 30 days': (2, 7),
+        'Within 90 days': (0, 0),
+    }
+    later = (date.today() + timedelta(days=180)).isoformat()
+    assert db.get_expiry_buckets(as_of=later)[1:] == [
+        {'bucket': 'Within 7 days', 'batches': 0, 'quantity': 0},
+        {'bucket': 'Within 30 days', 'batches': 1, 'quantity': 10},
+        {'bucket': 'Within 90 days', 'batches': 0, 'quantity': 0},
+    ]
@@ -0,0 +1,49 @@
+"""Statement timing and the slow-query log."""
+import gc
+import sqlite3
+
+import pytest
+
+import instrumentation
+
+@pytest.fixture
+def conn(monkeypatch):
+    monkeypatch.setattr(instrumentation, 'SLOW_QUERY_MS', 0)
+    instrumentation.reset()
+    conn = sqlite3.connect(':memory:', isolation_level=None, factory=instrumentation.InstrumentedConnection)
+    conn.execute('CREATE TABLE t (a INTEGER)')
+    conn.executemany('INSERT INTO t VALUES (?)', [(i,) for i in range(10)])
+    instrumentation.reset()
+    yield conn
+    conn.close()
+    instrumentation.reset()
+
+def test_slow_queries_are_planned_while_the_caller_holds_the_connection(conn, monkeypatch):
+    planned = []
+    explain = instrumentation.explain
+    monkeypatch.setattr(instrumentation, 'explain', lambda *args: planned.append(args[1]) or explain(*args))
+    cursor = conn.execute('SELECT a FROM t WHERE a > ?', (3,))
+    assert planned == ['SELECT a FROM t WHERE a > ?']
+    assert cursor.fetchone()[0] == 4
+    del cursor
+    gc.collect()
+    assert planned == ['SELECT a FROM t WHERE a > ?']  # Not planned again when the cursor was dropped
+    [slow] = instrumentation.snapshot()['slow_queries']
+    assert slow['rows'] == 1 and 'SCAN t' in slow['plan']
+
+def test_dropped_cursors_do_not_touch_the_connection(conn, monkeypatch):
+    monkeypatch.setattr(instrumentation, 'SLOW_QUERY_MS', float('inf'))
+    cursor = conn.execute('SELECT a FROM t')
+    cursor.fetchone()
+    monkeypatch.setattr(instrumentation, 'SLOW_QUERY_MS', 0)  # Only slow once abandoned
+    monkeypatch.setattr(instrumentation, 'explain', lambda *args: pytest.fail('planned from __del__'))
+    del cursor
+    gc.collect()
+    [slow] = instrumentation.snapshot()['slow_queries']
+    assert slow['plan'].startswith('(no plan')
+
+def test_statements_are_timed_with_their_rows(conn):
+    conn.execute('SELECT a FROM t WHERE a IN (?, ?, ?)', (1, 2, 3)).fetchall()
+    stats = instrumentation.snapshot()['queries']
+    assert stats['SELECT a FROM t WHERE a IN (?, ...)']['calls'] == 1
+    assert stats['SELECT a FROM t WHERE a IN (?, ...)']['rows'] == 3
@@ -0,0 +1,45 @@
+"""Inventory ledger: movements, point-in-time stock and compaction."""
+import pytest
+
+import compact_ledger
+
+def backdate(db, drug_id, created_at):
+    with db.transaction() as conn:
+        conn.execute('UPDATE Inventory_Ledger SET created_at = ? WHERE drug_id = ?', (created_at, drug_id))
+
+def test_movements_are_logged(db):
+    db.add_drug('Amoxicillin', 'B1', '2030-01-01', 'Acme', 100, '')
+    db.update_inventory(1, -30, 'dispense')
+    assert [(row['quantity_change'], row['reason']) for row in db.get_ledger(1)] == [(-30, 'dispense'), (100, 'opening')]
+    assert db.get_stock_at(1, '9999-12-31') == 70
+
+def test_compact_ledger_keeps_the_retention_window(db):
+    db.add_drug('Amoxicillin', 'B1', '2030-01-01', 'Acme', 100, '')
+    backdate(db, 1, '2000-01-01 00:00:00')
+    db.update_inventory(1, -30, 'dispense')
+    assert db.compact_ledger() == 1  # Only the opening entry is older than LEDGER_RETENTION_DAYS
+    assert db.get_ledger_summary()['entries'] == 1
+    assert db.get_stock_at(1, '9999-12-31') == 70
+    with pytest.raises(ValueError):
+        db.get_stock_at(1, '2000-06-01')
+
+def test_compact_ledger_cli(db, capsys):
+    db.add_drug('Amoxicillin', 'B1', '2030-01-01', 'Acme', 100, '')
+    backdate(db, 1, '2000-01-01 00:00:00')
+    assert compact_ledger.main(['--keep-days', '30']) == 0
+    assert 'Folded 1 entries' in capsys.readouterr().out
+    assert db.get_ledger_summary()['entries'] == 0
+    assert db.get_stock_at(1, '9999-12-31') == 100
+
+def test_earlier_compaction_keeps_the_later_cutoff(db):
+    db.add_drug('Amoxicillin', 'B1', '2030-01-01', 'Acme', 100, '')
+    db.add_supplier('Acme Supply', 'Ann', '555-0100')
+    order_id = db.place_order(1, 'Pending', [{'drug_id': 1, 'quantity': 30}], reserve_stock=True)
+    backdate(db, 1, '2000-01-01 00:00:00')
+    assert db.compact_ledger('2002-01-01 00:00:00') == 1  # The Pending order's reservation is kept
+    db.cancel_orders([order_id])
+    assert db.compact_ledger('2000-06-01 00:00:00') == 1  # Now folds the reservation
+    assert db.get_ledger_summary()['compacted_before'] == '2002-01-01 00:00:00'
+    with pytest.raises(ValueError):
+        db.get_stock_at(1, '2001-01-01')
+    assert db.get_stock_at(1, '9999-12-31') == 100
@@ -0,0 +1,80 @@
+"""Order lifecycle: receipts, cancellations and stock reservations."""
+import inspect
+
+import pytest
+
+@pytest.fixture
+def stocked(db):
+    db.add_drug('Amoxicillin', 'B1', '2030-01-01', 'Acme', 100, '')
+    db.add_supplier('Acme Supply', 'Ann', '555-0100')
+    return db
+
+def quantity(db, drug_id=1):
+    return db.get_all_drugs()[drug_id - 1]['quantity']
+
+def reasons(db, drug_id=1):
+    return [(row['quantity_change'], row['reason']) for row in reversed(db.get_ledger(drug_id))]
+
+def test_receipt_adds_items_once(stocked):
+    db = stocked
+    order_id = db.place_order(1, 'Pending', [{'drug_id': 1, 'quantity': 20}])
+    assert db.receive_orders([order_id]) == [order_id]
+    assert db.receive_orders([order_id]) == []
+    assert quantity(db) == 120
+
+def test_cancel_releases_reservation(stocked):
+    db = stocked
+    order_id = db.place_order(1, 'Pending', [{'drug_id': 1, 'quantity': 30}, {'name': 'Amoxicillin', 'quantity': 10}],
+                              reserve_stock=True)
+    assert quantity(db) == 60
+    db.cancel_orders([order_id])
+    assert quantity(db) == 100
+    assert reasons(db) == [(100, 'opening'), (-40, 'reservation'), (40, 'reservation_release')]
+    assert db.get_stock_at(1, '9999-12-31') == 100
+
+def test_receipt_releases_reservation_then_adds_items(stocked):
+    db = stocked
+    order_id = db.place_order(1, 'Pending', [{'drug_id': 1, 'quantity': 30}], reserve_stock=True)
+    db.receive_orders([order_id])
+    assert quantity(db) == 130
+    assert reasons(db) == [(100, 'opening'), (-30, 'reservation'), (30, 'reservation_release'), (30, 'receipt')]
+
+def test_cancel_without_reservation_leaves_stock(stocked):
+    db = stocked
+    order_id = db.place_order(1, 'Pending', [{'drug_id': 1, 'quantity': 30}])
+    db.cancel_orders([order_id])
+    assert quantity(db) == 100
+    assert reasons(db) == [(100, 'opening')]
+
+def test_only_pending_orders_reserve(stocked):
+    db = stocked
+    db.place_order(1, 'Cancelled', [{'drug_id': 1, 'quantity': 30}], reserve_stock=True)
+    assert quantity(db) == 100
+
+def test_finished_orders_cannot_change(stocked):
+    db = stocked
+    order_id = db.place_order(1, 'Pending', [{'drug_id': 1, 'quantity': 30}], reserve_stock=True)
+    db.cancel_orders([order_id])
+    with pytest.raises(ValueError):
+        db.receive_orders([order_id])
+    assert quantity(db) == 100
+
+def test_compaction_keeps_pending_reservations(stocked):
+    db = stocked
+    order_id = db.place_order(1, 'Pending', [{'drug_id': 1, 'quantity': 30}], reserve_stock=True)
+    with db.transaction() as conn:
+        conn.execute("UPDATE Inventory_Ledger SET created_at = '2000-01-01 00:00:00'")
+    assert db.compact_ledger() == 1  # The opening entry, not the reservation
+    db.cancel_orders([order_id])
+    assert quantity(db) == 100
+    assert db.get_stock_at(1, '9999-12-31') == 100
+
+def test_names_are_resolved_inside_the_order_transaction(stocked, monkeypatch):
+    db = stocked
+    resolve, in_transaction = db.resolve_drug_ids, []
+    monkeypatch.setattr(db, 'resolve_drug_ids',
+                        lambda names: in_transaction.append(db._pool.in_transaction()) or resolve(names))
+    place_order = inspect.unwrap(db.place_order)  # Without the @invalidates transaction around it
+    place_order(1, 'Pending', [{'name': 'Amoxicillin', 'quantity': 5}], reserve_stock=True)
+    assert in_transaction == [True]
+    assert quantity(db) == 95
@@ -0,0 +1,51 @@
+"""Keyset paging: every row exactly once, in order, whatever the page boundaries and ties."""
+import pytest
+
+@pytest.fixture
+def drugs(db):
+    # Few distinct names, quantities and dates, so page boundaries fall inside runs of ties
+    with db.transaction():
+        for i in range(23):
+            db.add_drug(f'Drug {i % 4}', f'B{i}', f'2030-0{1 + i % 3}-01', 'Acme', i % 5, '')
+    return db
+
+def walk(page, page_size, **options):
+    rows, after, pages = [], None, 0
+    while True:
+        page_rows, after = page(after=after, page_size=page_size, **options)
+        rows.extend(page_rows)
+        pages += 1
+        assert pages <= 100, 'paging does not terminate'
+        if after is None:
+            return rows, pages
+
+def expected_ids(db, sort, descending):
+    key = lambda drug: (drug[sort], drug['drug_id'])
+    return [drug['drug_id'] for drug in sorted(db.get_all_drugs(), key=key, reverse=descending)]
+
+@pytest.mark.parametrize('sort', ['drug_id', 'name', 'expiry_date', 'quantity'])
+@pytest.mark.parametrize('descending', [False, True])
+@pytest.mark.parametrize('page_size', [1, 4, 23, 50])
+def test_pages_cover_every_row_once_in_order(drugs, sort, descending, page_size):
+    db = drugs
+    rows, _ = walk(db.get_drugs_page, page_size, sort=sort, descending=descending)
+    assert [row['drug_id'] for row in rows] == expected_ids(db, sort, descending)
+
+def test_a_full_last_page_ends_the_walk(drugs):
+    rows, pages = walk(drugs.get_drugs_page, 23)
+    assert (len(rows), pages) == (23, 1)  # No empty page after an exactly full one
+    page, after = drugs.get_drugs_page(page_size=22)
+    assert len(page) == 22 and after == (22, 22)
+
+def test_orders_page_on_dates_with_ties(db):
+    db.add_drug('Amoxicillin', 'A1', '2030-01-01', 'Acme', 100, '')
+    db.add_supplier('Acme Supply', 'Ann', '555-0100')
+    for _ in range(7):
+        db.place_order(1, 'Pending', [{'drug_id': 1, 'quantity': 1}])  # All placed today
+    rows, pages = walk(db.get_orders_page, 3, sort='order_date')
+    assert [row['order_id'] for row in rows] == [7, 6, 5, 4, 3, 2, 1]
+    assert pages == 3
+
+def test_unknown_sort_is_rejected(db):
+    with pytest.raises(ValueError):
+        db.get_drugs_page(sort='storage_conditions')
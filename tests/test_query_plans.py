@@ -0,0 +1,39 @@
+"""EXPLAIN QUERY PLAN checks: the report and lookup queries must use an index, not scan."""
+import pytest
+
+REPORT_QUERIES = {
+    'low stock': ('SELECT * FROM Drugs WHERE quantity < ?', (10,), 'idx_drugs_quantity'),
+    'expiring soon': ('SELECT * FROM Drugs WHERE expiry_date < ?', ('2026-01-01',), 'idx_drugs_expiry_date'),
+    'order items by order': ('SELECT * FROM Order_Items WHERE order_id = ?', (1,), 'idx_order_items_order'),
+    'order items by drug': ('SELECT * FROM Order_Items WHERE drug_id = ?', (1,), 'idx_order_items_drug'),
+    'orders of a supplier': ('SELECT * FROM Orders WHERE supplier_id = ? ORDER BY order_date', (1,),
+                             'idx_orders_supplier_date'),
+    'reservations of orders': ("SELECT * FROM Inventory_Ledger WHERE order_id IN (?, ?) AND reason = 'reservation'",
+                               (1, 2), 'idx_ledger_order'),
+}
+
+def query_plan(db, sql, params):
+    with db.get_db_connection() as conn:
+        return [row['detail'] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()]
+
+@pytest.mark.parametrize('name', REPORT_QUERIES)
+def test_report_query_uses_index(db, name):
+    sql, params, index = REPORT_QUERIES[name]
+    plan = query_plan(db, sql, params)
+    assert any(f'USING INDEX {index}' in detail or f'USING COVERING INDEX {index}' in detail
+               for detail in plan), plan
+
+def test_orders_join_uses_supplier_primary_key(db):
+    plan = query_plan(db, '''
+        SELECT o.order_id, o.order_date, s.name as supplier_name, o.status
+        FROM Orders o
+        JOIN Suppliers s ON o.supplier_id = s.supplier_id
+    ''', ())
+    assert any(detail.startswith('SEARCH s USING INTEGER PRIMARY KEY') for detail in plan), plan
+
+def test_migrations_are_idempotent(db):
+    latest = db.MIGRATIONS[-1][0]
+    db.migrate()
+    assert db.get_schema_version() == latest
+    with db.get_db_connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM schema_version').fetchone()[0] == len(db.MIGRATIONS)
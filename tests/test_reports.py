@@ -0,0 +1,64 @@
+"""Report engine: each frame is computed in SQL and must agree with the data it summarises."""
+from datetime import date, timedelta
+
+import pytest
+
+pytest.importorskip('pandas')
+
+import reports
+
+@pytest.fixture
+def history(db):
+    soon = (date.today() + timedelta(days=10)).isoformat()
+    db.add_drug('Amoxicillin', 'A1', soon, 'Acme', 4, '')         # 1
+    db.add_drug('Ibuprofen', 'I1', '2099-01-01', 'Acme', 50, '')  # 2
+    db.add_drug('Zinc', 'Z1', soon, 'Acme', 0, '')                # 3: out of stock
+    db.add_supplier('Acme Supply', 'Ann', '555-0100')
+    db.add_supplier('Beta Pharma', 'Bob', '555-0101')
+    db.set_reorder_threshold('Ibuprofen', 'Acme', 100)
+    first = db.place_order(1, 'Received', [{'drug_id': 1, 'quantity': 6}, {'drug_id': 2, 'quantity': 10}])
+    second = db.place_order(1, 'Pending', [{'drug_id': 2, 'quantity': 20}])
+    third = db.place_order(2, 'Pending', [{'drug_id': 1, 'quantity': 1}])
+    with db.transaction() as conn:
+        conn.execute("UPDATE Orders SET order_date = '2026-09-01' WHERE order_id = ?", (first,))
+        conn.execute("UPDATE Orders SET order_date = '2026-09-15' WHERE order_id IN (?, ?)", (second, third))
+    db.invalidate_cache('Orders')
+    return db
+
+def test_low_stock_is_the_reorder_report(history):
+    frames = reports.run_reports(['low_stock'])
+    assert list(frames) == ['low_stock']
+    expected = [(row['name'], row['shortfall']) for row in history.get_reorder_report()]
+    assert list(zip(frames['low_stock']['name'], frames['low_stock']['shortfall'])) == expected
+    assert expected[0] == ('Ibuprofen', 100 - 60 - 20)
+
+def test_expiring_soon_lists_stocked_batches_only(history):
+    frame = reports.run_reports(['expiring_soon'])['expiring_soon']
+    assert frame['name'].tolist() == ['Amoxicillin']
+    assert frame['quantity'].tolist() == [10]
+
+def test_supplier_volume_and_daily_throughput(history):
+    frames = reports.run_reports(['supplier_volume', 'daily_throughput'])
+    volume = frames['supplier_volume'].set_index('supplier')
+    assert volume.loc['Acme Supply', ['orders', 'lines', 'units', 'pending_units']].tolist() == [2, 3, 36, 20]
+    assert volume.loc['Beta Pharma', ['orders', 'units', 'pending_units']].tolist() == [1, 1, 1]
+    assert volume.index.tolist() == ['Acme Supply', 'Beta Pharma']  # Most units first
+    daily = frames['daily_throughput']
+    assert daily['order_date'].tolist() == ['2026-09-01', '2026-09-15']
+    assert daily['units'].tolist() == [16, 21]
+
+def test_order_reports_cover_the_requested_period(history):
+    frames = reports.run_reports(['supplier_volume', 'daily_throughput'], since='2026-09-10', until='2026-09-30')
+    assert frames['daily_throughput']['order_date'].tolist() == ['2026-09-15']
+    assert frames['supplier_volume']['units'].sum() == 21
+    empty = reports.run_reports(['supplier_volume'], since='2027-01-01', until='2027-01-31')['supplier_volume']
+    assert empty.empty and 'units' in empty.columns
+
+def test_orders_of_deleted_suppliers_are_still_counted(history):
+    history.delete_supplier(2)
+    volume = reports.run_reports(['supplier_volume'])['supplier_volume']
+    assert '(unknown supplier)' in volume['supplier'].tolist()
+
+def test_expiry_buckets_match_the_database_function(history):
+    frame = reports.run_reports(['expiry_buckets'])['expiry_buckets']
+    assert frame.to_dict('records') == history.get_expiry_buckets()
@@ -0,0 +1,31 @@
+"""Search functions: exact order ID lookups and FTS5 prefix matching."""
+
+def add_order(db):
+    db.add_supplier('Acme Pharma', 'orders@acme.example', '1 Main Street')
+    db.add_drug('Amoxicillin', 'B1', '2030-01-01', 'Acme', 100, '')
+    return db.place_order(1, 'Pending', [{'name': 'Amoxicillin', 'quantity': 5}])
+
+def test_search_orders_by_id(db):
+    order_id = add_order(db)
+    assert [row['order_id'] for row in db.search_orders(str(order_id))] == [order_id]
+    assert db.search_orders(str(order_id + 1)) == []
+
+def test_search_orders_by_supplier_prefix(db):
+    order_id = add_order(db)
+    assert [row['order_id'] for row in db.search_orders('acm')] == [order_id]
+
+def test_search_orders_rejects_out_of_range_ids(db):
+    add_order(db)
+    assert db.search_orders('12345678901234567890123') == []
+    assert db.search_orders(str(2 ** 63)) == []
+    assert db.search_orders(str(2 ** 63 - 1)) == []
+
+def test_search_orders_non_ascii_digits(db):
+    add_order(db)
+    assert db.search_orders('²') == []
+    assert db.search_orders('١٢') == []  # Arabic-Indic digits
+
+def test_search_drugs_prefix(db):
+    add_order(db)
+    assert [row['name'] for row in db.search_drugs('amox')] == ['Amoxicillin']
+    assert db.search_drugs('   ') == []
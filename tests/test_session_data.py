@@ -0,0 +1,65 @@
+"""The shared drug picker index: kept in step with Drugs from the change log."""
+import pytest
+
+pytest.importorskip('streamlit')
+pytest.importorskip('pandas')
+
+import session_data
+
+def expected(db):
+    return [tuple(row) for row in db.get_drug_names()]
+
+def actual(index):
+    assert index.names == sorted(index.ids)
+    return [(name, index.ids[name]) for name in index.names]
+
+@pytest.fixture
+def drugs(db):
+    db.add_drug('Ibuprofen', 'I1', '2030-01-01', 'Acme', 50, '')
+    db.add_drug('Amoxicillin', 'A1', '2030-01-01', 'Acme', 100, '')
+    db.add_drug('Amoxicillin', 'A2', '2031-01-01', 'Acme', 20, '')
+    return db
+
+def test_index_matches_the_drug_names_query(drugs):
+    db = drugs
+    names = session_data.DrugNames()
+    assert actual(names.get()) == expected(db)
+    db.add_drug('Cetirizine', 'C1', '2030-01-01', 'Acme', 5, '')
+    db.update_drug(3, 'Zinc', 'A2', '2031-01-01', 'Acme', 20, '')  # Renamed
+    db.delete_drug(2)  # Amoxicillin's first batch
+    assert actual(names.get()) == expected(db)
+    db.delete_drug(1)
+    assert actual(names.get()) == expected(db)
+
+def test_quantity_changes_keep_the_index(drugs, monkeypatch):
+    db = drugs
+    names = session_data.DrugNames()
+    index = names.get()
+    monkeypatch.setattr(db, 'get_drug_names', lambda: pytest.fail('the index was rebuilt'))
+    db.update_inventory(2, -10, 'dispense')
+    assert names.get() is index
+
+def test_new_names_leave_older_indexes_alone(drugs):
+    db = drugs
+    names = session_data.DrugNames()
+    old = names.get()
+    db.add_drug('Cetirizine', 'C1', '2030-01-01', 'Acme', 5, '')
+    new = names.get()
+    assert 'Cetirizine' in new.ids and 'Cetirizine' not in old.ids
+    assert new.names == ['Amoxicillin', 'Cetirizine', 'Ibuprofen']
+
+def test_many_new_names_are_sorted(db):
+    names = session_data.DrugNames()
+    names.get()
+    with db.transaction():
+        for i in range(session_data.MAX_INSERTED_NAMES + 5):
+            db.add_drug(f'Drug {i:04d}', 'B', '2030-01-01', 'Acme', 1, '')
+    assert actual(names.get()) == expected(db)
+
+def test_index_follows_a_reconfigured_database(drugs, tmp_path):
+    db = drugs
+    names = session_data.DrugNames()
+    names.get()
+    db.configure(db_path=str(tmp_path / 'other.db'))
+    db.add_drug('Paracetamol', 'P1', '2030-01-01', 'Acme', 5, '')
+    assert actual(names.get()) == [('Paracetamol', 1)]
@@ -0,0 +1,61 @@
+"""Cached reads must notice writes made by other processes or app nodes sharing the database."""
+import os
+import subprocess
+import sys
+
+import pytest
+
+import backends
+import database
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def write_elsewhere(path, code):
+    """Runs database.py calls in another process, as another app node would."""
+    subprocess.run([sys.executable, '-c', f'import database; database.configure(db_path={path!r}); {code}'],
+                   cwd=REPO, check=True)
+
+@pytest.fixture(params=['sqlite', 'dbapi-sqlite3'])
+def shared_db(request, tmp_path, monkeypatch):
+    path = str(tmp_path / 'shared.db')
+    old_path = database.DB_PATH
+    if request.param == 'sqlite':
+        database.configure(db_path=path)
+        monkeypatch.setattr(database, 'LOCAL_VERSION_CHECK_INTERVAL', 0.0)
+    else:
+        database.configure(backend=backends.DBAPIBackend('sqlite3', path, check_same_thread=False))
+    yield database, path
+    database.configure(db_path=old_path)
+
+def test_cached_reads_see_writes_from_other_nodes(shared_db):
+    db, path = shared_db
+    db.add_drug('Aspirin', 'B1', '2030-01-01', 'Maker', 50, '')
+    assert db.count_drugs() == 1
+    assert db.count_drugs() == 1 and db.cache_stats()['hits'] == 1
+    write_elsewhere(path, "database.add_drug('Ibuprofen', 'B2', '2030-01-01', 'Maker', 5, '')")
+    assert db.count_drugs() == 2
+    assert [row['name'] for row in db.get_low_stock_drugs()] == ['Ibuprofen']
+    write_elsewhere(path, "database.update_inventory(1, -45)")
+    assert sorted(row['name'] for row in db.get_low_stock_drugs()) == ['Aspirin', 'Ibuprofen']
+
+def test_generations_change_on_writes_from_other_nodes(shared_db):
+    db, path = shared_db
+    db.add_supplier('Acme', 'c', 'a')
+    generation = db.get_table_generation('Suppliers')
+    assert db.get_table_generation('Suppliers') == generation
+    write_elsewhere(path, "database.add_supplier('Beta', 'c', 'a')")
+    assert db.get_table_generation('Suppliers') != generation
+
+def test_local_sqlite_checks_at_most_once_per_interval(tmp_path, monkeypatch):
+    old_path = database.DB_PATH
+    database.configure(db_path=str(tmp_path / 'local.db'))
+    try:
+        monkeypatch.setattr(database, 'LOCAL_VERSION_CHECK_INTERVAL', 3600.0)
+        database.add_drug('Aspirin', 'B1', '2030-01-01', 'Maker', 50, '')
+        assert database.count_drugs() == 1
+        write_elsewhere(str(tmp_path / 'local.db'), "database.add_drug('Ibuprofen', 'B2', '2030-01-01', 'Maker', 5, '')")
+        assert database.count_drugs() == 1  # Not checked again yet
+        monkeypatch.setattr(database, 'LOCAL_VERSION_CHECK_INTERVAL', 0.0)
+        assert database.count_drugs() == 2
+    finally:
+        database.configure(db_path=old_path)
@@ -0,0 +1,89 @@
+"""Stock_Levels: the trigger-maintained aggregate must always equal a recompute from its tables."""
+import random
+
+import pytest
+
+RECOMPUTE = '''
+    SELECT d.name, d.manufacturer, SUM(d.quantity) AS on_hand,
+           MIN(CASE WHEN d.quantity > 0 THEN d.expiry_date END) AS earliest_expiry,
+           (SELECT COALESCE(SUM(oi.quantity), 0)
+            FROM Drugs d2
+            JOIN Order_Items oi ON oi.drug_id = d2.drug_id
+            JOIN Orders o ON o.order_id = oi.order_id
+            WHERE d2.name = d.name AND d2.manufacturer = d.manufacturer AND o.status = 'Pending') AS pending_inbound
+    FROM Drugs d
+    GROUP BY d.name, d.manufacturer
+'''
+
+def assert_consistent(db):
+    with db.get_db_connection() as conn:
+        expected = {(row[0], row[1]): tuple(row[2:]) for row in conn.execute(RECOMPUTE).fetchall()}
+    actual = {(row['name'], row['manufacturer']): (row['on_hand'], row['earliest_expiry'], row['pending_inbound'])
+              for row in db.get_stock_levels()}
+    for product, values in actual.items():
+        # Products whose batches are all gone keep an empty row (and their threshold)
+        assert values == expected.get(product, (0, None, 0)), product
+    assert set(expected) <= set(actual)
+
+@pytest.fixture
+def supplied(db):
+    db.add_supplier('Acme Supply', 'Ann', '555-0100')
+    return db
+
+def test_batches_and_orders_update_the_product_row(supplied):
+    db = supplied
+    db.add_drug('Amoxicillin', 'A1', '2030-06-01', 'Acme', 10, '')
+    db.add_drug('Amoxicillin', 'A2', '2030-01-01', 'Acme', 0, '')  # Out of stock: not the earliest expiry
+    order_id = db.place_order(1, 'Pending', [{'drug_id': 1, 'quantity': 5}, {'drug_id': 2, 'quantity': 7}])
+    [level] = db.get_stock_levels()
+    assert (level['on_hand'], level['earliest_expiry'], level['pending_inbound']) == (10, '2030-06-01', 12)
+    db.receive_orders([order_id])
+    [level] = db.get_stock_levels()
+    assert (level['on_hand'], level['earliest_expiry'], level['pending_inbound']) == (22, '2030-01-01', 0)
+    assert_consistent(db)
+
+def test_renamed_batches_move_between_products(supplied):
+    db = supplied
+    db.add_drug('Amoxicillin', 'A1', '2030-06-01', 'Acme', 10, '')
+    db.add_drug('Amoxicillin', 'A2', '2030-01-01', 'Acme', 4, '')
+    db.place_order(1, 'Pending', [{'drug_id': 2, 'quantity': 3}])
+    db.update_drug(2, 'Amoxicillin', 'A2', '2030-01-01', 'Generic Co', 4, '')
+    assert_consistent(db)
+    levels = {(level['name'], level['manufacturer']): level for level in db.get_stock_levels()}
+    assert levels[('Amoxicillin', 'Acme')]['earliest_expiry'] == '2030-06-01'
+    assert levels[('Amoxicillin', 'Generic Co')]['pending_inbound'] == 3
+
+def test_random_workload_matches_a_recompute(supplied):
+    db = supplied
+    rng = random.Random(20261017)
+    names, manufacturers = ['Amoxicillin', 'Ibuprofen', 'Zinc'], ['Acme', 'Generic Co']
+    expiry = lambda: f'2030-{rng.randint(1, 12):02d}-01'
+    pending = []
+    for step in range(300):
+        drugs = [drug['drug_id'] for drug in db.get_all_drugs()]
+        action = rng.choice(['add', 'add', 'update', 'adjust', 'delete', 'order', 'receive', 'cancel', 'dispense'])
+        try:
+            if action == 'add' or not drugs:
+                db.add_drug(rng.choice(names), f'B{step}', expiry(), rng.choice(manufacturers), rng.randint(0, 20), '')
+            elif action == 'update':
+                drug = db.get_all_drugs()[rng.randrange(len(drugs))]
+                db.update_drug(drug['drug_id'], rng.choice([drug['name']] * 3 + names), drug['batch_number'],
+                               rng.choice([drug['expiry_date'], expiry()]),
+                               rng.choice([drug['manufacturer']] * 3 + manufacturers), rng.randint(0, 20), '')
+            elif action == 'adjust':
+                db.update_inventory(rng.choice(drugs), rng.randint(-5, 5))
+            elif action == 'delete':
+                db.delete_drug(rng.choice(drugs))
+            elif action == 'order':
+                items = [{'drug_id': rng.choice(drugs), 'quantity': rng.randint(1, 5)} for _ in range(rng.randint(1, 3))]
+                order_id = db.place_order(1, rng.choice(['Pending', 'Pending', 'Received']), items,
+                                          reserve_stock=rng.random() < 0.3)
+                pending.append(order_id)
+            elif action in ('receive', 'cancel') and pending:
+                order_id = pending.pop(rng.randrange(len(pending)))
+                (db.receive_orders if action == 'receive' else db.cancel_orders)([order_id])
+            elif action == 'dispense':
+                db.allocate_fefo(rng.choice(names), rng.randint(1, 8), include_expired=True)
+        except ValueError:
+            pass  # Not enough stock, an already finished order: the write changed nothing
+        assert_consistent(db)
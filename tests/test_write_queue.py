@@ -0,0 +1,45 @@
+"""Group commits: queued writes share a transaction, but a failing call only rolls back itself."""
+import pytest
+
+from write_queue import WriteQueue
+
+@pytest.fixture
+def writes(db):
+    queue = WriteQueue(max_batch=16, max_latency=0.2)  # Long enough for every submit below to join one batch
+    yield queue
+    queue.close()
+
+def add(db, name, quantity=10):
+    return lambda: db.add_drug(name, 'B1', '2030-01-01', 'Acme', quantity, '')
+
+def test_batch_mates_survive_a_failing_call(db, writes):
+    def add_then_fail():
+        db.add_drug('Doomed', 'B1', '2030-01-01', 'Acme', 5, '')
+        db.update_inventory(1, -3)
+        raise RuntimeError('rejected after writing')
+    futures = [writes.submit(add(db, 'Amoxicillin')), writes.submit(add_then_fail),
+               writes.submit(add(db, 'Ibuprofen')), writes.submit(db.add_user, 'ann', 'secret')]
+    futures[0].result(timeout=10)
+    with pytest.raises(RuntimeError, match='rejected after writing'):
+        futures[1].result(timeout=10)
+    assert futures[3].result(timeout=10) is True
+    assert [drug['name'] for drug in db.get_all_drugs()] == ['Amoxicillin', 'Ibuprofen']
+    assert db.get_all_drugs()[0]['quantity'] == 10  # The failed call's update was rolled back too
+    stats = writes.stats()
+    assert (stats['mutations'], stats['commits'], stats['failed']) == (3, 1, 1)
+
+def test_results_and_errors_reach_their_callers(db, writes):
+    assert writes.submit(db.add_supplier, 'Acme Supply', 'Ann', '555-0100').result(timeout=10) is None
+    with pytest.raises(ValueError):
+        writes.submit(db.place_order, 1, 'Pending', [{'name': 'No such drug', 'quantity': 1}]).result(timeout=10)
+    order_id = writes.submit(db.place_order, 1, 'Pending', []).result(timeout=10)
+    assert db.get_all_orders()[0]['order_id'] == order_id
+
+def test_close_drains_the_queue_and_refuses_more(db, writes):
+    futures = [writes.submit(add(db, f'Drug {i}')) for i in range(40)]  # More than one batch
+    writes.close()
+    assert all(future.done() and future.exception() is None for future in futures)
+    assert db.count_drugs() == 40
+    assert writes.stats()['commits'] >= 3
+    with pytest.raises(RuntimeError):
+        writes.submit(add(db, 'Late'))
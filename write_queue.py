@@ -0,0 +1,125 @@
+"""Background writer that batches database mutations into group commits.
+
+Callers hand a database.py write function to submit_write() and get a
+concurrent.futures.Future back. A single writer thread collects queued calls
+for up to WRITE_MAX_LATENCY seconds (or WRITE_MAX_BATCH calls) and runs them
+all in one transaction, so many small writes share one commit and the
+writers never compete for SQLite's lock.
+
+    future = submit_write(add_drug, 'Aspirin', 'B12', '2027-01-31', 'Bayer', 100, '')
+    future.result()  # Waits for the commit; re-raises the function's error
+"""
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import database
+
+WRITE_MAX_BATCH = 64        # Most mutations committed together
+WRITE_MAX_LATENCY = 0.005   # Seconds the first queued mutation may wait for others to join it
+
+class WriteQueue:
+    """A queue of mutations drained by one writer thread in group commits."""
+
+    def __init__(self, max_batch=WRITE_MAX_BATCH, max_latency=WRITE_MAX_LATENCY):
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self._queue = queue.Queue()
+        self._closed = False
+        self._stats = {'mutations': 0, 'commits': 0, 'failed': 0}
+        self._thread = threading.Thread(target=self._run, name='database-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        """Queues func(*args, **kwargs) and returns a Future for its result."""
+        if self._closed:
+            raise RuntimeError('The write queue has been closed')
+        future = Future()
+        self._queue.put((func, args, kwargs, future))
+        return future
+
+    def _next_batch(self):
+        """Blocks for the first mutation, then gathers more until the batch is full or time is up."""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # Finish this batch, then stop
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        """Writer thread: runs each batch in one transaction, isolating calls with savepoints."""
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            results = []
+            try:
+                with database.transaction(immediate=True) as conn:
+                    for func, args, kwargs, future in batch:
+                        if not future.set_running_or_notify_cancel():
+                            continue
+                        # A failing call is rolled back alone; the rest of the batch still commits
+                        conn.execute('SAVEPOINT queued_write')
+                        try:
+                            result = func(*args, **kwargs)
+                        except Exception as e:
+                            conn.execute('ROLLBACK TO queued_write')
+                            conn.execute('RELEASE queued_write')
+                            future.set_exception(e)
+                            self._stats['failed'] += 1
+                        else:
+                            conn.execute('RELEASE queued_write')
+                            results.append((future, result))
+            except Exception as e:
+                # BEGIN or COMMIT failed, so none of the batch was written
+                for _, _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                self._stats['failed'] += len(results)
+                continue
+            for future, result in results:
+                future.set_result(result)
+            self._stats['mutations'] += len(results)
+            self._stats['commits'] += 1
+
+    def stats(self):
+        """Returns mutation, commit and failure counts plus the current queue length."""
+        stats = dict(self._stats, queued=self._queue.qsize())
+        stats['mutations_per_commit'] = stats['mutations'] / stats['commits'] if stats['commits'] else 0.0
+        return stats
+
+    def close(self):
+        """Stops accepting mutations, lets the writer finish what is queued and waits for it."""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+
+_write_queue = None
+_write_queue_lock = threading.Lock()
+
+def get_write_queue():
+    """Returns the process-wide write queue, starting its writer thread on first use."""
+    global _write_queue
+    with _write_queue_lock:
+        if _write_queue is None:
+            _write_queue = WriteQueue()
+            atexit.register(_write_queue.close)
+        return _write_queue
+
+def submit_write(func, *args, **kwargs):
+    """Queues a database write function call and returns a Future for its result."""
+    return get_write_queue().submit(func, *args, **kwargs)